@@ -0,0 +1,334 @@
+import argparse
+import ast
+import contextlib
+import itertools
+import json
+import math
+import multiprocessing
+import random
+import statistics
+import time
+
+import numpy as np
+
+import main
+from main import (
+    GAME_STATE_GAME_OVER,
+    GAME_STATE_LEVEL_UP,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    WORLD_HEIGHT,
+    WORLD_WIDTH,
+    InputState,
+    Simulation,
+)
+
+# ボットに何千回も遊ばせて、定数の調整を評価するバランス調整用ランナー
+# 例: uv run balance.py --runs 200 --set ENEMY_HP=40,50,60 \
+#         --policy random --policy damage
+#   --set で指定した値の全ての組み合わせ x --policy x --bot ごとに --runs 回遊ばせて、
+#   生存時間・到達レベル・フェーズごとの撃破数の表を出すでやんす
+#   同じ設定の中では run ごとにシードを変え、設定どうしでは同じシードの組を使う
+
+KITE_RADIUS = 48 # この距離より近い敵から離れるように動く
+
+
+# --- アビリティの選び方 (レベルアップ時の選択肢 choices から選ぶ番号を返す) ---
+
+def pick_first(choices, rng):
+    return 0
+
+
+def pick_random(choices, rng):
+    return rng.randrange(len(choices))
+
+
+def pick_by_priority(priority):
+    # priority の前にあるアビリティほど優先して選ぶ
+    def pick(choices, rng):
+        ranks = [
+            priority.index(a.name) if a.name in priority else len(priority)
+            for a in choices
+        ]
+        return ranks.index(min(ranks))
+
+    return pick
+
+
+PICK_POLICIES = {
+    "first": pick_first,
+    "random": pick_random,
+    "damage": pick_by_priority(
+        [
+            "Bullet Damage Up",
+            "Bullet Fire Rate Up",
+            "Piercing Shot",
+            "Summon Ghost",
+            "Auto-aim Bullet",
+            "Bullet Speed Up",
+        ]
+    ),
+    "survival": pick_by_priority(
+        ["Max HP Up", "Move Speed Up", "Summon Ghost", "Bullet Fire Rate Up"]
+    ),
+}
+
+
+# --- ボット (Simulation の状態を見て InputState を作る入力ソース) ---
+
+class TurretBot:
+    # その場から動かず、一番近い敵を狙って撃ち続けるボット
+    def __init__(self, sim, pick_policy, seed):
+        self.sim = sim
+        self.pick_policy = pick_policy
+        # sim.rng とは別にする (ボットがゲームの乱数をずらさないように)
+        self.rng = random.Random(seed)
+        self.pending_choice = None
+
+    def poll(self):
+        sim = self.sim
+        if sim.game_state == GAME_STATE_LEVEL_UP:
+            return self.menu_inputs()
+        self.pending_choice = None
+        if sim.game_state == GAME_STATE_GAME_OVER:
+            return InputState()
+        inputs = InputState(fire=True)
+        self.aim(inputs)
+        self.move(inputs)
+        return inputs
+
+    def menu_inputs(self):
+        # 選ぶ番号までカーソルを下に動かしてから決定する
+        sim = self.sim
+        if self.pending_choice is None:
+            self.pending_choice = self.pick_policy(
+                sim.selected_abilities_for_level_up, self.rng
+            )
+        if sim.current_ability_selection_index != self.pending_choice:
+            return InputState(menu_down=True)
+        return InputState(confirm=True)
+
+    def nearby_enemies(self):
+        # プレイヤーの中心から見た、生きている敵の中心の相対座標
+        sim = self.sim
+        enemies = sim.enemies
+        n = enemies.count
+        alive = enemies.active[:n]
+        half = enemies.size[:n][alive] / 2
+        dx = enemies.x[:n][alive] + half - (sim.player_x + sim.player_width / 2)
+        dy = enemies.y[:n][alive] + half - (sim.player_y + sim.player_height / 2)
+        return dx, dy
+
+    def aim(self, inputs):
+        sim = self.sim
+        dx, dy = self.nearby_enemies()
+        if len(dx) == 0:
+            inputs.mouse_x, inputs.mouse_y = SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2
+            return
+        i = int(np.argmin(dx * dx + dy * dy))
+        # マウス座標は画面の座標で渡す
+        inputs.mouse_x = sim.player_x + dx[i] - sim.camera.x
+        inputs.mouse_y = sim.player_y + dy[i] - sim.camera.y
+
+    def move(self, inputs):
+        pass
+
+
+class KiteBot(TurretBot):
+    # 撃ちながら、近くの敵の反対側へ逃げるボット
+    # 近くに敵がいなければ一番近い経験値オーブを拾いに行き、
+    # それもなければワールドの中央へ戻る
+    def move(self, inputs):
+        sim = self.sim
+        dx, dy = self.nearby_enemies()
+        near = dx * dx + dy * dy < KITE_RADIUS * KITE_RADIUS
+        if near.any():
+            move_x = -float(dx[near].sum())
+            move_y = -float(dy[near].sum())
+        elif sim.exp_orbs:
+            orb = min(
+                sim.exp_orbs,
+                key=lambda o: (o.x - sim.player_x) ** 2 + (o.y - sim.player_y) ** 2,
+            )
+            move_x = orb.x - sim.player_x
+            move_y = orb.y - sim.player_y
+        else:
+            move_x = WORLD_WIDTH / 2 - sim.player_x
+            move_y = WORLD_HEIGHT / 2 - sim.player_y
+        inputs.left = move_x < -1
+        inputs.right = move_x > 1
+        inputs.up = move_y < -1
+        inputs.down = move_y > 1
+
+
+BOTS = {
+    "turret": TurretBot,
+    "kite": KiteBot,
+}
+
+
+@contextlib.contextmanager
+def overridden_constants(overrides):
+    # main モジュールの定数を一時的に書き換える (ワーカーは使い回されるので必ず元に戻す)
+    originals = {name: getattr(main, name) for name in overrides}
+    try:
+        for name, value in overrides.items():
+            setattr(main, name, value)
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(main, name, value)
+
+
+def run_one(task):
+    # 1回のランを最後まで (ゲームオーバーか max_frames まで) 遊ばせて結果を返す
+    overrides = dict(task["overrides"])
+    with overridden_constants(overrides):
+        sim = Simulation(seed=task["seed"])
+        bot = BOTS[task["bot"]](sim, PICK_POLICIES[task["policy"]], task["seed"])
+        while (
+            sim.game_state != GAME_STATE_GAME_OVER
+            and sim.clock.frame_count < task["max_frames"]
+        ):
+            sim.step(bot.poll())
+    died = sim.game_state == GAME_STATE_GAME_OVER
+    return {
+        "overrides": task["overrides"],
+        "policy": task["policy"],
+        "bot": task["bot"],
+        "seed": task["seed"],
+        "died": died,
+        "survived_frames": sim.final_time if died else sim.clock.frame_count,
+        "level": sim.player_level,
+        "kills_by_phase": {
+            str(phase): n for phase, n in sorted(sim.kills_by_phase.items())
+        },
+    }
+
+
+def config_key(result):
+    return (tuple(map(tuple, result["overrides"])), result["policy"], result["bot"])
+
+
+def config_label(key):
+    overrides, policy, bot = key
+    settings = " ".join(f"{name}={value}" for name, value in overrides)
+    return f"{settings} {policy}/{bot}".strip()
+
+
+def aggregate(results):
+    # 設定ごとに集計した行 (表示順は設定のラベル順)
+    groups = {}
+    for result in results:
+        groups.setdefault(config_key(result), []).append(result)
+    rows = []
+    for key in sorted(groups, key=config_label):
+        group = groups[key]
+        seconds = [r["survived_frames"] / main.SIM_FPS for r in group]
+        phases = sorted({int(p) for r in group for p in r["kills_by_phase"]})
+        rows.append(
+            {
+                "config": config_label(key),
+                "runs": len(group),
+                "died": sum(r["died"] for r in group) / len(group),
+                "survival_mean": statistics.fmean(seconds),
+                "survival_p50": statistics.median(seconds),
+                "level_mean": statistics.fmean(r["level"] for r in group),
+                "kills_by_phase": {
+                    phase: statistics.fmean(
+                        r["kills_by_phase"].get(str(phase), 0) for r in group
+                    )
+                    for phase in phases
+                },
+            }
+        )
+    return rows
+
+
+def print_table(rows):
+    width = max([len(row["config"]) for row in rows] + [6])
+    print(f"{'config':<{width}}  runs  died  surv(s) p50(s)  level  kills by phase")
+    for row in rows:
+        kills = " ".join(f"p{p}:{n:.1f}" for p, n in row["kills_by_phase"].items())
+        print(
+            f"{row['config']:<{width}}  {row['runs']:4}  {row['died']:4.0%}"
+            f"  {row['survival_mean']:7.1f} {row['survival_p50']:6.1f}"
+            f"  {row['level_mean']:5.1f}  {kills}"
+        )
+
+
+def parse_override(text):
+    # "ENEMY_HP=40,50,60" -> ("ENEMY_HP", [40, 50, 60])
+    name, _, values = text.partition("=")
+    if not name.isupper() or not hasattr(main, name):
+        raise argparse.ArgumentTypeError(f"unknown constant: {name}")
+    return name, [ast.literal_eval(v) for v in values.split(",")]
+
+
+def build_tasks(args):
+    names = [name for name, _ in args.set]
+    value_lists = [values for _, values in args.set]
+    tasks = []
+    for values in itertools.product(*value_lists):
+        overrides = [list(pair) for pair in zip(names, values)]
+        for policy in args.policy or ["random"]:
+            for bot in args.bot or ["kite"]:
+                for i in range(args.runs):
+                    tasks.append(
+                        {
+                            "overrides": overrides,
+                            "policy": policy,
+                            "bot": bot,
+                            "seed": args.seed + i,
+                            "max_frames": int(args.max_minutes * 60 * main.SIM_FPS),
+                        }
+                    )
+    return tasks
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Monte Carlo balance runner.")
+    parser.add_argument("--runs", type=int, default=100, help="runs per configuration")
+    parser.add_argument("--set", type=parse_override, action="append", default=[])
+    parser.add_argument("--policy", action="append", choices=sorted(PICK_POLICIES))
+    parser.add_argument("--bot", action="append", choices=sorted(BOTS))
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run")
+    parser.add_argument("--max-minutes", type=float, default=10.0)
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--out", help="append each run as a JSON line to this file")
+    parser.add_argument(
+        "--report-every",
+        type=int,
+        default=0,
+        help="print the partial table every N runs",
+    )
+    args = parser.parse_args()
+
+    tasks = build_tasks(args)
+    report_every = args.report_every or max(1, math.ceil(len(tasks) / 10))
+    results = []
+    out = open(args.out, "a") if args.out else None
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(args.jobs) as pool:
+            # 1ランが数秒かかるので、1個ずつ配って終わった順に受け取る
+            for result in pool.imap_unordered(run_one, tasks):
+                results.append(result)
+                if out is not None:
+                    out.write(json.dumps(result) + "\n")
+                    out.flush()
+                if len(results) % report_every == 0 and len(results) < len(tasks):
+                    elapsed = time.perf_counter() - start
+                    print(f"--- {len(results)}/{len(tasks)} runs ({elapsed:.1f}s)")
+                    print_table(aggregate(results))
+    finally:
+        if out is not None:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"=== {len(results)} runs in {elapsed:.1f}s on {args.jobs} processes")
+    print_table(aggregate(results))
+
+
+if __name__ == "__main__":
+    main_cli()
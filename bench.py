@@ -0,0 +1,551 @@
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyxel
+
+from events import EventLog
+from main import (
+    ALL_ABILITIES,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    WORLD_HEIGHT,
+    WORLD_WIDTH,
+    BulletFireRateUp,
+    FrameView,
+    GameRenderer,
+    Ghost,
+    InputState,
+    PiercingShotAbility,
+    Simulation,
+    spawn_enemy,
+)
+from stats import STAT_BULLET_DAMAGE, STAT_MAX_HP, STAT_SHOT_INTERVAL
+from vecenv import VectorEnv
+from vecmath import (
+    SIN_COS,
+    normalize,
+    step_towards,
+    turn_limit,
+    turn_towards,
+)
+
+# フレームループのベンチマーク
+#   uv run bench.py                  全シナリオを計測し、ベースラインと比べる
+#   uv run bench.py --save-baseline  計測結果をベースラインとして保存する
+#   uv run bench.py -s orbs_5000     シナリオを指定して計測する
+#   uv run bench.py --kernels        vecmath の計算を、三角関数を使う前のやり方と
+#                                    1体あたりで比べる
+#   uv run bench.py --events ev.jsonl  イベントログを記録しながら計測する
+#                                      (記録しないときと比べる用)
+#   uv run bench.py --pipelined      更新と描画を順番に動かすときと、
+#                                    別スレッドで重ねるときの1フレームを比べる
+#   uv run bench.py --vector         VectorEnv のゲームの数ごとに、
+#                                    1秒に進められるステップ数を測る
+# ベースラインより threshold 以上遅くなったシナリオがあれば終了コード1で終わる
+# リポジトリの bench_baseline.json は、計測したマシンを "machine" に書いてある
+# (1コアの Xeon の VM)
+# 速さはマシンで変わるので、
+# 違うマシンで比べるときは先に --save-baseline で作り直すでやんす
+
+BASELINE_PATH = "bench_baseline.json"
+# ベースラインのうち、シナリオではなく計測したマシンの情報を入れるキー
+MACHINE_KEY = "machine"
+DEFAULT_THRESHOLD = 0.15 # 15%以上遅くなったら遅くなったとみなす
+BENCH_SEED = 1234
+SPREAD_RADIUS = 320 # setup_spread_4000_enemies で敵を置く範囲 (プレイヤーからの距離)
+
+
+def make_invincible(sim):
+    # 計測中にゲームオーバーにならないようにする
+    sim.stats.set_base(STAT_MAX_HP, 10**9)
+    sim.player_hp = sim.stats.get(STAT_MAX_HP)
+
+
+def scatter_enemies(sim, count, phase):
+    # フェーズ phase の敵を count 体、画面内のランダムな位置に置く
+    camera = sim.camera
+    for _ in range(count):
+        spawn_enemy(sim.enemies, camera.x, camera.y, phase, sim.rng)
+    n = sim.enemies.count
+    sim.enemies.x[:n] = [camera.x + sim.rng.uniform(0, SCREEN_WIDTH) for _ in range(n)]
+    sim.enemies.y[:n] = [camera.y + sim.rng.uniform(0, SCREEN_HEIGHT) for _ in range(n)]
+
+
+def circling_inputs(frame):
+    # プレイヤーの周りを回る照準で撃ち続け、レベルアップしたら一番上を選ぶ
+    angle = frame * 0.1
+    return InputState(
+        left=(frame // 60) % 2 == 0,
+        right=(frame // 60) % 2 == 1,
+        fire=True,
+        mouse_x=SCREEN_WIDTH / 2 + 100 * math.cos(angle),
+        mouse_y=SCREEN_HEIGHT / 2 + 100 * math.sin(angle),
+        confirm=True,
+    )
+
+
+def setup_phase10_2000_enemies(sim):
+    sim.current_phase = 10
+    scatter_enemies(sim, 2000, 10)
+
+
+def setup_spread_4000_enemies(sim):
+    # 画面の外 (休眠しない範囲) まで広く敵を散らばらせる
+    # (遠い敵の更新の間引きを計測する)
+    sim.current_phase = 3
+    camera = sim.camera
+    for _ in range(4000):
+        spawn_enemy(sim.enemies, camera.x, camera.y, 3, sim.rng)
+    n = sim.enemies.count
+    center_x = sim.player_x
+    center_y = sim.player_y
+    sim.enemies.x[:n] = [
+        center_x + sim.rng.uniform(-SPREAD_RADIUS, SPREAD_RADIUS) for _ in range(n)
+    ]
+    sim.enemies.y[:n] = [
+        center_y + sim.rng.uniform(-SPREAD_RADIUS, SPREAD_RADIUS) for _ in range(n)
+    ]
+
+
+def setup_piercing5_max_fire_rate(sim):
+    for _ in range(5):
+        PiercingShotAbility().apply_effect(sim)
+    # 毎フレーム撃てるところまで発射レートを上げる
+    while sim.stats.get(STAT_SHOT_INTERVAL) > 1:
+        BulletFireRateUp().apply_effect(sim)
+    scatter_enemies(sim, 500, 5)
+    # 弾が当たり続けるように倒れないようにする
+    sim.enemies.hp[: sim.enemies.count] = 10**9
+
+
+def setup_projectiles_20000(sim):
+    # 弾幕の武器を全部最大レベルにし、ワールド中に2万発のゆっくり飛ぶ弾をばらまく
+    # (画面の中の敵には、そのうち画面の中にある千数百発が当たり続ける)
+    sim.spread_level = 3
+    sim.nova_level = 5
+    sim.orbit_level = 4
+    sim.chain_level = 3
+    scatter_enemies(sim, 1000, 3)
+    # 弾が当たり続けるように倒れないようにする
+    sim.enemies.hp[: sim.enemies.count] = 10**9
+    for _ in range(200):
+        sim.projectiles.nova(
+            sim.rng.uniform(0, WORLD_WIDTH),
+            sim.rng.uniform(0, WORLD_HEIGHT),
+            100,
+            0.2,
+            3,
+            1,
+            10**6,
+            pierce_level=10**6,
+        )
+
+
+def setup_ghosts_20(sim):
+    for _ in range(20):
+        sim.ghosts.append(
+            Ghost(
+                sim.player_x, sim.player_y, sim.stats.get(STAT_BULLET_DAMAGE), sim.rng
+            )
+        )
+    scatter_enemies(sim, 1000, 3)
+
+
+def setup_orbs_5000(sim):
+    for _ in range(5000):
+        orb = sim.orb_pool.acquire(
+            sim.camera.x + sim.rng.uniform(0, SCREEN_WIDTH),
+            sim.camera.y + sim.rng.uniform(0, SCREEN_HEIGHT),
+            1,
+        )
+        orb.life = 10**9 # 計測中に消えないようにする
+        sim.add_exp_orb(orb)
+
+
+SCENARIOS = {
+    "phase10_2000_enemies": setup_phase10_2000_enemies,
+    "spread_4000_enemies": setup_spread_4000_enemies,
+    "piercing5_max_fire_rate": setup_piercing5_max_fire_rate,
+    "projectiles_20000": setup_projectiles_20000,
+    "ghosts_20": setup_ghosts_20,
+    "orbs_5000": setup_orbs_5000,
+}
+
+
+def build_scenario(name):
+    sim = Simulation(seed=BENCH_SEED)
+    make_invincible(sim)
+    SCENARIOS[name](sim)
+    return sim
+
+
+def percentiles(samples):
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {"p50": round(p50, 4), "p95": round(p95, 4), "p99": round(p99, 4)}
+
+
+def run_scenario(name, frames, warmup, events_path=None):
+    # 1回目: 時間だけを計測する (tracemalloc は遅くなるので使わない)
+    # events_path を渡すと、1回目だけイベントログをそのファイルに記録する
+    sim = build_scenario(name)
+    events = None
+    if events_path:
+        events = EventLog(
+            events_path,
+            binary=events_path.endswith(".bin"),
+            ability_names=[ability.name for ability in ALL_ABILITIES],
+        )
+        sim.events = events
+    renderer = GameRenderer(pyxel.Image(SCREEN_WIDTH, SCREEN_HEIGHT))
+    update_times = []
+    draw_times = []
+    gc_before = gc.get_stats()[0]["collections"]
+    for frame in range(warmup + frames):
+        inputs = circling_inputs(frame)
+        start = time.perf_counter()
+        sim.step(inputs)
+        mid = time.perf_counter()
+        renderer.draw(sim)
+        end = time.perf_counter()
+        if frame >= warmup:
+            update_times.append(mid - start)
+            draw_times.append(end - mid)
+    gc_collections = gc.get_stats()[0]["collections"] - gc_before
+    if events is not None:
+        events.close()
+
+    # 2回目: メモリの確保量とピークを計測する
+    sim = build_scenario(name)
+    renderer = GameRenderer(pyxel.Image(SCREEN_WIDTH, SCREEN_HEIGHT))
+    for frame in range(warmup):
+        sim.step(circling_inputs(frame))
+        renderer.draw(sim)
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    for frame in range(warmup, warmup + frames):
+        sim.step(circling_inputs(frame))
+        renderer.draw(sim)
+    blocks_after = sys.getallocatedblocks()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "frames": frames,
+        "update_ms": percentiles(update_times),
+        "draw_ms": percentiles(draw_times),
+        "total_ms": percentiles(np.add(update_times, draw_times)),
+        "gc_gen0_per_1k_frames": round(gc_collections * 1000 / frames, 2),
+        "net_blocks_per_frame": round((blocks_after - blocks_before) / frames, 2),
+        "peak_kib": round(peak / 1024, 1),
+        "enemies": sim.enemies.count,
+        "bullets": len(sim.bullets) + len(sim.homing_bullets) + sim.projectiles.count,
+        "orbs": len(sim.exp_orbs),
+        "events": events.emitted if events is not None else 0,
+    }
+
+
+def run_pipelined(name, frames, warmup):
+    # App(pipelined=True) と同じ流れ
+    # (ワーカーが次のフレームを進めて写し取る間に、前のフレームを描く)
+    # と、順番に動かす流れとで、1フレームにかかる時間を比べる
+    results = {}
+    for pipelined in (False, True):
+        sim = build_scenario(name)
+        renderer = GameRenderer(pyxel.Image(SCREEN_WIDTH, SCREEN_HEIGHT))
+        views = [FrameView(), FrameView()]
+        views[0].capture(sim)
+        worker = ThreadPoolExecutor(max_workers=1)
+
+        def run_tick(frame):
+            sim.step(circling_inputs(frame))
+            views[1].capture(sim)
+
+        frame_times = []
+        for frame in range(warmup + frames):
+            start = time.perf_counter()
+            if pipelined:
+                job = worker.submit(run_tick, frame)
+                renderer.draw_view(views[0])
+                job.result()
+            else:
+                run_tick(frame)
+                renderer.draw_view(views[1])
+            views.reverse()
+            if frame >= warmup:
+                frame_times.append(time.perf_counter() - start)
+        worker.shutdown()
+        results["pipelined" if pipelined else "sequential"] = percentiles(frame_times)
+    return results
+
+
+def print_pipelined(name, results):
+    s = results["sequential"]
+    p = results["pipelined"]
+    print(
+        f"{name:<26} frame p50/p95 sequential {s['p50']:7.3f}/{s['p95']:7.3f} ms"
+        f"  pipelined {p['p50']:7.3f}/{p['p95']:7.3f} ms"
+        f"  ({s['p50'] / p['p50']:.2f}x)"
+    )
+
+
+VECTOR_ENV_COUNTS = (1, 4, 16, 64)
+
+
+def run_vector(frames, warmup):
+    # 全部のゲームで撃ちながら、ゲームごとに違う向きにぐるぐる回る
+    # 観測の書き込み (write_observations) にかかった時間も別に測る
+    results = {}
+    for num_envs in VECTOR_ENV_COUNTS:
+        env = VectorEnv(num_envs, seed=BENCH_SEED)
+        env.reset()
+        env.actions["fire"] = True
+        env.actions["ability"] = 0
+        offsets = np.arange(num_envs) * (2 * math.pi / num_envs)
+        write_time = 0.0
+        for frame in range(warmup + frames):
+            if frame == warmup:
+                start = time.perf_counter()
+                write_time = 0.0
+            angle = offsets + frame * 0.05
+            env.actions["move_x"] = np.rint(np.cos(angle))
+            env.actions["move_y"] = np.rint(np.sin(angle))
+            env.actions["aim"] = angle
+            env.step()
+            write_start = time.perf_counter()
+            env.write_observations()
+            write_time += time.perf_counter() - write_start
+        elapsed = time.perf_counter() - start - write_time
+        results[num_envs] = {
+            "steps_per_second": num_envs * frames / elapsed,
+            "observe_us": write_time / (num_envs * frames) * 1e6,
+        }
+    return results
+
+
+def print_vector(results):
+    for num_envs, result in results.items():
+        print(
+            f"vector_env K={num_envs:<4} {result['steps_per_second']:9.0f} env steps/s"
+            f"  observations {result['observe_us']:6.1f} us/env"
+        )
+
+
+# --- 数学カーネルのマイクロベンチマーク (前のやり方 legacy_* と vecmath を比べる) ---
+
+KERNEL_ENTITIES = 10000
+
+
+def legacy_homing_turn(vx, vy, tx, ty, speed, strength):
+    # vecmath.turn_towards() にする前の HomingBullet.update() の計算
+    target_angle = math.atan2(ty, tx)
+    current_angle = math.atan2(vy, vx)
+    angle_diff = target_angle - current_angle
+    while angle_diff > math.pi:
+        angle_diff -= 2 * math.pi
+    while angle_diff < -math.pi:
+        angle_diff += 2 * math.pi
+    new_angle = current_angle + angle_diff * strength
+    return speed * math.cos(new_angle), speed * math.sin(new_angle)
+
+
+def legacy_follow_step(x, y, target_x, target_y, speed):
+    # vecmath.step_towards() にする前の Ghost.update() の計算
+    angle = math.atan2(target_y - y, target_x - x)
+    return x + speed * math.cos(angle), y + speed * math.sin(angle)
+
+
+def legacy_fire_direction(dx, dy):
+    # vecmath.normalize() にする前の発射の計算
+    # (角度を度で持ってから cos/sin に戻していた)
+    angle = math.degrees(math.atan2(dy, dx))
+    return math.cos(math.radians(angle)), math.sin(math.radians(angle))
+
+
+def time_per_entity(func, n):
+    # func() が n 体分を処理するのにかかった時間 (1体あたりのナノ秒、5回の最小値)
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best / n * 1e9
+
+
+def run_kernels():
+    rng = np.random.default_rng(BENCH_SEED)
+    n = KERNEL_ENTITIES
+    vx, vy, tx, ty = rng.uniform(-10, 10, (4, n))
+    angles = rng.uniform(-math.pi, math.pi, n)
+    vx_list, vy_list, tx_list, ty_list = (
+        vx.tolist(),
+        vy.tolist(),
+        tx.tolist(),
+        ty.tolist(),
+    )
+    pairs = list(zip(vx_list, vy_list, tx_list, ty_list))
+    turn_cos, turn_sin = turn_limit(0.05 * math.pi)
+
+    kernels = {
+        "homing_turn": (
+            lambda: [legacy_homing_turn(a, b, c, d, 3.2, 0.05) for a, b, c, d in pairs],
+            lambda: [
+                turn_towards(a, b, c, d, 3.2, turn_cos, turn_sin)
+                for a, b, c, d in pairs
+            ],
+        ),
+        "follow_step": (
+            lambda: [legacy_follow_step(a, b, c, d, 0.8) for a, b, c, d in pairs],
+            lambda: [step_towards(a, b, c, d, 0.8) for a, b, c, d in pairs],
+        ),
+        "fire_direction": (
+            lambda: [legacy_fire_direction(a, b) for a, b in zip(vx_list, vy_list)],
+            lambda: [normalize(a, b) for a, b in zip(vx_list, vy_list)],
+        ),
+        "sin_cos_batched": (
+            lambda: (np.cos(angles), np.sin(angles)),
+            lambda: SIN_COS.lookup_arrays(angles),
+        ),
+    }
+    for name, (legacy, current) in kernels.items():
+        before = time_per_entity(legacy, n)
+        after = time_per_entity(current, n)
+        print(
+            f"{name:<20} legacy {before:8.1f} ns/entity  vecmath {after:8.1f} ns/entity"
+            f"  x{before / after:5.2f}"
+        )
+
+
+def cpu_name():
+    # Linux なら /proc/cpuinfo のモデル名 (platform.processor() は空のことが多い)
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_info():
+    return {
+        "cpu": cpu_name(),
+        "cpus": os.cpu_count(),
+        "system": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def compare(results, baseline, threshold):
+    # total の p50 がベースラインより threshold 以上遅くなったシナリオを返す
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        before = base["total_ms"]["p50"]
+        after = result["total_ms"]["p50"]
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+
+def print_result(name, result):
+    u = result["update_ms"]
+    d = result["draw_ms"]
+    print(
+        f"{name:<26} update p50/p95/p99"
+        f" {u['p50']:7.3f}/{u['p95']:7.3f}/{u['p99']:7.3f} ms"
+        f"  draw {d['p50']:7.3f}/{d['p95']:7.3f}/{d['p99']:7.3f} ms"
+        f"  gc0/1k {result['gc_gen0_per_1k_frames']:6.1f}"
+        f"  blocks/f {result['net_blocks_per_frame']:6.1f}"
+        f"  peak {result['peak_kib']:8.1f} KiB"
+        + (f"  events {result['events']}" if result.get("events") else "")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame loop benchmarks.")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument(
+        "--kernels", action="store_true", help="run the math kernel benchmarks"
+    )
+    parser.add_argument(
+        "--events", help="record gameplay events to this file while measuring"
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="compare sequential and pipelined update/draw",
+    )
+    parser.add_argument(
+        "--vector",
+        action="store_true",
+        help="measure VectorEnv steps per second by env count",
+    )
+    args = parser.parse_args()
+
+    if args.kernels:
+        run_kernels()
+        return
+    if args.vector:
+        print_vector(run_vector(args.frames, args.warmup))
+        return
+    if args.pipelined:
+        for name in args.scenario or SCENARIOS:
+            print_pipelined(name, run_pipelined(name, args.frames, args.warmup))
+        return
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        results[name] = run_scenario(name, args.frames, args.warmup, args.events)
+        print_result(name, results[name])
+
+    if args.save_baseline:
+        baseline = {}
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            pass
+        baseline.update(results)
+        baseline[MACHINE_KEY] = machine_info()
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"no baseline at {args.baseline} (create one with --save-baseline)")
+        return
+    machine = baseline.get(MACHINE_KEY)
+    if machine is not None and machine != machine_info():
+        print(f"baseline was recorded on another machine: {machine}")
+    regressions = compare(results, baseline, args.threshold)
+    for name, before, after in regressions:
+        print(f"REGRESSION {name}: total p50 {before:.3f} ms -> {after:.3f} ms")
+    if regressions:
+        raise SystemExit(1)
+    print(f"no regressions over {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
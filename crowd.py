@@ -0,0 +1,125 @@
+import math
+
+import numpy as np
+
+from vecmath import SIN_COS, normalize_arrays
+
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+class FlowField:
+    # 粗いグリッドの各セルに「目標 (プレイヤー) へ向かう単位ベクトル」を持たせた
+    # フローフィールド。目標が別のセルに移ったときだけ作り直し、
+    # 敵は自分のいるセルの向きを引くだけ (1体あたりO(1))
+    # 今のマップには障害物がないので、各セルの中心から目標のセルの中心への
+    # 向きをそのまま入れる
+    # (障害物を置くときは、ここを距離場 (BFS) の勾配に置き換えればよいでやんす)
+    def __init__(self, x0, y0, width, height, cell_size=16):
+        self.cell_size = cell_size
+        self.x0 = x0 # グリッドの左上のワールド座標
+        self.y0 = y0
+        self.cols = math.ceil(width / cell_size)
+        self.rows = math.ceil(height / cell_size)
+        self.center_x = x0 + (np.arange(self.cols) + 0.5) * cell_size
+        self.center_y = (y0 + (np.arange(self.rows) + 0.5) * cell_size)[:, None]
+        self.dir_x = np.zeros((self.rows, self.cols))
+        self.dir_y = np.zeros((self.rows, self.cols))
+        self.target_cell = None
+        self.rebuild_count = 0 # 作り直した回数 (計測用)
+
+    def cell_of(self, x, y):
+        cs = self.cell_size
+        col = min(max(math.floor((x - self.x0) / cs), 0), self.cols - 1)
+        row = min(max(math.floor((y - self.y0) / cs), 0), self.rows - 1)
+        return row, col
+
+    def update(self, target_x, target_y):
+        # 目標のセルが変わっていたら作り直す
+        cell = self.cell_of(target_x, target_y)
+        if cell == self.target_cell:
+            return
+        self.target_cell = cell
+        self.rebuild_count += 1
+        row, col = cell
+        self.dir_x, self.dir_y = normalize_arrays(
+            self.center_x[col] - self.center_x, self.center_y[row] - self.center_y
+        )
+
+    def sample(self, xs, ys, target_x, target_y):
+        # 各点の移動方向 (単位ベクトル) を返す
+        # 目標のセルとその周りのセルにいる点は、セルの向きではなく目標へ直接向かう
+        # (セルの中心に向かうだけだと、目標に届かずに止まってしまうので)
+        cs = self.cell_size
+        cols = np.clip(np.floor((xs - self.x0) / cs).astype(np.int64), 0, self.cols - 1)
+        rows = np.clip(np.floor((ys - self.y0) / cs).astype(np.int64), 0, self.rows - 1)
+        dir_x = self.dir_x[rows, cols]
+        dir_y = self.dir_y[rows, cols]
+        target_row, target_col = self.target_cell
+        near = (np.abs(rows - target_row) <= 1) & (np.abs(cols - target_col) <= 1)
+        if near.any():
+            dir_x[near], dir_y[near] = normalize_arrays(
+                target_x - xs[near], target_y - ys[near]
+            )
+        return dir_x, dir_y
+
+
+def separation(xs, ys, ids, cell_size, crowd_size=4, max_strength=2.0, which=None):
+    # 混み合った敵どうしを離す力 (大きさ0〜max_strengthのベクトル) を返すでやんす
+    # 総当たりの代わりに、セルごとの人数と座標の合計を bincount で数え、
+    # 自分のセルと周り8セルの重心 (自分は除く) から離れる向きに押す。
+    # 周りの人数が多いほど強く押す
+    # (周りに crowd_size 人いると強さ1、最大で max_strength)
+    # which (インデックスの配列) を渡すと、混み具合は全員から数え、
+    # 力はその点の分だけ返す
+    cx = np.floor(xs / cell_size).astype(np.int64)
+    cy = np.floor(ys / cell_size).astype(np.int64)
+    # 周りのセルを足し合わせるときにはみ出さないよう、1セル分の余白をつける
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    width = int(cx.max()) + 2
+    height = int(cy.max()) + 2
+    keys = cy * width + cx
+    size = width * height
+    # 人数・x座標の合計・y座標の合計を1つの配列に重ねて、
+    # まとめて周りのセルと足し合わせる
+    grid = np.empty((3, size))
+    grid[0] = np.bincount(keys, minlength=size)
+    grid[1] = np.bincount(keys, weights=xs, minlength=size)
+    grid[2] = np.bincount(keys, weights=ys, minlength=size)
+    grid = grid.reshape(3, height, width)
+    box = np.zeros_like(grid) # 各セルについて、自分と周り8セルの値の合計
+    inner = box[:, 1:-1, 1:-1]
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            inner += grid[:, dy : dy + height - 2, dx : dx + width - 2]
+    if which is not None:
+        xs = xs[which]
+        ys = ys[which]
+        ids = ids[which]
+        cx = cx[which]
+        cy = cy[which]
+    n = len(xs)
+    near = box[:, cy, cx]
+    near_count = near[0] - 1
+    near_x = near[1] - xs
+    near_y = near[2] - ys
+
+    force_x = np.zeros(n)
+    force_y = np.zeros(n)
+    crowded = near_count > 0
+    if not crowded.any():
+        return force_x, force_y
+    away_x = xs[crowded] - near_x[crowded] / near_count[crowded]
+    away_y = ys[crowded] - near_y[crowded] / near_count[crowded]
+    dist = np.hypot(away_x, away_y)
+    # 重心とぴったり重なっている (同じ位置に積み重なった) 敵は、IDで決まる向きに押し出す
+    # (乱数を使わないのでリプレイがずれない)
+    stacked = dist < 1e-9
+    away_x[stacked], away_y[stacked] = SIN_COS.lookup_arrays(
+        ids[crowded][stacked] * GOLDEN_ANGLE
+    )
+    dist[stacked] = 1.0
+    strength = np.minimum(near_count[crowded] / crowd_size, max_strength)
+    force_x[crowded] = away_x / dist * strength
+    force_y[crowded] = away_y / dist * strength
+    return force_x, force_y
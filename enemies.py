@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class EnemyStore:
+    # 敵をNumPyの連続した配列 (structure of arrays) でまとめて持つでやんす
+    # 生きている敵は常に先頭の count 個に詰めてあり、インデックス i が1体の敵を表す
+    # インデックスは compact() で変わるので、
+    # フレームをまたいで敵を覚えるときは ids を使う
+    def __init__(self, capacity=256):
+        self.count = 0
+        self.next_id = 0
+        self.id_to_index = {}
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        self.hp = np.zeros(capacity, dtype=np.float64)
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        # 当たり判定と描画の一辺 (正方形)
+        self.size = np.zeros(capacity, dtype=np.float64)
+        self.phase = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros(capacity, dtype=np.int32)
+        self.active = np.zeros(capacity, dtype=np.bool_)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+
+    ARRAY_NAMES = ("x", "y", "hp", "speed", "size", "phase", "color", "active", "ids")
+
+    def grow(self, capacity):
+        for name in self.ARRAY_NAMES:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: self.count] = old[: self.count]
+            setattr(self, name, new)
+
+    def spawn(self, x, y, hp, speed, size, phase, color):
+        i = self.count
+        if i == len(self.x):
+            self.grow(len(self.x) * 2)
+        enemy_id = self.next_id
+        self.next_id += 1
+        self.x[i] = x
+        self.y[i] = y
+        self.hp[i] = hp
+        self.speed[i] = speed
+        self.size[i] = size
+        self.phase[i] = phase
+        self.color[i] = color
+        self.active[i] = True
+        self.ids[i] = enemy_id
+        self.id_to_index[enemy_id] = i
+        self.count = i + 1
+        return enemy_id
+
+    def index_of(self, enemy_id):
+        # 生きている敵のインデックスを返す (倒された・存在しない場合はNone)
+        i = self.id_to_index.get(enemy_id)
+        if i is None or not self.active[i]:
+            return None
+        return i
+
+    def move_some(self, indices, dir_x, dir_y, steps):
+        # インデックス indices の敵だけを、
+        # 向き (dir_x, dir_y) に speed * steps だけ進めるでやんす
+        # (steps は間引いて更新する敵の、まとめて進めるフレーム数)
+        step = np.where(self.active[indices], self.speed[indices] * steps, 0.0)
+        self.x[indices] += dir_x * step
+        self.y[indices] += dir_y * step
+
+    def compact(self):
+        # 非アクティブな敵をまとめて取り除き、生きている敵を先頭に詰める (順番は保つ)
+        self.keep_rows(self.active[: self.count].copy())
+
+    def keep_rows(self, keep):
+        # keep[i] が真の敵だけを残して先頭に詰める (順番は保つ)
+        n = self.count
+        k = int(np.count_nonzero(keep))
+        if k == n:
+            return
+        for name in self.ARRAY_NAMES:
+            arr = getattr(self, name)
+            arr[:k] = arr[:n][keep]
+        self.count = k
+        self.id_to_index = dict(zip(self.ids[:k].tolist(), range(k)))
+
+    def extract(self, mask):
+        # mask[i] が真の敵を取り除き、その敵の列を {名前: 配列} で返す (IDはそのまま)
+        n = self.count
+        columns = {name: getattr(self, name)[:n][mask] for name in self.ARRAY_NAMES}
+        self.keep_rows(~mask)
+        return columns
+
+    def insert(self, columns):
+        # extract() で取り出した敵を末尾に戻す (active がなければ生きているとみなす)
+        m = len(columns["x"])
+        i = self.count
+        if i + m > len(self.x):
+            self.grow(max(len(self.x) * 2, i + m))
+        for name in self.ARRAY_NAMES:
+            getattr(self, name)[i : i + m] = columns.get(name, True)
+        self.id_to_index.update(zip(self.ids[i : i + m].tolist(), range(i, i + m)))
+        self.count = i + m
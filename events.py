@@ -0,0 +1,233 @@
+import json
+import queue
+import threading
+
+import numpy as np
+
+# プレイの記録 (後から集計するためのイベントログ) でやんす
+# イベントは1件32バイトの固定長レコードにして、
+# あらかじめ確保したバッファに書き込むだけにする
+# バッファが一杯になったら、書き出しはバックグラウンドのスレッドに任せて、
+# 空いている方のバッファに切り替える (ダブルバッファ)
+# フレームの処理の中では、ファイルへの書き込みも JSON への変換もしない
+
+# イベントの種類 (kind)
+EVENT_SPAWN = 0 # 敵の出現 (entity: 敵ID, value: HP, extra: フェーズ)
+EVENT_DAMAGE = 1 # 敵へのダメージ1回分 (source: 攻撃元, entity: 敵ID, value: ダメージ)
+EVENT_KILL = 2 # 敵を倒した (entity: 敵ID, extra: フェーズ)
+EVENT_ORB_DROP = 3 # 経験値オーブのドロップ (value: 経験値, extra: 大きいオーブなら1)
+EVENT_PICKUP = 4 # 経験値オーブの取得 (value: 経験値, extra: 取得後の経験値)
+# レベルアップ (value: 新しいレベル, extra: 選択肢のアビリティ番号のビット)
+EVENT_LEVEL_UP = 5
+# アビリティの選択 (entity: アビリティ番号, value: 取得後のアビリティのレベル)
+EVENT_ABILITY = 6
+EVENT_PLAYER_HIT = 7 # プレイヤーが敵に当たった (entity: 敵ID, value: 残りHP)
+EVENT_GAME_OVER = 8 # ゲームオーバー (value: 生き残ったフレーム数, extra: レベル)
+EVENT_NAMES = (
+    "spawn",
+    "damage",
+    "kill",
+    "orb_drop",
+    "pickup",
+    "level_up",
+    "ability",
+    "player_hit",
+    "game_over",
+)
+
+# ダメージの攻撃元 (source)
+SOURCE_NONE = 0
+SOURCE_BULLET = 1
+SOURCE_HOMING = 2
+SOURCE_GHOST = 3
+SOURCE_PROJECTILE = 4 # ProjectileStore の弾 (拡散弾・ノヴァ・オービット・チェーン)
+SOURCE_NAMES = ("none", "bullet", "homing", "ghost", "projectile")
+
+# x, y はイベントが起きた位置 (敵・オーブ・プレイヤーのワールド座標)
+EVENT_DTYPE = np.dtype(
+    [
+        ("frame", np.int32),
+        ("kind", np.uint8),
+        ("source", np.uint8),
+        ("entity", np.int64),
+        ("x", np.float32),
+        ("y", np.float32),
+        ("value", np.float32),
+        ("extra", np.int32),
+    ],
+    align=True,
+)
+
+# JSONL に書き出すときの、種類ごとのキー名 (None の列は書かない)
+# 並びは (source, entity, x, y, value, extra)
+EVENT_KEYS = (
+    (None, "enemy", "x", "y", "hp", "phase"),
+    ("source", "enemy", "x", "y", "damage", None),
+    (None, "enemy", "x", "y", None, "phase"),
+    (None, None, "x", "y", "exp", "big"),
+    (None, None, "x", "y", "exp", "total_exp"),
+    (None, None, None, None, "level", "offered"),
+    (None, "ability", None, None, "ability_level", None),
+    (None, "enemy", "x", "y", "hp", None),
+    (None, None, "x", "y", "frames", "level"),
+)
+
+DEFAULT_BUFFER_SIZE = 16384 # 1バッファのレコード数 (512KiB)
+
+
+class NullEventLog:
+    # 記録しないときに Simulation が持つイベントログ (何もしないので、ほぼタダでやんす)
+    # 1フレームに何度も呼ぶところ (ダメージなど) では、
+    # 呼ぶ前に enabled を見て引数を作るのも省く
+    enabled = False
+    frame = 0
+
+    def emit(
+        self, kind, source=SOURCE_NONE, entity=-1, x=0.0, y=0.0, value=0.0, extra=0
+    ):
+        pass
+
+    def emit_many(
+        self, kind, entities, xs, ys, values=0.0, extras=0, source=SOURCE_NONE
+    ):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_EVENT_LOG = NullEventLog()
+
+
+class EventLog:
+    # path にイベントを書き出す。binary=False なら1行1件の JSONL、
+    # True なら EVENT_DTYPE のレコードをそのまま並べたファイル
+    # (np.fromfile(path, dtype=EVENT_DTYPE) で読める)
+    # ability_names: アビリティ番号 -> 名前 (JSONL ではアビリティを名前で書く)
+    # frame は Simulation.step() が毎フレーム書き換える
+    # emit() 自体は1件 1µs 未満。
+    # ただし JSONL への変換もスレッドとはいえ同じプロセスで動く (GIL を取り合う)
+    # ので1件数µs かかる。重いシナリオを計測しながら記録するなら binary にして、
+    # JSONL は後で作るでやんす
+    enabled = True
+
+    def __init__(
+        self, path, binary=False, ability_names=(), buffer_size=DEFAULT_BUFFER_SIZE
+    ):
+        self.path = path
+        self.binary = binary
+        self.ability_names = tuple(ability_names)
+        self.buffer_size = buffer_size
+        self.frame = 0
+        self.records = np.zeros(buffer_size, dtype=EVENT_DTYPE)
+        self.size = 0 # records に書き込んだ件数
+        self.emitted = 0 # これまでに記録した件数
+        self.flushes = 0 # スレッドに渡したバッファの数
+        # 書き出し待ちのバッファと、書き出し終わって空いたバッファ
+        self.pending = queue.Queue()
+        self.free = queue.Queue()
+        self.free.put(np.zeros(buffer_size, dtype=EVENT_DTYPE))
+        self.file = open(path, "wb" if binary else "w")
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def emit(
+        self, kind, source=SOURCE_NONE, entity=-1, x=0.0, y=0.0, value=0.0, extra=0
+    ):
+        i = self.size
+        self.records[i] = (self.frame, kind, source, entity, x, y, value, extra)
+        self.size = i + 1
+        self.emitted += 1
+        if self.size == self.buffer_size:
+            self.flush()
+
+    def emit_many(
+        self, kind, entities, xs, ys, values=0.0, extras=0, source=SOURCE_NONE
+    ):
+        # 同じ種類のイベントを配列でまとめて記録する (倒した敵・弾幕のダメージなど)
+        count = len(entities)
+        start = 0
+        while start < count:
+            i = self.size
+            n = min(count - start, self.buffer_size - i)
+            rows = self.records[i : i + n]
+            rows["frame"] = self.frame
+            rows["kind"] = kind
+            rows["source"] = source
+            rows["entity"] = entities[start : start + n]
+            rows["x"] = xs[start : start + n]
+            rows["y"] = ys[start : start + n]
+            rows["value"] = values if np.isscalar(values) else values[start : start + n]
+            rows["extra"] = extras if np.isscalar(extras) else extras[start : start + n]
+            self.size = i + n
+            start += n
+            if self.size == self.buffer_size:
+                self.flush()
+        self.emitted += count
+
+    def flush(self):
+        # 書き込んだ分をスレッドに渡し、空いているバッファに切り替える
+        # (スレッドの書き出しが追いつかず空きがないときは、空くまで待つ)
+        if self.size == 0:
+            return
+        self.pending.put((self.records, self.size))
+        self.flushes += 1
+        self.records = self.free.get()
+        self.size = 0
+
+    def close(self):
+        # 残りを書き出して、スレッドの終了を待つ
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def write_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            records, size = item
+            if self.binary:
+                self.file.write(records[:size].tobytes())
+            else:
+                self.file.write(self.to_jsonl(records[:size]))
+            self.free.put(records)
+
+    def to_jsonl(self, records):
+        # 座標などは float32 なので、そのまま書くと桁が増えるだけになる。小数3桁に丸める
+        columns = [
+            records[name].astype(np.float64).round(3).tolist()
+            if records.dtype[name].kind == "f"
+            else records[name].tolist()
+            for name in EVENT_DTYPE.names
+        ]
+        lines = []
+        for frame, kind, source, entity, x, y, value, extra in zip(*columns):
+            event = {"frame": frame, "type": EVENT_NAMES[kind]}
+            for key, item in zip(
+                EVENT_KEYS[kind], (source, entity, x, y, value, extra)
+            ):
+                if key is not None:
+                    event[key] = item
+            if kind == EVENT_DAMAGE:
+                event["source"] = SOURCE_NAMES[source]
+            elif kind == EVENT_LEVEL_UP:
+                event["level"] = int(value)
+                event["offered"] = self.ability_list(extra)
+            elif kind == EVENT_ABILITY:
+                event["ability"] = self.ability_name(entity)
+                event["ability_level"] = int(value)
+            elif kind == EVENT_ORB_DROP:
+                event["big"] = bool(extra)
+            lines.append(json.dumps(event, separators=(",", ":")))
+        lines.append("")
+        return "\n".join(lines)
+
+    def ability_name(self, index):
+        if 0 <= index < len(self.ability_names):
+            return self.ability_names[index]
+        return index
+
+    def ability_list(self, bits):
+        return [self.ability_name(i) for i in range(32) if bits >> i & 1]
@@ -0,0 +1,41 @@
+import numpy as np
+
+# 遠くのエンティティほど間引いて更新するための、距離ごとの更新ティア (LOD) でやんす
+# ティア t のエンティティは 2**t フレームに1回だけ更新し、
+# その分 (2**t フレーム分) まとめて動かす
+# 更新するフレームは (フレーム番号 + ID) で決めるので、同じティアのエンティティは
+# 毎フレーム少しずつ更新される (あるフレームに更新が集中しない)
+
+
+class LodScheduler:
+    # radii: ティアの境目の距離 (近い順)。radii[0] 未満はティア0 (毎フレーム更新)
+    # budget: 1フレームに更新するエンティティ数の目安
+    #   遠いティアの分を足して超えそうなら、ティア1以上の間隔を2倍ずつ延ばしていく
+    #   (ティア0は常に毎フレーム更新する)
+    def __init__(self, radii, budget, max_period=64):
+        self.radii_sq = np.asarray(radii, dtype=np.float64) ** 2
+        self.budget = budget
+        self.max_period = max_period
+        self.shift = 0 # 予算に収めるために延ばしたティアの段数 (直近のフレーム)
+        self.last_updates = 0 # 直近のフレームで更新したエンティティ数
+
+    def select(self, xs, ys, ids, center_x, center_y, frame):
+        # このフレームに更新するエンティティのインデックスと、
+        # それぞれの進めるフレーム数を返す
+        dx = xs - center_x
+        dy = ys - center_y
+        tiers = np.searchsorted(self.radii_sq, dx * dx + dy * dy, side="right")
+        far = tiers > 0
+        near_count = len(tiers) - int(np.count_nonzero(far))
+        # 1フレームあたりの更新数の見込み (ティア t は 1/2**t 体分)
+        far_load = float(np.sum(np.exp2(-tiers[far].astype(np.float64))))
+        available = max(self.budget - near_count, 1)
+        shift = 0
+        while far_load > available and (2 << shift) <= self.max_period:
+            far_load /= 2
+            shift += 1
+        self.shift = shift
+        periods = np.where(far, np.minimum(1 << (tiers + shift), self.max_period), 1)
+        due = np.flatnonzero((frame + ids) % periods == 0)
+        self.last_updates = len(due)
+        return due, periods[due]
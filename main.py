@@ -1,16 +1,149 @@
 import math
 import random
-import sys # sysモジュールをインポート
+import sys  # sysモジュールをインポート
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pyxel
 
+from crowd import FlowField, separation
+from enemies import EnemyStore
+from events import (
+    EVENT_ABILITY,
+    EVENT_DAMAGE,
+    EVENT_GAME_OVER,
+    EVENT_KILL,
+    EVENT_LEVEL_UP,
+    EVENT_ORB_DROP,
+    EVENT_PICKUP,
+    EVENT_PLAYER_HIT,
+    EVENT_SPAWN,
+    NULL_EVENT_LOG,
+    SOURCE_BULLET,
+    SOURCE_GHOST,
+    SOURCE_HOMING,
+    SOURCE_PROJECTILE,
+)
+from lod import LodScheduler
+from pool import ObjectPool, compact_in_place
+from profiler import (
+    NULL_PROFILER,
+    PHASE_BULLETS,
+    PHASE_CLEANUP,
+    PHASE_COLLISION,
+    PHASE_DAMAGE,
+    PHASE_DRAW,
+    PHASE_ENEMIES,
+    PHASE_FIRE,
+    PHASE_GHOSTS,
+    PHASE_HOMING,
+    PHASE_INPUT,
+    PHASE_KILL,
+    PHASE_ORBS,
+    PHASE_PICKUP,
+    PHASE_PLAYER,
+    PHASE_PROJECTILES,
+    PHASE_WEAPONS,
+    FrameProfiler,
+)
+from projectiles import ProjectileStore
+from render import CachedLayer, RectBatcher
+from scheduler import Scheduler
+from spatial import BucketGrid, PointGrid
+from stats import (
+    STAT_BULLET_DAMAGE,
+    STAT_BULLET_SPEED,
+    STAT_FIRE_RATE,
+    STAT_GHOST_DAMAGE_MULTIPLIER,
+    STAT_LEVEL,
+    STAT_MAX_HP,
+    STAT_MOVE_SPEED,
+    STAT_SHOT_COOLDOWN,
+    STAT_SHOT_INTERVAL,
+    Stats,
+)
+from vecmath import normalize, step_towards, turn_limit, turn_towards
+from world import Camera, ChunkMap
+
 # ゲーム画面サイズ
 SCREEN_WIDTH = 256
 SCREEN_HEIGHT = 256
 
+# ワールドの大きさ (画面はカメラでその一部を映す)
+WORLD_WIDTH = 1024
+WORLD_HEIGHT = 1024
+# ワールドを区切るチャンクの一辺。
+# 画面とその周り CHUNK_ACTIVE_MARGIN チャンクの外の敵は休眠させる
+CHUNK_SIZE = 128
+CHUNK_ACTIVE_MARGIN = 1
+CHUNK_GRID_COLOR = 1
+
+# 描き直す必要があるときだけ描くHUDと照準の画像の大きさ
+HUD_WIDTH = 110
+HUD_HEIGHT = 45
+CROSSHAIR_SIZE = 11
+
+# 敵の更新の間引き (LOD)
+# プレイヤーの中心からの距離が LOD_RADII の各値以上になるごとに、
+# 更新の間隔を 2, 4, 8 フレームと延ばす
+LOD_RADII = (96, 192, 320)
+# 1フレームに動かす敵の数の目安 (超えそうなら遠い敵の間隔をさらに延ばす)
+LOD_UPDATE_BUDGET = 1500
+LOD_MAX_PERIOD = 64
+
+# F3で巻き戻す秒数と、そのために記録しておく秒数
+# 記録は毎フレーム スナップショットを取るので重い。
+# デバッグ用に --rewind を付けたときだけ記録する
+REWIND_SECONDS = 5
+REWIND_HISTORY_SECONDS = 10
+REWIND_FLAG = "--rewind"
+
+# シミュレーションは1秒に SIM_FPS 回の固定の刻みで進める
+# (描画が遅れても、ゲームの時間は遅れない)
+SIM_FPS = 30
+MAX_TICKS_PER_FRAME = 4 # 遅れを取り戻すために1回の描画の間に進める最大の回数
+# 刻みのこの割合まで早ければ進めてしまう
+# (タイマーの揺らぎで0回/2回と交互にならないように)
+TIMESTEP_SLOP = 0.2
+# これをコマンドラインに付けると、更新と描画を別のスレッドで重ねて動かす
+# (例: uv run main.py --pipelined)
+PIPELINED_FLAG = "--pipelined"
+
 # 銃弾の速度
 BULLET_SPEED = 4
 BULLET_DAMAGE = 20
+BULLET_SIZE = 2
+BULLET_COLOR = 8
+BULLET_LIFE = 90 # 弾が消えるまでのフレーム数
+HOMING_BULLET_SIZE = 3 # 見分けがつくように少し大きくする
+HOMING_BULLET_COLOR = 12 # 追尾弾は色を変える（例：シアン）
+
+# 弾幕の武器 (ProjectileStore でまとめて動かす弾。ダメージはどれも STAT_BULLET_DAMAGE)
+SPREAD_ANGLE_STEP = math.pi / 12 # 拡散弾の隣り合う弾の間の角度 (15度)
+SPREAD_COLOR = 9
+NOVA_INTERVAL = 60 # ノヴァ (全方位のリング) を撃つ間隔 (フレーム数)
+# レベル1のリングの弾数 (レベルが1上がるごとに NOVA_COUNT_PER_LEVEL 発増える)
+NOVA_BASE_COUNT = 8
+NOVA_COUNT_PER_LEVEL = 4
+NOVA_SPEED = 2.5
+NOVA_LIFE = 60
+NOVA_SIZE = 3
+NOVA_COLOR = 14
+ORBIT_INTERVAL = 120 # オービット (周りを回る刃) を出し直す間隔 (フレーム数)
+# 刃が消えるまでのフレーム数 (同じ刃は同じ敵に1回しか当たらないので、出し直す)
+ORBIT_LIFE = 90
+ORBIT_RADIUS = 24
+ORBIT_ANGULAR_SPEED = 2 * math.pi / 45 # 1.5秒で1周
+ORBIT_SIZE = 4
+ORBIT_COLOR = 6
+CHAIN_INTERVAL = 45 # チェーン (同じ向きに続けて飛ぶ弾) を撃つ間隔 (フレーム数)
+CHAIN_BASE_COUNT = 3 # レベル1の弾数 (レベルが1上がるごとに1発増える)
+CHAIN_DELAY = 3 # 続く弾が出るまでのフレーム数
+CHAIN_SPEED = 5
+CHAIN_LIFE = 60
+CHAIN_SIZE = 2
+CHAIN_COLOR = 15
 
 # 敵の速度
 ENEMY_SPEED = 0.5
@@ -18,6 +151,9 @@ ENEMY_HP = 50
 ENEMY_DAMAGE = 1
 ENEMY_EXP = 1  # 敵がドロップする経験値
 
+# レベルアップごとに次のレベルに必要な経験値をこの倍率にする
+EXP_LEVEL_UP_MULTIPLIER = 1.5
+
 # ゲーム状態
 GAME_STATE_PLAYING = 0
 GAME_STATE_GAME_OVER = 1
@@ -30,8 +166,27 @@ ENEMY_SPAWN_INTERVAL = 60
 EXP_ORB_LIFETIME = 300  # 300フレーム(5秒)で消滅
 BIG_EXP_ORB_CHANCE = 0.1 # 多めにドロップする経験値オーブの出現確率 (10%)
 BIG_EXP_ORB_MULTIPLIER = 5 # 多めにドロップする経験値オーブの倍率 (5倍)
+EXP_ORB_SIZE = 4
 NORMAL_EXP_ORB_COLOR = 11 # 通常の経験値オーブの色 (黄色)
 BIG_EXP_ORB_COLOR = 10 # 多めにドロップする経験値オーブの色 (緑色)
+EXP_ORB_MERGE_CELL_SIZE = 8 # 同じセルに落ちたオーブは1個にまとめる (経験値は合計する)
+# 地面に置けるオーブの上限 (超えたら一番古いオーブを近くのオーブにまとめる)
+MAX_EXP_ORBS = 256
+EXP_ORB_MAGNET_RADIUS = 24 # プレイヤーの中心からこの距離以内のオーブは吸い寄せられる
+# 吸い寄せられるオーブは、プレイヤーの移動速度よりこれだけ速く飛ぶ
+# (移動速度を上げても必ず追いつく)
+EXP_ORB_MAGNET_SPEED_MARGIN = 2
+
+# 衝突判定のブロードフェーズ (空間ハッシュ) のセルサイズ
+SPATIAL_CELL_SIZE = 32
+
+# 敵の群れの動き
+FLOW_FIELD_CELL_SIZE = 16 # プレイヤーへ向かうフローフィールドのセルの大きさ
+# 画面外に出現した敵もフローフィールドに乗るよう、画面の周りに広げる幅
+FLOW_FIELD_MARGIN = 32
+# 敵どうしを離す力を計算するセルの大きさ (周り8セルまでを近くの敵とみなす)
+CROWD_CELL_SIZE = 8
+CROWD_SEPARATION_WEIGHT = 1.2 # 離す力の強さ (プレイヤーへ向かう力を1としたとき)
 
 
 # 衝突判定ヘルパー関数
@@ -39,15 +194,47 @@ def is_colliding(x1, y1, w1, h1, x2, y2, w2, h2):
     return x1 < x2 + w2 and x1 + w1 > x2 and y1 < y2 + h2 and y1 + h1 > y2
 
 
+def sweep_hit_time(x1, y1, w1, h1, dx, dy, x2, y2, w2, h2):
+    # 矩形1が (dx, dy) だけ動く間に、止まっている矩形2と重なり始める時刻 (0〜1) を返す
+    # 重ならなければNone。最初から重なっていれば0
+    # (重なりの判定は is_colliding と同じく端を含まない)
+    # 矩形2を矩形1の大きさだけ広げ、矩形1の左上の点が通る線分との交差を軸ごとに求める
+    # (スラブ法)
+    t_enter = 0.0
+    t_exit = 1.0
+    for start, delta, low, high in (
+        (x1, dx, x2 - w1, x2 + w2),
+        (y1, dy, y2 - h1, y2 + h2),
+    ):
+        if delta == 0:
+            if not low < start < high:
+                return None
+            continue
+        t0 = (low - start) / delta
+        t1 = (high - start) / delta
+        if t0 > t1:
+            t0, t1 = t1, t0
+        if t0 > t_enter:
+            t_enter = t0
+        if t1 < t_exit:
+            t_exit = t1
+        if t_enter >= t_exit:
+            return None
+    return t_enter
+
+
 # Ability Base Class
 class Ability:
-    def __init__(self, name, description, max_level=-1): # max_levelを追加 (デフォルトは無限)
+    # max_levelを追加 (デフォルトは無限)
+    def __init__(self, name, description, max_level=-1):
         self.name = name
         self.description = description
         self.max_level = max_level # このアビリティが取得できる最大レベル
 
     def apply_effect(self, player):
         # このメソッドは各アビリティでオーバーライドされるでやんす
+        # 能力値を変えるアビリティは、player.stats に修正値を登録する
+        # (値は必要なときに計算し直される)
         pass
 
 
@@ -59,7 +246,7 @@ class MaxHpUp(Ability):
         )  # 英語に戻すでやんす
 
     def apply_effect(self, player):
-        player.player_max_hp += 1
+        player.stats.add_modifier(STAT_MAX_HP, add=1, source=self.name)
         player.player_hp += 1  # 最大HPが増えた分、現在HPも増やすでやんす
 
 
@@ -70,7 +257,8 @@ class MoveSpeedUp(Ability):
         )  # 英語に戻すでやんす
 
     def apply_effect(self, player):
-        player.player_speed += 0.5  # 仮で0.5増やすでやんす
+        # 仮で0.5増やすでやんす
+        player.stats.add_modifier(STAT_MOVE_SPEED, add=0.5, source=self.name)
 
 
 class BulletSpeedUp(Ability):
@@ -80,7 +268,8 @@ class BulletSpeedUp(Ability):
         )  # 英語に戻すでやんす
 
     def apply_effect(self, player):
-        player.bullet_bullet_speed_multiplier += 0.1  # 弾速を乗算で強化
+        # 弾速を乗算で強化
+        player.stats.add_modifier(STAT_BULLET_SPEED, mul=0.1, source=self.name)
 
 
 class BulletDamageUp(Ability):
@@ -90,13 +279,14 @@ class BulletDamageUp(Ability):
         )  # 英語にするでやんす
 
     def apply_effect(self, player):
-        player.bullet_damage += 1
+        player.stats.add_modifier(STAT_BULLET_DAMAGE, add=1, source=self.name)
 
 
 class AutoAimBulletAbility(Ability):
     def __init__(self):
         super().__init__(
-            "Auto-aim Bullet", "Periodically fires a homing bullet.", max_level=1 # max_levelを1に設定
+            # max_levelを1に設定
+            "Auto-aim Bullet", "Periodically fires a homing bullet.", max_level=1
         )
 
     def apply_effect(self, player):
@@ -117,13 +307,22 @@ class PiercingShotAbility(Ability):
 class SummonGhostAbility(Ability):
     def __init__(self):
         super().__init__(
-            "Summon Ghost", "Summons a ghost that fights for you.", max_level=1 # max_levelを1に設定
+            # max_levelを1に設定
+            "Summon Ghost", "Summons a ghost that fights for you.", max_level=1
         )
 
     def apply_effect(self, player):
         player.has_ghost_summon = True
-        # 最初のゴーストを召喚 (player_x, player_yはプレイヤーの初期位置、BULLET_DAMAGEは現在の弾丸ダメージ)
-        player.ghosts.append(Ghost(player.player_x, player.player_y, player.bullet_damage))
+        # 最初のゴーストを召喚 (player_x, player_yはプレイヤーの初期位置、
+        # 攻撃力は現在の弾丸ダメージから決める)
+        player.ghosts.append(
+            Ghost(
+                player.player_x,
+                player.player_y,
+                player.stats.get(STAT_BULLET_DAMAGE),
+                player.rng,
+            )
+        )
 
 class BulletFireRateUp(Ability):
     def __init__(self):
@@ -132,7 +331,54 @@ class BulletFireRateUp(Ability):
         )
 
     def apply_effect(self, player):
-        player.player_fire_rate_multiplier += 0.1 # 発射レートを上げる (0.1は仮の値)
+        # 発射レートを上げる (0.1は仮の値)
+        player.stats.add_modifier(STAT_FIRE_RATE, add=0.1, source=self.name)
+
+
+class SpreadShotAbility(Ability):
+    def __init__(self):
+        super().__init__(
+            "Spread Shot", "Fires a fan of bullets instead of one.", max_level=3
+        )
+
+    def apply_effect(self, player):
+        player.spread_level += 1 # 1発が 1 + 2 * レベル 発の扇形になる
+
+
+class NovaRingAbility(Ability):
+    def __init__(self):
+        super().__init__(
+            "Nova Ring",
+            "Periodically fires a ring of bullets in all directions.",
+            max_level=5,
+        )
+
+    def apply_effect(self, player):
+        player.nova_level += 1
+
+
+class OrbitBladesAbility(Ability):
+    def __init__(self):
+        super().__init__(
+            "Orbit Blades",
+            "Blades circle around you and cut through enemies.",
+            max_level=4,
+        )
+
+    def apply_effect(self, player):
+        player.orbit_level += 1 # 刃の枚数は 1 + レベル
+
+
+class ChainBurstAbility(Ability):
+    def __init__(self):
+        super().__init__(
+            "Chain Burst",
+            "Periodically fires a burst at the nearest enemy.",
+            max_level=3,
+        )
+
+    def apply_effect(self, player):
+        player.chain_level += 1
 
 
 # 全てのアビリティのリスト
@@ -145,57 +391,154 @@ ALL_ABILITIES = [
     PiercingShotAbility(),
     SummonGhostAbility(), # 新しいアビリティを追加
     BulletFireRateUp(), # 新しいアビリティを追加
+    SpreadShotAbility(), # ここから下は弾幕の武器 (ProjectileStore)
+    NovaRingAbility(),
+    OrbitBladesAbility(),
+    ChainBurstAbility(),
 ]
 
 
 class Bullet:
-    def __init__(self, x, y, angle, pierce_level=0): # pierce_levelを追加
+    # 弾は大量に作っては消すので、__slots__でインスタンスの__dict__をなくし、
+    # ObjectPoolで使い回せるように初期化を reset() にまとめてあるでやんす
+    __slots__ = (
+        "x",
+        "y",
+        "dx",
+        "dy",
+        "is_active",
+        "width",
+        "height",
+        "life_time",
+        "pierce_level",
+        "pierced_count",
+        "damage", # 貫通する前のダメージ (発射したときのプレイヤーの弾丸ダメージ)
+        "hit_enemies",
+        "prev_x", # このフレームで動く前の位置 (移動経路ごと当たり判定するのに使う)
+        "prev_y",
+    )
+
+    def __init__(
+        self,
+        x,
+        y,
+        dir_x,
+        dir_y,
+        pierce_level=0,
+        damage=BULLET_DAMAGE,
+        speed=BULLET_SPEED,
+    ): # pierce_levelを追加
+        self.hit_enemies = set() # 既にヒットした敵のIDを記録 (二重ヒット防止)
+        self.reset(x, y, dir_x, dir_y, pierce_level, damage, speed)
+
+    def reset(
+        self,
+        x,
+        y,
+        dir_x,
+        dir_y,
+        pierce_level=0,
+        damage=BULLET_DAMAGE,
+        speed=BULLET_SPEED,
+    ):
+        # (dir_x, dir_y) は飛ぶ向きの単位ベクトル
         self.x = x
         self.y = y
-        self.angle = angle
-        self.dx = BULLET_SPEED * math.cos(math.radians(angle))
-        self.dy = BULLET_SPEED * math.sin(math.radians(angle))
+        self.prev_x = x
+        self.prev_y = y
+        self.dx = speed * dir_x
+        self.dy = speed * dir_y
+        self.damage = damage
         self.is_active = True
-        self.width = 2
-        self.height = 2
-        self.life_time = 90  # 3秒で消えるでやんす (30fps * 3s)
+        self.width = BULLET_SIZE
+        self.height = BULLET_SIZE
+        self.life_time = BULLET_LIFE  # 3秒で消えるでやんす (30fps * 3s)
         self.pierce_level = pierce_level # 貫通レベル (0で貫通なし、1以上で貫通)
         self.pierced_count = 0 # 実際に貫通した敵の数
-        self.hit_enemies = set() # 既にヒットした敵のIDを記録 (二重ヒット防止)
+        self.hit_enemies.clear() # 使い回すときはセットも作り直さずに空にする
 
     def get_damage(self):
         # 貫通回数に応じてダメージを減衰させるでやんす
         # 例えば、貫通1回ごとにダメージが20%減少する (調整可能)
         decay_rate = 0.2
         # ダメージが0を下回らないようにするでやんす
-        return max(0, BULLET_DAMAGE * (1 - self.pierced_count * decay_rate))
+        return max(0, self.damage * (1 - self.pierced_count * decay_rate))
 
     def update(self):
         if not self.is_active:
             return
+        self.prev_x = self.x
+        self.prev_y = self.y
         self.x += self.dx
         self.y += self.dy
         self.life_time -= 1
         if self.life_time <= 0:
             self.is_active = False
-        if not (0 <= self.x < SCREEN_WIDTH and 0 <= self.y < SCREEN_HEIGHT):
+        if not (0 <= self.x < WORLD_WIDTH and 0 <= self.y < WORLD_HEIGHT):
             self.is_active = False
 
-    def draw(self):
-        if self.is_active:
-            pyxel.rect(self.x, self.y, self.width, self.height, 8)
-
 
 class HomingBullet(Bullet):
-    def __init__(self, x, y, target_enemy, angle, pierce_level=0, homing_strength=0.05, homing_delay=30): # pierce_levelを追加
-        # 親クラスのコンストラクタを呼び出す
-        super().__init__(x, y, angle, pierce_level) # pierce_levelも渡すでやんす！
-        self.speed = BULLET_SPEED * 0.8  # 通常弾より少し遅くする
-        self.target = target_enemy
+    __slots__ = (
+        "speed",
+        "target_id",
+        "homing_strength",
+        "homing_delay",
+        "turn_cos",
+        "turn_sin",
+    )
+
+    def __init__(
+        self,
+        x,
+        y,
+        target_id,
+        dir_x,
+        dir_y,
+        pierce_level=0,
+        damage=BULLET_DAMAGE,
+        speed=BULLET_SPEED,
+        homing_strength=0.05,
+        homing_delay=30,
+    ): # pierce_levelを追加
+        self.hit_enemies = set()
+        self.reset(
+            x,
+            y,
+            target_id,
+            dir_x,
+            dir_y,
+            pierce_level,
+            damage,
+            speed,
+            homing_strength,
+            homing_delay,
+        )
+
+    def reset(
+        self,
+        x,
+        y,
+        target_id,
+        dir_x,
+        dir_y,
+        pierce_level=0,
+        damage=BULLET_DAMAGE,
+        speed=BULLET_SPEED,
+        homing_strength=0.05,
+        homing_delay=30,
+    ):
+        # 親クラスの初期化を呼び出す
+        # pierce_levelも渡すでやんす！
+        super().reset(x, y, dir_x, dir_y, pierce_level, damage, speed)
+        self.speed = speed * 0.8  # 通常弾より少し遅くする
+        self.target_id = target_id # 追尾する敵のID (EnemyStore.ids)
         self.homing_strength = homing_strength
-        self.width = 3  # 見分けがつくように少し大きくする
-        self.height = 3
-        self.life_time = 90  # 3秒で消えるでやんす (30fps * 3s)
+        # 1フレームに曲がれる最大の角度は homing_strength * 180度
+        self.turn_cos, self.turn_sin = turn_limit(homing_strength * math.pi)
+        self.width = HOMING_BULLET_SIZE
+        self.height = HOMING_BULLET_SIZE
+        self.life_time = BULLET_LIFE  # 3秒で消えるでやんす (30fps * 3s)
         self.homing_delay = homing_delay # 追尾開始までの猶予フレーム
 
     def update(self, enemies):
@@ -211,126 +554,110 @@ class HomingBullet(Bullet):
             # 猶予期間中は直進するでやんす（dx, dyは初期の方向を保持している）
         else:
             # ターゲットが存在し、かつアクティブか確認
-            if self.target and self.target.is_active:
-                # ターゲットへの角度を計算
-                target_angle = math.atan2(self.target.y - self.y, self.target.x - self.x)
-                current_angle = math.atan2(self.dy, self.dx)
-
-                # 角度の差を正規化
-                angle_diff = target_angle - current_angle
-                while angle_diff > math.pi:
-                    angle_diff -= 2 * math.pi
-                while angle_diff < -math.pi:
-                    angle_diff += 2 * math.pi
-
-                # homing_strengthに基づいて角度を徐々に変える
-                new_angle = current_angle + angle_diff * self.homing_strength
-                self.dx = self.speed * math.cos(new_angle)
-                self.dy = self.speed * math.sin(new_angle)
+            target_index = enemies.index_of(self.target_id)
+            if target_index is not None:
+                # ターゲットの方へ、1フレームに曲がれる角度だけ向きを変える
+                # (角度は使わない)
+                self.dx, self.dy = turn_towards(
+                    self.dx,
+                    self.dy,
+                    enemies.x[target_index] - self.x,
+                    enemies.y[target_index] - self.y,
+                    self.speed,
+                    self.turn_cos,
+                    self.turn_sin,
+                )
             # else の処理は既にコメントアウトして直進するように変更済み
         # ターゲットを失ったら直進するでやんす。速度はそのまま維持。
         # self.dx, self.dy はターゲット追尾中の最後の速度ベクトルを保持しているため、
         # これをそのまま利用すればよいでやんす。
 
+        self.prev_x = self.x
+        self.prev_y = self.y
         self.x += self.dx
         self.y += self.dy
-        if not (0 <= self.x < SCREEN_WIDTH and 0 <= self.y < SCREEN_HEIGHT):
+        if not (0 <= self.x < WORLD_WIDTH and 0 <= self.y < WORLD_HEIGHT):
             self.is_active = False
 
-    def find_closest_enemy(self, enemies):
-        closest_enemy = None
-        min_dist = float('inf')
-        for enemy in enemies:
-            if enemy.is_active:
-                dist = math.hypot(self.x - enemy.x, self.y - enemy.y)
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_enemy = enemy
-        return closest_enemy
-
-    def draw(self):
-        if self.is_active:
-            # 追尾弾は色を変える（例：シアン）
-            pyxel.rect(self.x, self.y, self.width, self.height, 12)
-
-
-class Enemy:
-    def __init__(self, player_x, player_y, phase=1):  # phase引数を追加
-        side = random.randint(0, 3)
-        if side == 0:
-            self.x, self.y = random.randint(0, SCREEN_WIDTH - 8), -8
-        elif side == 1:
-            self.x, self.y = SCREEN_WIDTH, random.randint(0, SCREEN_HEIGHT - 8)
-        elif side == 2:
-            self.x, self.y = random.randint(0, SCREEN_WIDTH - 8), SCREEN_HEIGHT
-        else:
-            self.x, self.y = -8, random.randint(0, SCREEN_HEIGHT - 8)
-
-        # フェーズに応じてステータスを決定
-        self.hp = int(ENEMY_HP * (1 + (phase - 1) * 0.5)) # フェーズごとに50%ずつHPを増加
-        self.speed = ENEMY_SPEED * (1 + (phase - 1) * 0.1) # フェーズごとに10%ずつスピードを増加
-        self.is_active = True
-        
-        # フェーズに応じて大きさと色を変える
-        size_multiplier = 1 + (phase - 1) * 0.2
-        self.width = int(8 * size_multiplier)
-        self.height = int(8 * size_multiplier)
-        self.color = 1 + ((phase - 1) % 14) # pyxelのカラーパレットに合わせて色をサイクルさせる (0は黒なので1から)
-        self.phase = phase
-
-    def update(self, player_x, player_y):
-        if not self.is_active:
-            return
-        angle = math.atan2(player_y - self.y, player_x - self.x)
-        self.x += self.speed * math.cos(angle)
-        self.y += self.speed * math.sin(angle)
-
-    def draw(self):
-        if self.is_active:
-            pyxel.rect(self.x, self.y, self.width, self.height, self.color)
+    def find_closest_enemy(self, enemies, enemy_grid):
+        # 最も近い敵のIDを返す (いなければNone)
+        closest_index = enemy_grid.nearest(self.x, self.y, valid=enemies.active)
+        if closest_index is None:
+            return None
+        return int(enemies.ids[closest_index])
+
+
+def spawn_enemy(enemies, view_x, view_y, phase=1, rng=random):
+    # 画面 (左上のワールド座標が (view_x, view_y) の範囲) のすぐ外のランダムな位置に、
+    # フェーズに応じたステータスの敵を1体出現させるでやんす
+    # rng にはランごとの乱数生成器 (Simulation.rng) を渡す (リプレイを再現できるように)
+    side = rng.randint(0, 3)
+    if side == 0:
+        x, y = rng.randint(0, SCREEN_WIDTH - 8), -8
+    elif side == 1:
+        x, y = SCREEN_WIDTH, rng.randint(0, SCREEN_HEIGHT - 8)
+    elif side == 2:
+        x, y = rng.randint(0, SCREEN_WIDTH - 8), SCREEN_HEIGHT
+    else:
+        x, y = -8, rng.randint(0, SCREEN_HEIGHT - 8)
+    x += view_x
+    y += view_y
+
+    # フェーズに応じてステータスを決定
+    hp = int(ENEMY_HP * (1 + (phase - 1) * 0.5)) # フェーズごとに50%ずつHPを増加
+    speed = ENEMY_SPEED * (1 + (phase - 1) * 0.1) # フェーズごとに10%ずつスピードを増加
+
+    # フェーズに応じて大きさと色を変える
+    size_multiplier = 1 + (phase - 1) * 0.2
+    size = int(8 * size_multiplier)
+    # pyxelのカラーパレットに合わせて色をサイクルさせる (0は黒なので1から)
+    color = 1 + ((phase - 1) % 14)
+    return enemies.spawn(x, y, hp, speed, size, phase, color)
 
 # ゴーストの攻撃レート (フレーム数)
 GHOST_ATTACK_INTERVAL = 30 # 1秒間に1回攻撃 (30FPS)
 GHOST_ATTACK_RANGE = 30 # ゴーストの攻撃範囲
 GHOST_ATTACK_EFFECT_DURATION = 5 # ゴーストが攻撃時に色が変わるフレーム数
+GHOST_SIZE = 6 # サイズを小さくする
 
 class Ghost:
-    def __init__(self, player_x, player_y, initial_player_bullet_damage):
+    def __init__(self, player_x, player_y, initial_player_bullet_damage, rng=random):
         self.x = player_x
         self.y = player_y
-        self.width = 6 # サイズを小さくする
-        self.height = 6 # サイズを小さくする
+        self.width = GHOST_SIZE
+        self.height = GHOST_SIZE
         self.original_color = 7 # 白色
         self.attack_color = 8 # 赤色 (攻撃時に変わる色)
         self.color = self.original_color
         self.is_active = True
-        self.target_offset_x = random.uniform(-20, 20) # プレイヤーの周りをふわふわするためのオフセット
-        self.target_offset_y = random.uniform(-20, 20)
+        # プレイヤーの周りをふわふわするためのオフセット
+        self.target_offset_x = rng.uniform(-20, 20)
+        self.target_offset_y = rng.uniform(-20, 20)
         self.speed = 0.8 # プレイヤー追従速度
-        
-        self.base_attack_damage = initial_player_bullet_damage * 2.0 # プレイヤー弾丸ダメージの200% (2倍)
+
+        # プレイヤー弾丸ダメージの200% (2倍)
+        self.base_attack_damage = initial_player_bullet_damage * 2.0
         self.current_attack_damage = self.base_attack_damage
         self.attack_timer = 0
         self.attack_interval = GHOST_ATTACK_INTERVAL
         self.attack_effect_timer = 0 # 攻撃エフェクト用タイマー
 
 
-    def update(self, player_x, player_y, player_level, enemies):
+    def update(self, player_x, player_y, damage_multiplier, enemies, enemy_grid):
         if not self.is_active:
             return
 
         # プレイヤーレベルに応じて攻撃力強化
-        # プレイヤーレベルが1上がるごとに1.1倍に強化される
-        self.current_attack_damage = self.base_attack_damage * (1.1 ** (player_level - 1))
+        # (damage_multiplier はプレイヤーレベルが1上がるごとに1.1倍になる倍率。
+        # Simulation.stats のキャッシュから渡されるので、ここでは掛け算だけ)
+        self.current_attack_damage = self.base_attack_damage * damage_multiplier
 
 
         # プレイヤーの周りを追従
         target_x = player_x + self.target_offset_x
         target_y = player_y + self.target_offset_y
-        
-        angle = math.atan2(target_y - self.y, target_x - self.x)
-        self.x += self.speed * math.cos(angle)
-        self.y += self.speed * math.sin(angle)
+
+        self.x, self.y = step_towards(self.x, self.y, target_x, target_y, self.speed)
 
         # 攻撃エフェクトタイマーの更新
         if self.attack_effect_timer > 0:
@@ -342,81 +669,260 @@ class Ghost:
         self.attack_timer += 1
         if self.attack_timer >= self.attack_interval:
             self.attack_timer = 0
-            
-            # 攻撃範囲内の最も近い敵を探す
-            closest_enemy = None
-            min_dist = GHOST_ATTACK_RANGE
-            for enemy in enemies:
-                if enemy.is_active:
-                    dist = math.hypot(self.x - enemy.x, self.y - enemy.y)
-                    if dist < min_dist:
-                        min_dist = dist
-                        closest_enemy = enemy
-            
-            if closest_enemy:
+
+            # 攻撃範囲内の最も近い敵を探す (範囲より外のセルは探さない)
+            closest_index = enemy_grid.nearest(
+                self.x, self.y, GHOST_ATTACK_RANGE, valid=enemies.active
+            )
+
+            if closest_index is not None:
                 # 敵にダメージを与える
-                closest_enemy.hp -= self.current_attack_damage
+                enemies.hp[closest_index] -= self.current_attack_damage
                 # 攻撃エフェクトを開始
                 self.color = self.attack_color
                 self.attack_effect_timer = GHOST_ATTACK_EFFECT_DURATION
-                # 敵が倒れたかどうかのチェックと経験値オーブの生成はAppクラス側で行うでやんす
-                # Appクラスのupdateメソッドで、全ての敵のhpをチェックして、0以下ならexp_orbを生成する
+                # 敵が倒れたかどうかのチェックと経験値オーブの生成は
+                # Appクラス側で行うでやんす
+                # Appクラスのupdateメソッドで、全ての敵のhpをチェックして、
+                # 0以下ならexp_orbを生成する
                 # という処理を入れれば良いでやんす。
-
-    def draw(self):
-        if self.is_active:
-            # 今回は単純に白い四角で表現するでやんす
-            pyxel.rect(self.x, self.y, self.width, self.height, self.color)
+                return closest_index # 攻撃した敵のインデックス (イベントログ用)
+        return None
 
 
 class ExperienceOrb:
+    # 弾と同じく __slots__ + reset() で使い回せるようにしてあるでやんす
+    # bucket: 置かれているセル (Simulation.orb_buckets のキー)。
+    # 吸い寄せられている間はNone
+    __slots__ = (
+        "x",
+        "y",
+        "value",
+        "life",
+        "is_active",
+        "width",
+        "height",
+        "color",
+        "bucket",
+    )
+
     def __init__(self, x, y, value, color=NORMAL_EXP_ORB_COLOR): # color引数を追加
+        self.reset(x, y, value, color)
+
+    def reset(self, x, y, value, color=NORMAL_EXP_ORB_COLOR):
         self.x = x
         self.y = y
         self.value = value
         self.life = EXP_ORB_LIFETIME
         self.is_active = True
-        self.width = 4
-        self.height = 4
+        self.width = EXP_ORB_SIZE
+        self.height = EXP_ORB_SIZE
         self.color = color # 色を保持するでやんす
+        self.bucket = None
+
+    def absorb(self, other):
+        # other の経験値をこのオーブにまとめる
+        # (多めのオーブを含んでいたら色も多めの方にする)
+        self.value += other.value
+        if other.color == BIG_EXP_ORB_COLOR:
+            self.color = BIG_EXP_ORB_COLOR
+        self.life = max(self.life, other.life)
 
     def update(self):
-        if not self.is_active:
+        # 地面に置かれている間だけ寿命が減る (吸い寄せられ始めたら消えない)
+        if not self.is_active or self.bucket is None:
             return
         self.life -= 1
         if self.life <= 0:
             self.is_active = False
 
-    def draw(self):
-        if self.is_active:
-            pyxel.rect(self.x, self.y, self.width, self.height, self.color)  # 指定された色で描画
+    def move_towards(self, x, y, speed):
+        # オーブの中心を (x, y) に向かって speed だけ動かす
+        half_w = self.width / 2
+        half_h = self.height / 2
+        x, y = step_towards(self.x + half_w, self.y + half_h, x, y, speed)
+        self.x = x - half_w
+        self.y = y - half_h
+
+
+class InputState:
+    # 1フレーム分の入力をまとめたもの (pyxelに依存しないのでヘッドレスでも使える)
+    def __init__(
+        self,
+        left=False,
+        right=False,
+        up=False,
+        down=False,
+        fire=False,
+        toggle_continuous_move=False,
+        mouse_x=0,
+        mouse_y=0,
+        menu_up=False,
+        menu_down=False,
+        confirm=False,
+        retry=False,
+        quit=False,
+    ):
+        self.left = left # 押しっぱなし判定 (btn)
+        self.right = right
+        self.up = up
+        self.down = down
+        self.fire = fire
+        # ここから下は押した瞬間 (btnp)
+        self.toggle_continuous_move = toggle_continuous_move
+        self.mouse_x = mouse_x
+        self.mouse_y = mouse_y
+        self.menu_up = menu_up
+        self.menu_down = menu_down
+        self.confirm = confirm
+        self.retry = retry
+        self.quit = quit
+
+
+class PyxelInputSource:
+    # pyxelのキーボード・マウスから InputState を作る入力ソース
+    # 押した瞬間の入力 (btnp) は latch() で pyxel のフレームごとに読んで貯めておき、
+    # 次の poll() で返す
+    # App は毎フレーム latch() を呼ぶので、シミュレーションを進めないフレーム
+    # (FixedTimestep が0回を返したとき) に押されたキーも捨てずに次の刻みで使う
+    # 同じフレームで2回以上 poll() されたら
+    # (遅れを取り戻すため1回の描画で何tickか進めるとき)、
+    # 押した瞬間の入力は最初の1回だけ返すでやんす
+    # (メニューが2つ進んだりしないように)
+    def __init__(self):
+        self.last_latch_frame = None
+        self.pending = InputState() # まだ poll() で返していない、押した瞬間の入力
 
+    def latch(self):
+        # このフレームの押した瞬間の入力を貯める (同じフレームで何度呼んでも1回だけ読む)
+        if pyxel.frame_count == self.last_latch_frame:
+            return
+        self.last_latch_frame = pyxel.frame_count
+        pending = self.pending
+        pending.toggle_continuous_move |= pyxel.btnp(pyxel.KEY_LSHIFT)
+        pending.menu_up |= pyxel.btnp(pyxel.KEY_UP)
+        pending.menu_down |= pyxel.btnp(pyxel.KEY_DOWN)
+        pending.confirm |= pyxel.btnp(pyxel.KEY_RETURN) or pyxel.btnp(pyxel.KEY_Z)
+        pending.retry |= pyxel.btnp(pyxel.KEY_R)
+        pending.quit |= pyxel.btnp(pyxel.KEY_Q)
+
+    def poll(self):
+        self.latch()
+        pending = self.pending
+        self.pending = InputState()
+        return InputState(
+            left=pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.KEY_A),
+            right=pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.KEY_D),
+            up=pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.KEY_W),
+            down=pyxel.btn(pyxel.KEY_DOWN) or pyxel.btn(pyxel.KEY_S),
+            fire=pyxel.btn(pyxel.KEY_SPACE),
+            toggle_continuous_move=pending.toggle_continuous_move,
+            mouse_x=pyxel.mouse_x,
+            mouse_y=pyxel.mouse_y,
+            menu_up=pending.menu_up,
+            menu_down=pending.menu_down,
+            confirm=pending.confirm,
+            retry=pending.retry,
+            quit=pending.quit,
+        )
 
-class App:
-    def __init__(self):
-        pyxel.init(SCREEN_WIDTH, SCREEN_HEIGHT, title="Vampire Survivors-like")
 
-        self.debug_abilities = []
-        if len(sys.argv) > 1:
-            # コマンドライン引数からデバッグ用アビリティを取得
-            # 例: uv run main.py --piercing_shot --summon_ghost
-            for arg in sys.argv[1:]:
-                if arg.startswith('--'):
-                    self.debug_abilities.append(arg[2:].replace('_', ' ').title())
+class IdleInputSource:
+    # 何も入力しない入力ソース (ヘッドレスの負荷テスト用)
+    def latch(self):
+        pass
 
+    def poll(self):
+        return InputState()
+
+
+class FrameClock:
+    # Simulation.step() ごとに1フレーム進む独自クロック
+    def __init__(self, frame_count=0):
+        self.frame_count = frame_count
+
+    def tick(self):
+        self.frame_count += 1
+
+
+class FixedTimestep:
+    # 実際に経った時間を貯めておき、
+    # 固定の刻みで何回シミュレーションを進めるかを決めるでやんす
+    # 描画が遅れたら1回の描画の間に何回か進めて追いつく (間の描画は飛ばす)
+    # max_ticks_per_frame を超える遅れは捨てる (その分だけはゲームが遅くなる)
+    def __init__(
+        self,
+        ticks_per_second=SIM_FPS,
+        max_ticks_per_frame=MAX_TICKS_PER_FRAME,
+        now=time.perf_counter,
+    ):
+        self.tick_seconds = 1 / ticks_per_second
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.now = now
+        self.last_time = None
+        self.accumulator = 0.0
+        self.dropped_ticks = 0 # 上限を超えて捨てた刻みの数
+        self.skipped_draws = 0 # 2回以上進めたので描画しなかった刻みの数
+
+    def advance(self):
+        # 今回の描画までに進めるシミュレーションの回数を返す
+        now = self.now()
+        if self.last_time is None:
+            self.last_time = now
+            return 1
+        self.accumulator += now - self.last_time
+        self.last_time = now
+        ticks = int(self.accumulator / self.tick_seconds + TIMESTEP_SLOP)
+        if ticks > self.max_ticks_per_frame:
+            self.dropped_ticks += ticks - self.max_ticks_per_frame
+            ticks = self.max_ticks_per_frame
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= ticks * self.tick_seconds
+        if ticks > 1:
+            self.skipped_draws += ticks - 1
+        return ticks
+
+
+class Simulation:
+    # ゲームの状態とロジック本体 (pyxelのウィンドウなしで step() できる)
+    def __init__(self, debug_abilities=(), clock=None, seed=None):
+        self.debug_abilities = list(debug_abilities)
+        # ランごとの乱数生成器。ゲーム内の乱数は全てこれを使うので、
+        # シードと入力が同じなら同じ展開になる (リプレイ用)
+        # シード省略時はランダムに決めるでやんす
+        if seed is None:
+            seed = random.SystemRandom().randrange(2**63)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        # フレームクロックは差し替え可能 (省略時はstep()ごとに1進む独自クロック)
+        self.clock = clock if clock is not None else FrameClock()
+        # Qキーで終了が要求されたらTrue (終了処理はApp側で行う)
+        self.quit_requested = False
+        self.mouse_x = 0 # 最後に受け取ったマウス座標 (照準の描画に使う)
+        self.mouse_y = 0
+        # 処理の区間ごとの計測 (FrameProfilerを入れたときだけ計測する)
+        self.profiler = NULL_PROFILER
+        # プレイの記録
+        # (EventLogを入れたときだけ記録する。リトライをまたいで同じログに書く)
+        self.events = NULL_EVENT_LOG
+
+        # 弾と経験値オーブのフリーリスト (リトライをまたいで使い回す)
+        self.bullet_pool = ObjectPool(Bullet)
+        self.homing_bullet_pool = ObjectPool(HomingBullet)
+        self.orb_pool = ObjectPool(ExperienceOrb)
+        self.scheduler = self.build_scheduler()
 
         self.reset_game_state()
 
-        pyxel.mouse(False)
-        pyxel.run(self.update, self.draw)
-
     def level_up(self):
         self.player_level += 1
+        self.stats.set_base(STAT_LEVEL, self.player_level)
         self.player_exp -= self.exp_to_next_level
         self.exp_to_next_level = int(
-            self.exp_to_next_level * 1.5
+            self.exp_to_next_level * EXP_LEVEL_UP_MULTIPLIER
         )  # 次のレベルに必要な経験値を1.5倍にするでやんす
-        self.player_hp = self.player_max_hp  # HPを全回復するでやんす
+        self.player_hp = self.stats.get(STAT_MAX_HP)  # HPを全回復するでやんす
 
         # 取得可能なアビリティのリストを作成
         available_abilities = []
@@ -429,31 +935,68 @@ class App:
 
         # 選択可能なアビリティが3つ未満の場合、可能な限り選択するでやんす
         num_choices = min(3, len(available_abilities))
-        self.selected_abilities_for_level_up = random.sample(available_abilities, num_choices)
+        self.selected_abilities_for_level_up = self.rng.sample(
+            available_abilities, num_choices
+        )
         self.current_ability_selection_index = 0  # 選択中のアビリティのインデックス
+        if self.events.enabled:
+            offered = 0 # 選択肢のアビリティ番号 (ALL_ABILITIES の添字) のビット
+            for ability in self.selected_abilities_for_level_up:
+                offered |= 1 << ALL_ABILITIES.index(ability)
+            self.events.emit(EVENT_LEVEL_UP, value=self.player_level, extra=offered)
 
         self.game_state = (
             GAME_STATE_LEVEL_UP  # ゲーム状態をレベルアップ選択に切り替えるでやんす
         )
 
     def reset_game_state(self):
-        self.player_x = SCREEN_WIDTH / 2
-        self.player_y = SCREEN_HEIGHT / 2
+        self.player_x = WORLD_WIDTH / 2
+        self.player_y = WORLD_HEIGHT / 2
         self.player_width = 8
         self.player_height = 8
-        self.player_max_hp = 3
-        self.player_hp = self.player_max_hp
+        self.camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT, WORLD_WIDTH, WORLD_HEIGHT)
+        self.follow_player()
+        # 遠くのチャンクで休眠している敵
+        self.chunks = ChunkMap(CHUNK_SIZE, CHUNK_ACTIVE_MARGIN)
+        self.enemy_lod = LodScheduler(LOD_RADII, LOD_UPDATE_BUDGET, LOD_MAX_PERIOD)
         self.player_level = 1
+        # 能力値 (アビリティの修正値を反映した値は self.stats.get() で読む)
+        self.stats = Stats(
+            {
+                STAT_LEVEL: self.player_level,
+                STAT_MAX_HP: 3,
+                STAT_MOVE_SPEED: 1.0,  # プレイヤーの移動速度の初期値
+                STAT_BULLET_DAMAGE: BULLET_DAMAGE,  # 弾のダメージ
+                STAT_BULLET_SPEED: BULLET_SPEED,
+                STAT_SHOT_COOLDOWN: 10,  # 1秒間に3発 (30FPSなので 30 / 3 = 10フレーム)
+                STAT_FIRE_RATE: 1.0, # 発射レートの乗数
+            }
+        )
+        self.player_hp = self.stats.get(STAT_MAX_HP)
         self.player_exp = 0
         self.exp_to_next_level = 5  # 次のレベルアップに必要な経験値
-        self.player_speed = 1.0  # プレイヤーの移動速度の初期値
 
-        self.bullet_damage = BULLET_DAMAGE  # 弾のダメージ
-        self.bullet_bullet_speed_multiplier = 1.0  # 弾速の倍率
-
-        self.bullets = []
-        self.enemies = []
+        self.bullets = [] # 普通の弾
+        # 追尾弾 (弾の種類ごとにリストを分け、それぞれ専用のシステムで更新する)
+        self.homing_bullets = []
+        self.projectiles = ProjectileStore() # 弾幕の武器の弾 (配列でまとめて持つ)
+        self.enemies = EnemyStore()
         self.exp_orbs = []  # 経験値オーブを管理するリストでやんす
+        # 敵の空間インデックス (毎フレーム作り直す)。
+        # 衝突判定・自動照準・ゴースト・追尾弾で共有する
+        self.enemy_grid = PointGrid(SPATIAL_CELL_SIZE)
+        self.flow_field = FlowField(
+            -FLOW_FIELD_MARGIN,
+            -FLOW_FIELD_MARGIN,
+            WORLD_WIDTH + FLOW_FIELD_MARGIN * 2,
+            WORLD_HEIGHT + FLOW_FIELD_MARGIN * 2,
+            FLOW_FIELD_CELL_SIZE,
+        )
+        # 地面にある経験値オーブ (1セルに1個。同じセルに落ちたものはまとめる)
+        self.orb_buckets = BucketGrid(EXP_ORB_MERGE_CELL_SIZE)
+        self.magnet_orbs = [] # プレイヤーに吸い寄せられている途中のオーブ
+        # exp_orbs のこれより前には、まとめ先にできるオーブがない
+        self.oldest_orb_cursor = 0
         self.enemy_spawn_timer = 0
         self.invincible_timer = 0  # 無敵時間タイマー
         self.is_invincible = False  # 無敵状態フラグ
@@ -463,15 +1006,23 @@ class App:
         self.selected_abilities_for_level_up = []
         self.current_ability_selection_index = 0
         self.has_auto_aim_bullet = False
-        self.shot_cooldown_frames = 10  # 1秒間に3発 (30FPSなので 30 / 3 = 10フレーム)
         self.last_shot_frame = -10  # 最初の発射をすぐできるように初期値を設定
-        self.player_fire_rate_multiplier = 1.0 # 発射レートの乗数
         self.current_phase = 1  # 現在のゲームフェーズ
         self.has_piercing_shot = False # 貫通弾アビリティを持っているか
         self.pierce_level = 0 # 貫通レベル (貫通できる敵の数 + 1)
         self.acquired_ability_levels = {} # 取得済みアビリティのレベルを記録する辞書
         self.has_ghost_summon = False # ゴースト召喚アビリティを持っているか
         self.ghosts = [] # 召喚されたゴーストオブジェクトを保持するリスト
+        # 弾幕の武器のレベル (0なら持っていない) と、次に撃つまでのタイマー
+        self.spread_level = 0
+        self.nova_level = 0
+        self.orbit_level = 0
+        self.chain_level = 0
+        self.nova_timer = 0
+        self.orbit_timer = 0
+        self.chain_timer = 0
+        # 倒した敵の数 ({敵のフェーズ: 数}、バランス調整の集計用)
+        self.kills_by_phase = {}
 
         # 移動しっぱなしモード関連
         self.is_continuous_move_mode_on = False # 移動しっぱなしモードのオン/オフ
@@ -491,272 +1042,680 @@ class App:
 
 
 
+    def aim_direction(self, inputs):
+        # プレイヤーからマウスカーソルへの向き (単位ベクトル)
+        # マウス座標は画面の座標なので、カメラの位置を足してワールドの座標にする
+        # カーソルがプレイヤーにぴったり重なっているときは右向き (atan2(0, 0) と同じ)
+        dir_x, dir_y = normalize(
+            inputs.mouse_x + self.camera.x - self.player_x,
+            inputs.mouse_y + self.camera.y - self.player_y,
+        )
+        if dir_x == 0 and dir_y == 0:
+            return 1.0, 0.0
+        return dir_x, dir_y
+
     def find_closest_enemy_for_player(self):
-        closest_enemy = None
-        min_dist = float('inf')
-        for enemy in self.enemies:
-            if enemy.is_active:
-                dist = math.hypot(self.player_x - enemy.x, self.player_y - enemy.y)
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_enemy = enemy
-        return closest_enemy
+        # プレイヤーに最も近い敵のIDを返す (いなければNone)
+        closest_index = self.enemy_grid.nearest(
+            self.player_x, self.player_y, valid=self.enemies.active
+        )
+        if closest_index is None:
+            return None
+        return int(self.enemies.ids[closest_index])
+
+    def add_exp_orb(self, orb):
+        # 同じセルに既にオーブがあれば、そちらに経験値をまとめて、
+        # 新しいオーブは置かないでやんす
+        key = self.orb_buckets.key(orb.x, orb.y)
+        target = self.orb_buckets.get(key)
+        if target is not None:
+            target.absorb(orb)
+            self.orb_pool.release(orb)
+            return
+        orb.bucket = key
+        self.orb_buckets.put(key, orb)
+        self.exp_orbs.append(orb)
+        if len(self.orb_buckets) > MAX_EXP_ORBS:
+            self.fold_oldest_exp_orb()
+
+    def fold_oldest_exp_orb(self):
+        # 地面にある一番古いオーブを、周りのセルのオーブ
+        # (なければ一番新しいオーブ) にまとめる
+        orbs = self.exp_orbs
+        i = self.oldest_orb_cursor
+        while orbs[i].bucket is None:
+            i += 1
+        self.oldest_orb_cursor = i + 1
+        oldest = orbs[i]
+        self.orb_buckets.discard(oldest.bucket, oldest)
+        target = self.orb_buckets.neighbour(oldest.bucket, oldest) or orbs[-1]
+        target.absorb(oldest)
+        oldest.value = 0
+        oldest.is_active = False
+        oldest.bucket = None
+
+    def release_exp_orb(self, orb):
+        if orb.bucket is not None:
+            self.orb_buckets.discard(orb.bucket, orb)
+        self.orb_pool.release(orb)
+
+    def move_enemies(self):
+        # フローフィールドの向きに、近くの敵から離れる力を足した向きに敵を動かすでやんす
+        # プレイヤーから遠い敵は毎フレームではなく、
+        # LODのティアの間隔ごとにまとめて動かす
+        enemies = self.enemies
+        n = enemies.count
+        if n == 0:
+            return
+        self.flow_field.update(self.player_x, self.player_y)
+        x = enemies.x[:n]
+        y = enemies.y[:n]
+        ids = enemies.ids[:n]
+        due, steps = self.enemy_lod.select(
+            x,
+            y,
+            ids,
+            self.player_x + self.player_width / 2,
+            self.player_y + self.player_height / 2,
+            self.clock.frame_count,
+        )
+        if len(due) == 0:
+            return
+        dir_x, dir_y = self.flow_field.sample(
+            x[due], y[due], self.player_x, self.player_y
+        )
+        push_x, push_y = separation(x, y, ids, CROWD_CELL_SIZE, which=due)
+        move_x = dir_x + push_x * CROWD_SEPARATION_WEIGHT
+        move_y = dir_y + push_y * CROWD_SEPARATION_WEIGHT
+        # 押されても speed より速くは動かない
+        length = np.hypot(move_x, move_y)
+        scale = np.minimum(
+            1.0, np.divide(1.0, length, out=np.ones(len(due)), where=length > 0)
+        )
+        enemies.move_some(due, move_x * scale, move_y * scale, steps)
+
+    def rebuild_enemy_grid(self):
+        # 敵の左上座標でグリッドを作る。インデックスは EnemyStore のものと同じでやんす
+        enemies = self.enemies
+        n = enemies.count
+        max_size = float(enemies.size[:n].max()) if n else 0.0
+        self.enemy_grid.build(enemies.x[:n], enemies.y[:n], max_size)
+
+    def build_scheduler(self):
+        # プレイ中の1ステップで実行するシステム (この順番で実行する)
+        # 新しい武器や敵を足すときは、そのシステムをここ
+        # (か scheduler.add()) で差し込むでやんす
+        scheduler = Scheduler()
+        scheduler.add(PHASE_PLAYER, self.move_player)
+        scheduler.add(PHASE_ENEMIES, self.update_enemies)
+        scheduler.add(PHASE_FIRE, self.fire)
+        scheduler.add(PHASE_WEAPONS, self.fire_weapons)
+        scheduler.add(PHASE_BULLETS, self.move_bullets)
+        scheduler.add(PHASE_HOMING, self.steer_homing_bullets)
+        scheduler.add(PHASE_PROJECTILES, self.move_projectiles)
+        scheduler.add(PHASE_ORBS, self.age_exp_orbs)
+        scheduler.add(PHASE_GHOSTS, self.update_ghosts)
+        scheduler.add(PHASE_COLLISION, self.collide_bullets)
+        scheduler.add(PHASE_COLLISION, self.collide_projectiles)
+        scheduler.add(PHASE_KILL, self.kill_enemies)
+        scheduler.add(PHASE_DAMAGE, self.damage_player)
+        scheduler.add(PHASE_PICKUP, self.pick_up_exp_orbs)
+        scheduler.add(PHASE_CLEANUP, self.clean_up)
+        return scheduler
+
+    def move_player(self, inputs):
+        speed = self.stats.get(STAT_MOVE_SPEED)
+        # LShiftキーで移動しっぱなしモードをトグル
+        if inputs.toggle_continuous_move:
+            self.is_continuous_move_mode_on = not self.is_continuous_move_mode_on
+            # モードがオフになったら、継続移動を停止
+            if not self.is_continuous_move_mode_on:
+                self.continuous_move_dx = 0
+                self.continuous_move_dy = 0
+
+        # プレイヤーの移動処理
+        if self.is_continuous_move_mode_on:
+            # 継続移動モードがオンの場合
+            input_dx = 0
+            input_dy = 0
+            if inputs.left:
+                input_dx -= 1
+            if inputs.right:
+                input_dx += 1
+            if inputs.up:
+                input_dy -= 1
+            if inputs.down:
+                input_dy += 1
+
+            # 新しい方向入力があれば、継続移動の方向を更新
+            if input_dx != 0 or input_dy != 0:
+                self.continuous_move_dx = input_dx
+                self.continuous_move_dy = input_dy
+
+            # 継続移動を実行
+            self.player_x += self.continuous_move_dx * speed
+            self.player_y += self.continuous_move_dy * speed
 
-    def update(self):
-        if self.game_state == GAME_STATE_PLAYING:
-            # LShiftキーで移動しっぱなしモードをトグル
-            if pyxel.btnp(pyxel.KEY_LSHIFT):
-                self.is_continuous_move_mode_on = not self.is_continuous_move_mode_on
-                # モードがオフになったら、継続移動を停止
-                if not self.is_continuous_move_mode_on:
-                    self.continuous_move_dx = 0
-                    self.continuous_move_dy = 0
-
-            # プレイヤーの移動処理
-            if self.is_continuous_move_mode_on:
-                # 継続移動モードがオンの場合
-                input_dx = 0
-                input_dy = 0
-                if pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.KEY_A):
-                    input_dx -= 1
-                if pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.KEY_D):
-                    input_dx += 1
-                if pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.KEY_W):
-                    input_dy -= 1
-                if pyxel.btn(pyxel.KEY_DOWN) or pyxel.btn(pyxel.KEY_S):
-                    input_dy += 1
-
-                # 新しい方向入力があれば、継続移動の方向を更新
-                if input_dx != 0 or input_dy != 0:
-                    self.continuous_move_dx = input_dx
-                    self.continuous_move_dy = input_dy
-                
-                # 継続移動を実行
-                self.player_x += self.continuous_move_dx * self.player_speed
-                self.player_y += self.continuous_move_dy * self.player_speed
+        else:
+            # 継続移動モードがオフの場合（通常の移動）
+            if inputs.left:
+                self.player_x -= speed
+            if inputs.right:
+                self.player_x += speed
+            if inputs.up:
+                self.player_y -= speed
+            if inputs.down:
+                self.player_y += speed
+
+        self.player_x = max(0, min(self.player_x, WORLD_WIDTH - self.player_width))
+        self.player_y = max(
+            0, min(self.player_y, WORLD_HEIGHT - self.player_height)
+        )
 
-            else:
-                # 継続移動モードがオフの場合（通常の移動）
-                if pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.KEY_A):
-                    self.player_x -= self.player_speed
-                if pyxel.btn(pyxel.KEY_RIGHT) or pyxel.btn(pyxel.KEY_D):
-                    self.player_x += self.player_speed
-                if pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.KEY_W):
-                    self.player_y -= self.player_speed
-                if pyxel.btn(pyxel.KEY_DOWN) or pyxel.btn(pyxel.KEY_S):
-                    self.player_y += self.player_speed
-
-            self.player_x = max(0, min(self.player_x, SCREEN_WIDTH - self.player_width))
-            self.player_y = max(
-                0, min(self.player_y, SCREEN_HEIGHT - self.player_height)
+        # 移動しっぱなしモードで壁に到達したら停止する
+        if self.is_continuous_move_mode_on:
+            if self.player_x <= 0 or self.player_x >= WORLD_WIDTH - self.player_width:
+                self.continuous_move_dx = 0
+            if self.player_y <= 0 or self.player_y >= WORLD_HEIGHT - self.player_height:
+                self.continuous_move_dy = 0
+        self.follow_player()
+
+    def follow_player(self):
+        self.camera.follow(
+            self.player_x + self.player_width / 2,
+            self.player_y + self.player_height / 2,
+        )
+
+    def update_enemies(self, inputs):
+        # カメラの近くのチャンクの敵を起こし、遠くに離れた敵を眠らせてから動かす
+        self.chunks.update(self.camera, self.enemies)
+        self.move_enemies() # 全ての敵をまとめて移動
+
+        # ゲーム時間に応じてフェーズを更新
+        frame_count = self.clock.frame_count
+        # 1分 (30FPS * 60秒 = 1800フレーム) ごとにフェーズ更新
+        if frame_count > 0 and frame_count % 1800 == 0:
+            self.current_phase += 1
+            # print(f"Phase changed to: {self.current_phase}") # デバッグ用
+
+        # 敵の出現ロジック
+        self.enemy_spawn_timer += 1
+        if self.enemy_spawn_timer >= ENEMY_SPAWN_INTERVAL:
+            # 現在のフェーズを渡して敵を生成
+            enemy_id = spawn_enemy(
+                self.enemies, self.camera.x, self.camera.y, self.current_phase, self.rng
             )
-            
-            # 移動しっぱなしモードで壁に到達したら停止する
-            if self.is_continuous_move_mode_on:
-                if self.player_x <= 0 or self.player_x >= SCREEN_WIDTH - self.player_width:
-                    self.continuous_move_dx = 0
-                if self.player_y <= 0 or self.player_y >= SCREEN_HEIGHT - self.player_height:
-                    self.continuous_move_dy = 0
-
-            # スペースキーで銃弾発射
-            if pyxel.btn(pyxel.KEY_SPACE) and pyxel.frame_count >= self.last_shot_frame + (self.shot_cooldown_frames / self.player_fire_rate_multiplier):
-                self.last_shot_frame = pyxel.frame_count # 発射時刻を更新
-                if self.has_auto_aim_bullet:
-                    # 自動追尾弾アビリティがある場合、HomingBulletを発射
-                    closest_enemy = self.find_closest_enemy_for_player()
-                    if closest_enemy:
-                        # プレイヤーからマウスカーソルへの角度を計算
-                        angle = math.degrees(
-                            math.atan2(
-                                pyxel.mouse_y - self.player_y, pyxel.mouse_x - self.player_x
-                            )
-                        )
-                        self.bullets.append(
-                            HomingBullet(
-                                self.player_x + self.player_width / 2,
-                                self.player_y + self.player_height / 2,
-                                closest_enemy,
-                                angle,
-                                self.pierce_level, # pierce_levelを渡すでやんす！
-                            )
-                        )
-                else:
-                    # 通常の弾丸を発射
-                    angle = math.degrees(
-                        math.atan2(
-                            pyxel.mouse_y - self.player_y, pyxel.mouse_x - self.player_x
-                        )
-                    )
-                    self.bullets.append(
-                        Bullet(
-                            self.player_x + self.player_width / 2,
-                            self.player_y + self.player_height / 2,
-                            angle,
+            if self.events.enabled:
+                enemies = self.enemies
+                i = enemies.count - 1
+                self.events.emit(
+                    EVENT_SPAWN,
+                    entity=enemy_id,
+                    x=float(enemies.x[i]),
+                    y=float(enemies.y[i]),
+                    value=float(enemies.hp[i]),
+                    extra=self.current_phase,
+                )
+            self.enemy_spawn_timer = 0
+
+        # このフレームの敵の位置が決まったので、空間インデックスを作り直す
+        # (ここから後の自動照準・追尾弾・ゴースト・衝突判定は全てこれを使う)
+        self.rebuild_enemy_grid()
+
+    def fire(self, inputs):
+        # スペースキーで銃弾発射
+        frame_count = self.clock.frame_count
+        stats = self.stats
+        shot_interval = stats.get(STAT_SHOT_INTERVAL)
+        if inputs.fire and frame_count >= self.last_shot_frame + shot_interval:
+            self.last_shot_frame = frame_count # 発射時刻を更新
+            center_x = self.player_x + self.player_width / 2
+            center_y = self.player_y + self.player_height / 2
+            dir_x, dir_y = self.aim_direction(inputs)
+            if self.has_auto_aim_bullet:
+                # 自動追尾弾アビリティがある場合、HomingBulletを発射
+                closest_enemy = self.find_closest_enemy_for_player()
+                if closest_enemy is not None:
+                    self.homing_bullets.append(
+                        self.homing_bullet_pool.acquire(
+                            center_x,
+                            center_y,
+                            closest_enemy,
+                            dir_x,
+                            dir_y,
                             self.pierce_level, # pierce_levelを渡すでやんす！
+                            stats.get(STAT_BULLET_DAMAGE),
+                            stats.get(STAT_BULLET_SPEED),
                         )
                     )
-            for bullet in self.bullets:
-                if isinstance(bullet, HomingBullet):
-                    bullet.update(self.enemies)
-                else:
-                    bullet.update()
-            for enemy in self.enemies:
-                enemy.update(self.player_x, self.player_y)
-            for orb in self.exp_orbs:
-                orb.update()
-            for ghost in self.ghosts: # ゴーストの更新
-                ghost.update(self.player_x, self.player_y, self.player_level, self.enemies)
-
-            # ゲーム時間に応じてフェーズを更新
-            if pyxel.frame_count > 0 and pyxel.frame_count % 1800 == 0: # 1分 (30FPS * 60秒 = 1800フレーム) ごとにフェーズ更新
-                self.current_phase += 1
-                # print(f"Phase changed to: {self.current_phase}") # デバッグ用
-
-            # 敵の出現ロジック
-            self.enemy_spawn_timer += 1
-            if self.enemy_spawn_timer >= ENEMY_SPAWN_INTERVAL:
-                # 現在のフェーズを渡して敵を生成
-                self.enemies.append(Enemy(self.player_x, self.player_y, self.current_phase))
-                self.enemy_spawn_timer = 0
-
-            # --- 衝突判定とダメージ処理 ---
-            # 銃弾と敵の衝突判定
-            for bullet in self.bullets:
+            if self.spread_level > 0:
+                # 拡散弾: 狙った向きを真ん中にした扇形でまとめて撃つ
+                # (通常の弾の代わりに撃つ。自動追尾弾を持っていれば、追尾弾と一緒に撃つ)
+                self.projectiles.spread(
+                    center_x,
+                    center_y,
+                    dir_x,
+                    dir_y,
+                    1 + 2 * self.spread_level,
+                    SPREAD_ANGLE_STEP,
+                    stats.get(STAT_BULLET_SPEED),
+                    BULLET_SIZE,
+                    stats.get(STAT_BULLET_DAMAGE),
+                    BULLET_LIFE,
+                    self.pierce_level,
+                    SPREAD_COLOR,
+                )
+            elif not self.has_auto_aim_bullet:
+                # 通常の弾丸を発射
+                self.bullets.append(
+                    self.bullet_pool.acquire(
+                        center_x,
+                        center_y,
+                        dir_x,
+                        dir_y,
+                        self.pierce_level, # pierce_levelを渡すでやんす！
+                        stats.get(STAT_BULLET_DAMAGE),
+                        stats.get(STAT_BULLET_SPEED),
+                    )
+                )
+
+    def fire_weapons(self, inputs):
+        # 弾幕の武器 (ノヴァ・オービット・チェーン) は、それぞれの間隔で勝手に撃つ
+        center_x = self.player_x + self.player_width / 2
+        center_y = self.player_y + self.player_height / 2
+        damage = self.stats.get(STAT_BULLET_DAMAGE)
+        projectiles = self.projectiles
+        if self.nova_level > 0:
+            self.nova_timer += 1
+            if self.nova_timer >= NOVA_INTERVAL:
+                self.nova_timer = 0
+                projectiles.nova(
+                    center_x,
+                    center_y,
+                    NOVA_BASE_COUNT + NOVA_COUNT_PER_LEVEL * (self.nova_level - 1),
+                    NOVA_SPEED,
+                    NOVA_SIZE,
+                    damage,
+                    NOVA_LIFE,
+                    self.pierce_level,
+                    NOVA_COLOR,
+                )
+        if self.orbit_level > 0:
+            self.orbit_timer += 1
+            if self.orbit_timer >= ORBIT_INTERVAL:
+                self.orbit_timer = 0
+                projectiles.orbit(
+                    center_x,
+                    center_y,
+                    1 + self.orbit_level,
+                    ORBIT_RADIUS,
+                    ORBIT_ANGULAR_SPEED,
+                    ORBIT_SIZE,
+                    damage,
+                    ORBIT_LIFE,
+                    ORBIT_COLOR,
+                )
+        if self.chain_level > 0:
+            self.chain_timer += 1
+            if self.chain_timer >= CHAIN_INTERVAL:
+                closest_index = self.enemy_grid.nearest(
+                    self.player_x, self.player_y, valid=self.enemies.active
+                )
+                if closest_index is not None: # 敵がいなければ、いるようになるまで待つ
+                    self.chain_timer = 0
+                    dir_x, dir_y = normalize(
+                        float(self.enemies.x[closest_index]) - self.player_x,
+                        float(self.enemies.y[closest_index]) - self.player_y,
+                    )
+                    if dir_x == 0 and dir_y == 0:
+                        dir_x = 1.0
+                    projectiles.chain(
+                        center_x,
+                        center_y,
+                        dir_x,
+                        dir_y,
+                        CHAIN_BASE_COUNT + self.chain_level - 1,
+                        CHAIN_DELAY,
+                        CHAIN_SPEED,
+                        CHAIN_SIZE,
+                        damage,
+                        CHAIN_LIFE,
+                        self.pierce_level,
+                        CHAIN_COLOR,
+                    )
+
+    def move_bullets(self, inputs):
+        for bullet in self.bullets:
+            bullet.update()
+
+    def steer_homing_bullets(self, inputs):
+        enemies = self.enemies
+        for bullet in self.homing_bullets:
+            bullet.update(enemies)
+
+    def move_projectiles(self, inputs):
+        # 弾幕の弾をまとめて動かし、寿命が尽きた弾とワールドの外に出た弾を消す
+        self.projectiles.update(
+            self.player_x + self.player_width / 2,
+            self.player_y + self.player_height / 2,
+            0,
+            0,
+            WORLD_WIDTH,
+            WORLD_HEIGHT,
+        )
+
+    def age_exp_orbs(self, inputs):
+        orb_buckets = self.orb_buckets
+        for orb in self.exp_orbs:
+            orb.update()
+            if not orb.is_active and orb.bucket is not None:
+                # 寿命が尽きたオーブはすぐにセルから外す (上限の判定を正しくするため)
+                orb_buckets.discard(orb.bucket, orb)
+                orb.bucket = None
+
+    def update_ghosts(self, inputs):
+        damage_multiplier = self.stats.get(STAT_GHOST_DAMAGE_MULTIPLIER)
+        enemies = self.enemies
+        events = self.events
+        for ghost in self.ghosts: # ゴーストの更新
+            hit = ghost.update(
+                self.player_x,
+                self.player_y,
+                damage_multiplier,
+                enemies,
+                self.enemy_grid,
+            )
+            if hit is not None and events.enabled:
+                events.emit(
+                    EVENT_DAMAGE,
+                    SOURCE_GHOST,
+                    int(enemies.ids[hit]),
+                    float(enemies.x[hit]),
+                    float(enemies.y[hit]),
+                    ghost.current_attack_damage,
+                )
+
+    def collide_bullets(self, inputs):
+        # 銃弾と敵の衝突判定
+        # (ダメージを与えるだけで、倒れた敵は kill_enemies() でまとめて処理する)
+        # 弾がこのフレームで動いた経路ごと判定するので、速い弾でも小さい敵をすり抜けない
+        # (経路が通るセルにいる敵だけを調べ、
+        # 当たった順 (当たった時刻の順) に処理するでやんす)
+        # 位置はこのフレームの間は変わらないので、Pythonのリストにしてから使うでやんす
+        # (NumPy配列を1要素ずつ読むより速い)
+        enemies = self.enemies
+        enemy_x = enemies.x[: enemies.count].tolist()
+        enemy_y = enemies.y[: enemies.count].tolist()
+        enemy_size = enemies.size[: enemies.count].tolist()
+        enemy_ids = enemies.ids[: enemies.count].tolist()
+        enemy_active = enemies.active
+        enemy_hp = enemies.hp
+        events = self.events
+
+        for bullets, source in (
+            (self.bullets, SOURCE_BULLET),
+            (self.homing_bullets, SOURCE_HOMING),
+        ):
+            for bullet in bullets:
                 if not bullet.is_active:
                     continue
-                for enemy in self.enemies:
-                    if not enemy.is_active:
+                start_x = bullet.prev_x
+                start_y = bullet.prev_y
+                move_x = bullet.x - start_x
+                move_y = bullet.y - start_y
+                hits = []
+                for i in self.enemy_grid.query_rect(
+                    min(start_x, bullet.x),
+                    min(start_y, bullet.y),
+                    bullet.width + abs(move_x),
+                    bullet.height + abs(move_y),
+                ):
+                    # 倒れた敵 (このフレームでHPが0以下になった敵を含む) には当たらない
+                    if not enemy_active[i] or enemy_hp[i] <= 0:
                         continue
-                    # 既にこの弾丸でヒット済みの敵は無視するでやんす (貫通弾の二重ヒット防止)
-                    if enemy in bullet.hit_enemies:
+                    # 既にこの弾丸でヒット済みの敵は無視するでやんす
+                    # (貫通弾の二重ヒット防止)
+                    if enemy_ids[i] in bullet.hit_enemies:
                         continue
-
-                    if is_colliding(
-                        bullet.x,
-                        bullet.y,
+                    hit_time = sweep_hit_time(
+                        start_x,
+                        start_y,
                         bullet.width,
                         bullet.height,
-                        enemy.x,
-                        enemy.y,
-                        enemy.width,
-                        enemy.height,
-                    ):
-                        # 弾丸がヒットした敵を記録するでやんす
-                        bullet.hit_enemies.add(enemy)
-                        
-                        # ダメージ計算はBulletクラスのget_damageメソッドを使うでやんす
-                        damage_to_deal = bullet.get_damage()
-                        enemy.hp -= damage_to_deal
-                        
-                        if enemy.hp <= 0:
-                            enemy.is_active = False
-                            # 経験値オーブの生成ロジックを変更
-                            exp_value = ENEMY_EXP * enemy.phase
-                            exp_color = NORMAL_EXP_ORB_COLOR
-                            if random.random() < BIG_EXP_ORB_CHANCE: # BIG_EXP_ORB_CHANCEの確率で
-                                exp_value *= BIG_EXP_ORB_MULTIPLIER
-                                exp_color = BIG_EXP_ORB_COLOR
-                            self.exp_orbs.append(
-                                ExperienceOrb(enemy.x, enemy.y, exp_value, exp_color)
-                            )  # 経験値オーブをドロップ (色も渡す)
-                        
-                        # 貫通弾の場合の処理
-                        if bullet.pierce_level > 0:
-                            bullet.pierced_count += 1
-                            if bullet.pierced_count > bullet.pierce_level:
-                                bullet.is_active = False # 貫通回数を超えたら弾を非アクティブにする
-                        else:
-                            bullet.is_active = False # 貫通能力がなければ1体ヒットで非アクティブ
-
-            # ここで全ての敵のHPをチェックし、倒れた敵を処理するでやんす
-            # 銃弾、ゴーストどちらの攻撃でもここを通るようにするでやんす
-            for enemy in self.enemies:
-                if enemy.is_active and enemy.hp <= 0:
-                    enemy.is_active = False
-                    # 経験値オーブの生成ロジックを変更
-                    exp_value = ENEMY_EXP * enemy.phase
-                    exp_color = NORMAL_EXP_ORB_COLOR
-                    if random.random() < BIG_EXP_ORB_CHANCE: # BIG_EXP_ORB_CHANCEの確率で
-                        exp_value *= BIG_EXP_ORB_MULTIPLIER
-                        exp_color = BIG_EXP_ORB_COLOR
-                    self.exp_orbs.append(
-                        ExperienceOrb(enemy.x, enemy.y, exp_value, exp_color)
-                    )  # 経験値オーブをドロップ (色も渡す)
-
-            # プレイヤーと敵の衝突判定
-            if not self.is_invincible:
-                for enemy in self.enemies:
-                    if not enemy.is_active:
-                        continue
-                    if is_colliding(
-                        self.player_x,
-                        self.player_y,
-                        self.player_width,
-                        self.player_height,
-                        enemy.x,
-                        enemy.y,
-                        enemy.width,
-                        enemy.height,
-                    ):
-                        self.player_hp -= ENEMY_DAMAGE
-                        if self.player_hp <= 0:
-                            self.game_state = GAME_STATE_GAME_OVER
-                            self.final_time = pyxel.frame_count
-                            print("Game Over!")  # デバッグ用
-                        else:
-                            self.is_invincible = True
-                            self.invincible_timer = 90  # 3秒間の無敵 (30fps * 3s)
-                        break  # 1フレームに1回だけダメージを受ける
-
-            # 無敵時間処理
-            if self.is_invincible:
-                self.invincible_timer -= 1
-                if self.invincible_timer <= 0:
-                    self.is_invincible = False
-
-            # プレイヤーと経験値オーブの衝突判定
-            for orb in self.exp_orbs:
-                if not orb.is_active:
+                        move_x,
+                        move_y,
+                        enemy_x[i],
+                        enemy_y[i],
+                        enemy_size[i],
+                        enemy_size[i],
+                    )
+                    if hit_time is not None:
+                        hits.append((hit_time, i))
+                hits.sort() # 同じ時刻ならインデックスの小さい順
+
+                for _, i in hits:
+                    if not bullet.is_active:
+                        break # 貫通回数を使い切ったら、その先の敵には当たらない
+                    if enemy_hp[i] <= 0:
+                        continue # 同じフレームで先に別の弾が倒していた
+                    # 弾丸がヒットした敵のIDを記録するでやんす
+                    bullet.hit_enemies.add(enemy_ids[i])
+
+                    # ダメージ計算はBulletクラスのget_damageメソッドを使うでやんす
+                    damage = bullet.get_damage()
+                    enemy_hp[i] -= damage
+                    if events.enabled:
+                        events.emit(
+                            EVENT_DAMAGE,
+                            source,
+                            enemy_ids[i],
+                            enemy_x[i],
+                            enemy_y[i],
+                            damage,
+                        )
+
+                    # 貫通弾の場合の処理
+                    if bullet.pierce_level > 0:
+                        bullet.pierced_count += 1
+                        if bullet.pierced_count > bullet.pierce_level:
+                            # 貫通回数を超えたら弾を非アクティブにする
+                            bullet.is_active = False
+                    else:
+                        # 貫通能力がなければ1体ヒットで非アクティブ
+                        bullet.is_active = False
+
+    def collide_projectiles(self, inputs):
+        # 弾幕の弾と敵の衝突判定
+        # (まとめて判定してダメージを与える。倒れた敵は kill_enemies() で処理する)
+        hits, targets, damage = self.projectiles.collide(self.enemies)
+        if len(hits) and self.events.enabled:
+            enemies = self.enemies
+            self.events.emit_many(
+                EVENT_DAMAGE,
+                enemies.ids[targets],
+                enemies.x[targets],
+                enemies.y[targets],
+                damage,
+                source=SOURCE_PROJECTILE,
+            )
+
+    def kill_enemies(self, inputs):
+        # ここで全ての敵のHPをチェックし、倒れた敵を処理するでやんす
+        # 銃弾、ゴーストどちらの攻撃でもここを通る
+        # (HPが0以下の敵をまとめて探して、その敵だけループする)
+        enemies = self.enemies
+        n = enemies.count
+        killed = np.flatnonzero(enemies.active[:n] & (enemies.hp[:n] <= 0))
+        if len(killed) == 0:
+            return
+        enemies.active[killed] = False
+        events = self.events
+        if events.enabled:
+            events.emit_many(
+                EVENT_KILL,
+                enemies.ids[killed],
+                enemies.x[killed],
+                enemies.y[killed],
+                extras=enemies.phase[killed],
+            )
+        for x, y, phase in zip(
+            enemies.x[killed].tolist(),
+            enemies.y[killed].tolist(),
+            enemies.phase[killed].tolist(),
+        ):
+            self.kills_by_phase[phase] = self.kills_by_phase.get(phase, 0) + 1
+            # 経験値オーブの生成ロジックを変更
+            exp_value = ENEMY_EXP * phase
+            exp_color = NORMAL_EXP_ORB_COLOR
+            if self.rng.random() < BIG_EXP_ORB_CHANCE: # BIG_EXP_ORB_CHANCEの確率で
+                exp_value *= BIG_EXP_ORB_MULTIPLIER
+                exp_color = BIG_EXP_ORB_COLOR
+            if events.enabled:
+                events.emit(
+                    EVENT_ORB_DROP,
+                    x=x,
+                    y=y,
+                    value=exp_value,
+                    extra=int(exp_color == BIG_EXP_ORB_COLOR),
+                )
+            self.add_exp_orb(
+                self.orb_pool.acquire(x, y, exp_value, exp_color)
+            )  # 経験値オーブをドロップ (色も渡す)
+
+    def damage_player(self, inputs):
+        # プレイヤーと敵の衝突判定
+        enemies = self.enemies
+        if not self.is_invincible:
+            for i in self.enemy_grid.query_rect(
+                self.player_x, self.player_y, self.player_width, self.player_height
+            ):
+                if not enemies.active[i]:
                     continue
+                size = float(enemies.size[i])
                 if is_colliding(
                     self.player_x,
                     self.player_y,
                     self.player_width,
                     self.player_height,
-                    orb.x,
-                    orb.y,
-                    orb.width,
-                    orb.height,
+                    float(enemies.x[i]),
+                    float(enemies.y[i]),
+                    size,
+                    size,
                 ):
-                    self.player_exp += orb.value
-                    orb.is_active = False
-                    if self.player_exp >= self.exp_to_next_level:
-                        self.level_up()
+                    self.player_hp -= ENEMY_DAMAGE
+                    self.events.emit(
+                        EVENT_PLAYER_HIT,
+                        entity=int(enemies.ids[i]),
+                        x=self.player_x,
+                        y=self.player_y,
+                        value=self.player_hp,
+                    )
+                    if self.player_hp <= 0:
+                        self.game_state = GAME_STATE_GAME_OVER
+                        self.final_time = self.clock.frame_count
+                        self.events.emit(
+                            EVENT_GAME_OVER,
+                            x=self.player_x,
+                            y=self.player_y,
+                            value=self.final_time,
+                            extra=self.player_level,
+                        )
+                    else:
+                        self.is_invincible = True
+                        self.invincible_timer = 90  # 3秒間の無敵 (30fps * 3s)
+                    break  # 1フレームに1回だけダメージを受ける
+
+        # 無敵時間処理
+        if self.is_invincible:
+            self.invincible_timer -= 1
+            if self.invincible_timer <= 0:
+                self.is_invincible = False
+
+    def pick_up_exp_orbs(self, inputs):
+        # 吸い寄せ範囲に入ったオーブをセルから外して、プレイヤーに向かって飛ばす
+        # (プレイヤーに触れるオーブは必ず範囲内にあるので、
+        # 拾う判定は飛んでいるオーブだけでよい)
+        center_x = self.player_x + self.player_width / 2
+        center_y = self.player_y + self.player_height / 2
+        radius = EXP_ORB_MAGNET_RADIUS
+        for orb in self.orb_buckets.query_rect(
+            center_x - radius - EXP_ORB_SIZE,
+            center_y - radius - EXP_ORB_SIZE,
+            radius * 2 + EXP_ORB_SIZE,
+            radius * 2 + EXP_ORB_SIZE,
+        ):
+            if math.hypot(
+                orb.x + orb.width / 2 - center_x, orb.y + orb.height / 2 - center_y
+            ) <= radius:
+                self.orb_buckets.discard(orb.bucket, orb)
+                orb.bucket = None
+                self.magnet_orbs.append(orb)
+
+        # プレイヤーと経験値オーブの衝突判定
+        magnet_speed = self.stats.get(STAT_MOVE_SPEED) + EXP_ORB_MAGNET_SPEED_MARGIN
+        for orb in self.magnet_orbs:
+            if not orb.is_active:
+                continue
+            orb.move_towards(center_x, center_y, magnet_speed)
+            if is_colliding(
+                self.player_x,
+                self.player_y,
+                self.player_width,
+                self.player_height,
+                orb.x,
+                orb.y,
+                orb.width,
+                orb.height,
+            ):
+                self.player_exp += orb.value
+                orb.is_active = False
+                self.events.emit(
+                    EVENT_PICKUP,
+                    x=orb.x,
+                    y=orb.y,
+                    value=orb.value,
+                    extra=self.player_exp,
+                )
+                if self.player_exp >= self.exp_to_next_level:
+                    self.level_up()
+        self.magnet_orbs = [orb for orb in self.magnet_orbs if orb.is_active]
+
+    def clean_up(self, inputs):
+        # 非アクティブなオブジェクトの削除
+        # (弾とオーブはリストを作り直さずにその場で詰め、消えたものはフリーリストに戻す)
+        compact_in_place(self.bullets, self.bullet_pool.release)
+        compact_in_place(self.homing_bullets, self.homing_bullet_pool.release)
+        self.projectiles.compact()
+        self.enemies.compact() # 倒された敵はまとめて詰めて取り除く
+        compact_in_place(self.exp_orbs, self.release_exp_orb)
+        self.oldest_orb_cursor = 0
+
+    def step(self, inputs):
+        self.mouse_x = inputs.mouse_x
+        self.mouse_y = inputs.mouse_y
+        if self.events.enabled:
+            self.events.frame = self.clock.frame_count
 
-            # 非アクティブなオブジェクトの削除
-            self.bullets = [b for b in self.bullets if b.is_active]
-            self.enemies = [e for e in self.enemies if e.is_active]
-            self.exp_orbs = [o for o in self.exp_orbs if o.is_active]
+        if self.game_state == GAME_STATE_PLAYING:
+            self.scheduler.run(inputs, self.profiler)
 
         elif self.game_state == GAME_STATE_GAME_OVER:
-            if pyxel.btnp(pyxel.KEY_R):  # Rキーでリトライ
+            if inputs.retry:  # Rキーでリトライ
                 self.reset_game_state()  # ゲームを初期化
-            if pyxel.btnp(pyxel.KEY_Q):  # Qキーで終了
-                pyxel.quit()
+            if inputs.quit:  # Qキーで終了
+                self.quit_requested = True
 
         elif self.game_state == GAME_STATE_LEVEL_UP:
-            if pyxel.btnp(pyxel.KEY_UP):  # 上キーで選択肢を上に移動
+            if inputs.menu_up:  # 上キーで選択肢を上に移動
                 self.current_ability_selection_index = (
                     self.current_ability_selection_index - 1
                 ) % len(self.selected_abilities_for_level_up)
-            if pyxel.btnp(pyxel.KEY_DOWN):  # 下キーで選択肢を下に移動
+            if inputs.menu_down:  # 下キーで選択肢を下に移動
                 self.current_ability_selection_index = (
                     self.current_ability_selection_index + 1
                 ) % len(self.selected_abilities_for_level_up)
 
-            if pyxel.btnp(pyxel.KEY_RETURN) or pyxel.btnp(
-                pyxel.KEY_Z
-            ):  # エンターキーまたはZキーで決定
+            if inputs.confirm:  # エンターキーまたはZキーで決定
                 chosen_ability = self.selected_abilities_for_level_up[
                     self.current_ability_selection_index
                 ]
@@ -767,130 +1726,548 @@ class App:
                 # 取得したアビリティのレベルを更新するでやんす
                 self.acquired_ability_levels[chosen_ability.name] = \
                     self.acquired_ability_levels.get(chosen_ability.name, 0) + 1
+                self.events.emit(
+                    EVENT_ABILITY,
+                    entity=ALL_ABILITIES.index(chosen_ability),
+                    value=self.acquired_ability_levels[chosen_ability.name],
+                )
 
                 self.selected_abilities_for_level_up = []  # 選択肢をクリア
                 self.current_ability_selection_index = 0  # 選択カーソルをリセット
                 self.game_state = GAME_STATE_PLAYING  # ゲーム状態をプレイ中に戻す
 
-    def draw(self):
-        pyxel.cls(0)
+        self.clock.tick()
 
-        if self.game_state == GAME_STATE_PLAYING:
-            for orb in self.exp_orbs:
-                orb.draw()
-            for bullet in self.bullets:
-                bullet.draw()
-            for enemy in self.enemies:
-                enemy.draw()
-            for ghost in self.ghosts: # ゴーストの描画
-                ghost.draw()
+
+class FrameView:
+    # 描画に必要な状態だけを Simulation から写し取ったもの
+    # (GameRenderer はこれだけを見て描く)
+    # パイプライン実行 (App の pipelined) では2つを交互に使い、片方を描いている間に
+    # ワーカースレッドが Simulation を進めて、もう片方に次のフレームを写し取るでやんす
+    # エンティティの座標などの配列は使い回し、足りなくなったら2倍に広げる
+    def __init__(self):
+        self.buffers = {} # {列の名前: 配列}
+        self.game_state = GAME_STATE_PLAYING
+        self.frame_count = 0
+        self.camera_x = 0
+        self.camera_y = 0
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.player_x = 0.0
+        self.player_y = 0.0
+        self.player_width = 0
+        self.player_height = 0
+        self.is_invincible = False
+        self.player_hp = 0
+        self.max_hp = 0
+        self.player_level = 0
+        self.player_exp = 0
+        self.exp_to_next_level = 1
+        self.final_time = 0
+        self.selected_abilities_for_level_up = ()
+        self.current_ability_selection_index = 0
+        empty = np.zeros(0)
+        self.orb_x = self.orb_y = self.orb_color = empty
+        self.bullet_x = self.bullet_y = empty
+        self.homing_x = self.homing_y = empty
+        self.projectile_x = self.projectile_y = empty
+        self.projectile_size = self.projectile_color = empty
+        self.enemy_x = self.enemy_y = self.enemy_size = self.enemy_color = empty
+        self.ghost_x = self.ghost_y = self.ghost_color = empty
+
+    def column(self, name, values, dtype=np.float64):
+        # values を name の配列に書き込み、書き込んだ部分を返す
+        n = len(values)
+        buffer = self.buffers.get(name)
+        if buffer is None or len(buffer) < n:
+            size = 64 if buffer is None else len(buffer)
+            while size < n:
+                size *= 2
+            buffer = np.zeros(size, dtype=dtype)
+            self.buffers[name] = buffer
+        buffer[:n] = values
+        return buffer[:n]
+
+    def capture(self, sim):
+        self.game_state = sim.game_state
+        self.frame_count = sim.clock.frame_count
+        self.camera_x = sim.camera.x
+        self.camera_y = sim.camera.y
+        self.mouse_x = sim.mouse_x
+        self.mouse_y = sim.mouse_y
+        self.player_x = sim.player_x
+        self.player_y = sim.player_y
+        self.player_width = sim.player_width
+        self.player_height = sim.player_height
+        self.is_invincible = sim.is_invincible
+        self.player_hp = sim.player_hp
+        self.max_hp = sim.stats.get(STAT_MAX_HP)
+        self.player_level = sim.player_level
+        self.player_exp = sim.player_exp
+        self.exp_to_next_level = sim.exp_to_next_level
+        self.final_time = sim.final_time
+        self.selected_abilities_for_level_up = tuple(
+            sim.selected_abilities_for_level_up
+        )
+        self.current_ability_selection_index = sim.current_ability_selection_index
+        if sim.game_state != GAME_STATE_PLAYING:
+            return # メニューの画面ではエンティティを描かない
+
+        column = self.column
+        orbs = sim.exp_orbs
+        self.orb_x = column("orb_x", [orb.x for orb in orbs])
+        self.orb_y = column("orb_y", [orb.y for orb in orbs])
+        self.orb_color = column("orb_color", [orb.color for orb in orbs], np.int64)
+        bullets = sim.bullets
+        self.bullet_x = column("bullet_x", [bullet.x for bullet in bullets])
+        self.bullet_y = column("bullet_y", [bullet.y for bullet in bullets])
+        homing_bullets = sim.homing_bullets
+        self.homing_x = column("homing_x", [bullet.x for bullet in homing_bullets])
+        self.homing_y = column("homing_y", [bullet.y for bullet in homing_bullets])
+        projectiles = sim.projectiles
+        n = projectiles.count
+        # 動き出す前の弾は描かない
+        shown = projectiles.active[:n] & (projectiles.delay[:n] == 0)
+        self.projectile_x = column("projectile_x", projectiles.x[:n][shown])
+        self.projectile_y = column("projectile_y", projectiles.y[:n][shown])
+        self.projectile_size = column("projectile_size", projectiles.size[:n][shown])
+        self.projectile_color = column(
+            "projectile_color", projectiles.color[:n][shown], projectiles.color.dtype
+        )
+        enemies = sim.enemies
+        n = enemies.count
+        self.enemy_x = column("enemy_x", enemies.x[:n])
+        self.enemy_y = column("enemy_y", enemies.y[:n])
+        self.enemy_size = column("enemy_size", enemies.size[:n])
+        self.enemy_color = column("enemy_color", enemies.color[:n], enemies.color.dtype)
+        ghosts = sim.ghosts
+        self.ghost_x = column("ghost_x", [ghost.x for ghost in ghosts])
+        self.ghost_y = column("ghost_y", [ghost.y for ghost in ghosts])
+        self.ghost_color = column(
+            "ghost_color", [ghost.color for ghost in ghosts], np.int64
+        )
+
+
+class GameRenderer:
+    # Simulation の状態を pyxel.Image に描画するクラス
+    # 画面 (pyxel.screen) だけでなく、
+    # オフスクリーンの画像にも描けるのでヘッドレスでも使える
+    # HUD・照準・ゲームオーバー画面・レベルアップ画面は CachedLayer に描いておき、
+    # 表示する値が変わったときだけ描き直す (毎フレームは blt で1回貼るだけ)
+    def __init__(self, screen):
+        self.screen = screen
+        self.batcher = RectBatcher(screen)
+        self.hud_layer = CachedLayer(HUD_WIDTH, HUD_HEIGHT)
+        self.crosshair_layer = CachedLayer(CROSSHAIR_SIZE, CROSSHAIR_SIZE)
+        self.game_over_layer = CachedLayer(SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.level_up_layer = CachedLayer(SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.view = FrameView() # draw(sim) で写し取る先
+
+    def draw(self, sim):
+        # sim の今の状態を写し取ってから描く
+        self.view.capture(sim)
+        self.draw_view(self.view)
+
+    def draw_view(self, view):
+        # 写し取った状態 (FrameView) だけを見て描く
+        # (描いている間に Simulation が進んでもよい)
+        screen = self.screen
+
+        if view.game_state == GAME_STATE_PLAYING:
+            screen.cls(0)
+            self.draw_chunk_grid(view.camera_x, view.camera_y)
+            self.draw_entities(view)
 
             # プレイヤーの描画 (無敵時間中は点滅)
-            if self.is_invincible:
+            if view.is_invincible:
                 if (
-                    pyxel.frame_count // 15
+                    view.frame_count // 15
                 ) % 2 == 0:  # 0.5秒間隔で点滅 (30fpsで15フレーム)
-                    pyxel.rect(
-                        self.player_x,
-                        self.player_y,
-                        self.player_width,
-                        self.player_height,
+                    screen.rect(
+                        view.player_x - view.camera_x,
+                        view.player_y - view.camera_y,
+                        view.player_width,
+                        view.player_height,
                         7,
                     )
             else:
-                pyxel.rect(
-                    self.player_x,
-                    self.player_y,
-                    self.player_width,
-                    self.player_height,
+                screen.rect(
+                    view.player_x - view.camera_x,
+                    view.player_y - view.camera_y,
+                    view.player_width,
+                    view.player_height,
                     7,
                 )
 
-            # 照準
-            x, y = pyxel.mouse_x, pyxel.mouse_y
-            pyxel.pset(x, y, 7)
-            pyxel.line(x - 5, y, x - 1, y, 7)
-            pyxel.line(x + 1, y, x + 5, y, 7)
-            pyxel.line(x, y - 5, x, y - 1, 7)
-            pyxel.line(x, y + 1, x, y + 5, 7)
-
-            # UI
-            pyxel.text(5, 5, f"HP: {self.player_hp}/{self.player_max_hp}", 7)
-            pyxel.text(5, 15, f"LV: {self.player_level}", 7)
-            # 経験値バー
-            pyxel.rect(5, 25, 100, 5, 13)  # 背景
-            exp_bar_width = 100 * self.player_exp / self.exp_to_next_level
-            pyxel.rect(5, 25, exp_bar_width, 5, 11)  # 経験値
-
-            # 経過時間表示 (MM:SS)
-            total_seconds = pyxel.frame_count // 30  # Pyxelはデフォルトで30fps
-            minutes = total_seconds // 60
-            seconds = total_seconds % 60
-            time_str = f"TIME: {minutes:02}:{seconds:02}"
-            pyxel.text(5, 35, time_str, 7)
+            # 照準 (形は変わらないので、一度描いた画像を貼るだけ)
+            half = CROSSHAIR_SIZE // 2
+            crosshair = self.crosshair_layer.update(None, self.build_crosshair)
+            screen.blt(
+                view.mouse_x - half,
+                view.mouse_y - half,
+                crosshair,
+                0,
+                0,
+                CROSSHAIR_SIZE,
+                CROSSHAIR_SIZE,
+                0,
+            )
 
-        elif self.game_state == GAME_STATE_GAME_OVER:
-            game_over_message = "GAME OVER"
-            retry_message = "Press 'R' to Retry"
-            quit_message = "Press 'Q' to Quit"
-
-            message_x = (SCREEN_WIDTH - len(game_over_message) * pyxel.FONT_WIDTH) // 2
-            message_y = SCREEN_HEIGHT // 2 - pyxel.FONT_HEIGHT * 2
-            pyxel.text(message_x, message_y, game_over_message, 8)  # 赤色
-
-            final_total_seconds = self.final_time // 30
-            final_minutes = final_total_seconds // 60
-            final_seconds = final_total_seconds % 60
-            final_time_str = f"SURVIVED: {final_minutes:02}:{final_seconds:02}"
-            final_time_x = (SCREEN_WIDTH - len(final_time_str) * pyxel.FONT_WIDTH) // 2
-            pyxel.text(
-                final_time_x, message_y + pyxel.FONT_HEIGHT * 2, final_time_str, 7
+            # UI (HP・レベル・経験値バーの長さ・経過秒が変わったときだけ描き直す)
+            exp_bar_width = 100 * view.player_exp / view.exp_to_next_level
+            total_seconds = view.frame_count // 30  # Pyxelはデフォルトで30fps
+            hud = self.hud_layer.update(
+                (
+                    view.player_hp,
+                    view.max_hp,
+                    view.player_level,
+                    exp_bar_width,
+                    total_seconds,
+                ),
+                self.build_hud,
             )
+            screen.blt(0, 0, hud, 0, 0, HUD_WIDTH, HUD_HEIGHT, 0)
 
-            retry_x = (SCREEN_WIDTH - len(retry_message) * pyxel.FONT_WIDTH) // 2
-            pyxel.text(retry_x, message_y + pyxel.FONT_HEIGHT * 4, retry_message, 7)
+        elif view.game_state == GAME_STATE_GAME_OVER:
+            # 画面全体を覆う (背景の黒も含む) ので、画面を消さずにそのまま貼る
+            layer = self.game_over_layer.update(
+                view.final_time // 30, self.build_game_over
+            )
+            screen.blt(0, 0, layer, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        elif view.game_state == GAME_STATE_LEVEL_UP:
+            layer = self.level_up_layer.update(
+                (
+                    tuple(
+                        ability.name for ability in view.selected_abilities_for_level_up
+                    ),
+                    view.current_ability_selection_index,
+                ),
+                self.build_level_up_menu,
+                view.selected_abilities_for_level_up,
+            )
+            screen.blt(0, 0, layer, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+    def build_crosshair(self, image, _):
+        c = CROSSHAIR_SIZE // 2
+        image.pset(c, c, 7)
+        image.line(c - 5, c, c - 1, c, 7)
+        image.line(c + 1, c, c + 5, c, 7)
+        image.line(c, c - 5, c, c - 1, 7)
+        image.line(c, c + 1, c, c + 5, 7)
+
+    def build_hud(self, image, key):
+        hp, max_hp, level, exp_bar_width, total_seconds = key
+        image.text(5, 5, f"HP: {hp}/{max_hp}", 7)
+        image.text(5, 15, f"LV: {level}", 7)
+        # 経験値バー
+        image.rect(5, 25, 100, 5, 13)  # 背景
+        image.rect(5, 25, exp_bar_width, 5, 11)  # 経験値
+
+        # 経過時間表示 (MM:SS)
+        minutes = total_seconds // 60
+        seconds = total_seconds % 60
+        time_str = f"TIME: {minutes:02}:{seconds:02}"
+        image.text(5, 35, time_str, 7)
+
+    def build_game_over(self, image, final_total_seconds):
+        game_over_message = "GAME OVER"
+        retry_message = "Press 'R' to Retry"
+        quit_message = "Press 'Q' to Quit"
+
+        message_x = (SCREEN_WIDTH - len(game_over_message) * pyxel.FONT_WIDTH) // 2
+        message_y = SCREEN_HEIGHT // 2 - pyxel.FONT_HEIGHT * 2
+        image.text(message_x, message_y, game_over_message, 8)  # 赤色
+
+        final_minutes = final_total_seconds // 60
+        final_seconds = final_total_seconds % 60
+        final_time_str = f"SURVIVED: {final_minutes:02}:{final_seconds:02}"
+        final_time_x = (SCREEN_WIDTH - len(final_time_str) * pyxel.FONT_WIDTH) // 2
+        image.text(
+            final_time_x, message_y + pyxel.FONT_HEIGHT * 2, final_time_str, 7
+        )
 
-            quit_x = (SCREEN_WIDTH - len(quit_message) * pyxel.FONT_WIDTH) // 2
-            pyxel.text(quit_x, message_y + pyxel.FONT_HEIGHT * 5, quit_message, 7)
+        retry_x = (SCREEN_WIDTH - len(retry_message) * pyxel.FONT_WIDTH) // 2
+        image.text(retry_x, message_y + pyxel.FONT_HEIGHT * 4, retry_message, 7)
 
-        elif self.game_state == GAME_STATE_LEVEL_UP:
-            pyxel.rect(
-                0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, 0
-            )  # 画面を黒く塗りつぶすでやんす
-
-            title_text = "LEVEL UP!"
-            # タイトルは中央より少し左に寄せるでやんす（後で微調整可能）
-            pyxel.text(
-                SCREEN_WIDTH // 2 - len(title_text) * pyxel.FONT_WIDTH / 2,
-                30,
-                title_text,
-                7,
-            )
+        quit_x = (SCREEN_WIDTH - len(quit_message) * pyxel.FONT_WIDTH) // 2
+        image.text(quit_x, message_y + pyxel.FONT_HEIGHT * 5, quit_message, 7)
+
+    def build_level_up_menu(self, image, key, abilities):
+        _, selection_index = key
+        # 画面は CachedLayer が黒で塗りつぶしてあるでやんす
+
+        title_text = "LEVEL UP!"
+        # タイトルは中央より少し左に寄せるでやんす（後で微調整可能）
+        image.text(
+            SCREEN_WIDTH // 2 - len(title_text) * pyxel.FONT_WIDTH / 2,
+            30,
+            title_text,
+            7,
+        )
+
+        start_y = 60
+        for i, ability in enumerate(abilities):
+            display_text = f"{ability.name}: {ability.description}"
+            text_color = 7  # 白
+
+            display_x = SCREEN_WIDTH // 2 - 80  # 固定位置に表示するでやんす
+
+            if i == selection_index:
+                text_color = 3  # 緑
+                image.text(
+                    display_x - 10, start_y + i * 20, ">", text_color
+                )  # カーソル
+
+            image.text(display_x, start_y + i * 20, display_text, text_color)
 
-            start_y = 60
-            for i, ability in enumerate(self.selected_abilities_for_level_up):
-                display_text = f"{ability.name}: {ability.description}"
-                text_color = 7  # 白
+        confirm_text = "Press ENTER/Z to select"
+        # 確認メッセージも中央より少し左に寄せるでやんす
+        image.text(
+            SCREEN_WIDTH // 2 - len(confirm_text) * pyxel.FONT_WIDTH / 2,
+            SCREEN_HEIGHT - 30,
+            confirm_text,
+            7,
+        )
+
+    def draw_chunk_grid(self, camera_x, camera_y):
+        # チャンクの境目に線を引く
+        # (背景が真っ黒だと、カメラが動いているのが分からないので)
+        screen = self.screen
+        start_x = -(camera_x % CHUNK_SIZE)
+        start_y = -(camera_y % CHUNK_SIZE)
+        for x in range(start_x, SCREEN_WIDTH, CHUNK_SIZE):
+            screen.line(x, 0, x, SCREEN_HEIGHT - 1, CHUNK_GRID_COLOR)
+        for y in range(start_y, SCREEN_HEIGHT, CHUNK_SIZE):
+            screen.line(0, y, SCREEN_WIDTH - 1, y, CHUNK_GRID_COLOR)
+
+    def draw_entities(self, view):
+        # 種類ごと (同じ大きさ・色) にまとめて描画するでやんす
+        # 座標はワールドの座標のまま渡し、カメラの分は RectBatcher がずらす
+        batcher = self.batcher
+        batcher.begin_frame(view.camera_x, view.camera_y)
+        batcher.fill_rects(
+            view.orb_x, view.orb_y, EXP_ORB_SIZE, EXP_ORB_SIZE, view.orb_color
+        )
+        batcher.fill_rects(
+            view.bullet_x, view.bullet_y, BULLET_SIZE, BULLET_SIZE, BULLET_COLOR
+        )
+        batcher.fill_rects(
+            view.homing_x,
+            view.homing_y,
+            HOMING_BULLET_SIZE,
+            HOMING_BULLET_SIZE,
+            HOMING_BULLET_COLOR,
+        )
+        # 弾幕の弾と敵は大きさごとのグループに分けて塗られる
+        batcher.fill_rects_sized(
+            view.projectile_x,
+            view.projectile_y,
+            view.projectile_size,
+            view.projectile_color,
+        )
+        batcher.fill_rects_sized(
+            view.enemy_x, view.enemy_y, view.enemy_size, view.enemy_color
+        )
+        batcher.fill_rects(
+            view.ghost_x, view.ghost_y, GHOST_SIZE, GHOST_SIZE, view.ghost_color
+        )
 
-                display_x = SCREEN_WIDTH // 2 - 80  # 固定位置に表示するでやんす
 
-                if i == self.current_ability_selection_index:
-                    text_color = 3  # 緑
-                    pyxel.text(
-                        display_x - 10, start_y + i * 20, ">", text_color
-                    )  # カーソル
+class App:
+    # Simulation をpyxelのウィンドウで動かして描画するクラス
+    # sim と input_source を渡すと、それを使う (リプレイの再生・記録など)
+    # input_source は poll() と、pyxel のフレームごとに呼ぶ latch() を持つこと
+    # シミュレーションは pyxel.frame_count ではなく自分のクロックで、
+    # FixedTimestep の刻みで進める
+    # rewind_seconds 秒分の状態を記録しておき、F3で REWIND_SECONDS 秒前に戻せる
+    # (0なら記録しない。uv run main.py --rewind で
+    # REWIND_HISTORY_SECONDS 秒分を記録する)
+    # pipelined=True なら、シミュレーションをワーカースレッドで進めながら、
+    # 1フレーム前の状態 (FrameView) を描く
+    # (描画が1フレーム遅れる代わりに、更新と描画が重なる)
+    # NumPy の大きな配列の計算は GIL を離すので、その間はもう片方のスレッドが動ける
+    def __init__(
+        self,
+        sim=None,
+        input_source=None,
+        max_ticks_per_frame=MAX_TICKS_PER_FRAME,
+        rewind_seconds=0,
+        pipelined=False,
+    ):
+        pyxel.init(
+            SCREEN_WIDTH, SCREEN_HEIGHT, title="Vampire Survivors-like", fps=SIM_FPS
+        )
 
-                pyxel.text(display_x, start_y + i * 20, display_text, text_color)
+        if sim is None:
+            sim = Simulation(parse_debug_abilities(sys.argv[1:]))
+        self.sim = sim
+        self.input_source = (
+            input_source if input_source is not None else PyxelInputSource()
+        )
+        self.renderer = GameRenderer(pyxel.screen)
+        self.timestep = FixedTimestep(max_ticks_per_frame=max_ticks_per_frame)
+        self.needs_draw = True # 前回の描画からシミュレーションが進んだか
+        # F1で区間ごとの処理時間のオーバーレイを表示、F2でその記録をCSVに書き出す
+        self.profiler = FrameProfiler()
+        self.show_profiler = False
+        self.rewind = None
+        if rewind_seconds:
+            # snapshot は main を読み込むので、ここで読み込む
+            from snapshot import RewindBuffer
+
+            self.rewind = RewindBuffer(rewind_seconds)
+        self.worker = None
+        if pipelined:
+            self.worker = ThreadPoolExecutor(max_workers=1)
+            # [描いている方, ワーカーが書き込む方]
+            # (ワーカーの処理が終わるたびに入れ替える)
+            self.views = [FrameView(), FrameView()]
+            self.views[0].capture(sim)
+            self.job = None # ワーカーで実行中の run_ticks()
+            self.draw_seconds = 0.0 # 直近の描画にかかった時間 (プロファイラ用)
 
-            confirm_text = "Press ENTER/Z to select"
-            # 確認メッセージも中央より少し左に寄せるでやんす
-            pyxel.text(
-                SCREEN_WIDTH // 2 - len(confirm_text) * pyxel.FONT_WIDTH / 2,
-                SCREEN_HEIGHT - 30,
-                confirm_text,
-                7,
+        pyxel.mouse(False)
+        pyxel.run(self.update, self.draw)
+
+    def update(self):
+        if self.worker is not None:
+            # ここから先は sim を触るので、前のフレームの更新が終わるのを待つ
+            self.finish_job()
+            if self.sim.quit_requested:
+                pyxel.quit()
+                return
+        if pyxel.btnp(pyxel.KEY_F1):
+            self.show_profiler = not self.show_profiler
+            self.sim.profiler = self.profiler if self.show_profiler else NULL_PROFILER
+        if pyxel.btnp(pyxel.KEY_F2) and self.profiler.size:
+            path = f"profile_{self.sim.clock.frame_count}.csv"
+            self.profiler.dump_csv(path)
+            print(f"profile written to {path}")
+        if pyxel.btnp(pyxel.KEY_F3) and self.rewind is not None:
+            frame = self.rewind.rewind(self.sim, REWIND_SECONDS)
+            print(
+                f"rewound to frame {frame} "
+                f"({self.rewind.memory_bytes / 1024:.0f} KiB"
+                f" for {self.rewind.seconds_stored:.1f}s, "
+                f"{self.rewind.bytes_per_second() / 1024:.1f} KiB/s)"
             )
 
+        # 押した瞬間の入力は毎フレーム読んでおく
+        # (このフレームで進めなくても、次の刻みで使う)
+        self.input_source.latch()
+
+        profiler = self.sim.profiler
+        if self.worker is not None:
+            # 入力は pyxel から読むのでメインスレッドで取り、進めるのはワーカーに任せる
+            ticks = self.timestep.advance()
+            if ticks:
+                inputs = [self.input_source.poll() for _ in range(ticks)]
+                self.job = self.worker.submit(self.run_ticks, inputs)
+            return
+        if profiler.enabled:
+            profiler.begin_frame()
+        ticks = self.timestep.advance()
+        for _ in range(ticks):
+            self.tick()
+            if self.sim.quit_requested:
+                pyxel.quit()
+                return
+        if ticks:
+            self.needs_draw = True
+
+    def tick(self):
+        # シミュレーションを1刻み進める
+        profiler = self.sim.profiler
+        inputs = self.input_source.poll()
+        profiler.mark(PHASE_INPUT)
+        self.sim.step(inputs)
+        if self.rewind is not None:
+            self.rewind.push(self.sim)
+
+    def run_ticks(self, inputs):
+        # ワーカースレッドで、受け取った入力の分だけシミュレーションを進め、書き込む方の
+        # FrameView に写し取る (描いている方の FrameView には触らない)
+        # 計測していたかを返す (途中で F1 が押されても、記録の途中の行を使わないように)
+        sim = self.sim
+        profiler = sim.profiler
+        if profiler.enabled:
+            profiler.begin_frame()
+        for frame_inputs in inputs:
+            sim.step(frame_inputs)
+            if self.rewind is not None:
+                self.rewind.push(sim)
+            if sim.quit_requested:
+                break
+        self.views[1].capture(sim)
+        return profiler.enabled
+
+    def finish_job(self):
+        if self.job is None:
+            return
+        profiled = self.job.result() # ワーカーで起きた例外はここで出る
+        self.job = None
+        self.views.reverse()
+        self.needs_draw = True
+        profiler = self.sim.profiler
+        if profiled and profiler.enabled:
+            # 描画は更新と並んで動いていたので、
+            # 直近の描画の時間をこのフレームの分として足す
+            profiler.row[PHASE_DRAW] += self.draw_seconds
+            profiler.end_frame(self.sim)
+
+    def draw(self):
+        # シミュレーションが進んでいなければ描き直さない (前の画面がそのまま残る)
+        profiler = self.sim.profiler
+        drawn = self.needs_draw
+        if self.worker is not None:
+            if drawn:
+                start = time.perf_counter()
+                self.renderer.draw_view(self.views[0])
+                self.draw_seconds = time.perf_counter() - start
+                self.needs_draw = False
+                if profiler.enabled:
+                    profiler.draw_overlay(pyxel.screen)
+            return
+        if profiler.enabled:
+            profiler.resume()
+        if drawn:
+            self.renderer.draw(self.sim)
+            self.needs_draw = False
+        if profiler.enabled:
+            profiler.mark(PHASE_DRAW)
+            profiler.end_frame(self.sim)
+            if drawn:
+                profiler.draw_overlay(pyxel.screen)
+
+
+def parse_debug_abilities(args):
+    # コマンドライン引数からデバッグ用アビリティを取得
+    # 例: uv run main.py --piercing_shot --summon_ghost
+    debug_abilities = []
+    for arg in args:
+        if arg in (PIPELINED_FLAG, REWIND_FLAG):
+            continue
+        if arg.startswith('--'):
+            debug_abilities.append(arg[2:].replace('_', ' ').title())
+    return debug_abilities
+
+
+def run_headless(
+    num_frames, input_source=None, debug_abilities=(), clock=None, seed=None
+):
+    # ウィンドウを開かずに num_frames フレームだけシミュレーションを進めるでやんす
+    # CIでの負荷テストなど、30FPSより速く回したいとき用
+    sim = Simulation(debug_abilities, clock=clock, seed=seed)
+    if input_source is None:
+        input_source = IdleInputSource()
+    for _ in range(num_frames):
+        sim.step(input_source.poll())
+    return sim
+
 
 if __name__ == "__main__":
-    App()
+    App(
+        rewind_seconds=REWIND_HISTORY_SECONDS if REWIND_FLAG in sys.argv[1:] else 0,
+        pipelined=PIPELINED_FLAG in sys.argv[1:],
+    )
@@ -0,0 +1,33 @@
+class ObjectPool:
+    # 使い終わったオブジェクトを捨てずにフリーリストに取っておき、
+    # 次の生成で使い回すでやんす
+    # 使い回すクラスは、__init__ と同じ引数を受け取る reset() を持っていること
+    def __init__(self, cls, max_free=4096):
+        self.cls = cls
+        # フリーリストに取っておく最大数 (これを超えたら普通に捨てる)
+        self.max_free = max_free
+        self.free = []
+
+    def acquire(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.reset(*args)
+            return obj
+        return self.cls(*args)
+
+    def release(self, obj):
+        if len(self.free) < self.max_free:
+            self.free.append(obj)
+
+
+def compact_in_place(items, release):
+    # is_active が偽のオブジェクトをリストから取り除き、release(obj) に渡すでやんす
+    # 新しいリストは作らず、残すものを前に詰めてから末尾を切り落とす (順番は保つ)
+    keep = 0
+    for obj in items:
+        if obj.is_active:
+            items[keep] = obj
+            keep += 1
+        else:
+            release(obj)
+    del items[keep:]
@@ -0,0 +1,139 @@
+import csv
+import time
+
+import numpy as np
+
+# 計測する処理の区間 (FrameProfiler.mark() に渡す番号)
+PHASE_INPUT = 0 # 入力の読み取り
+PHASE_PLAYER = 1 # プレイヤーの移動
+PHASE_ENEMIES = 2 # 敵の移動・出現・空間インデックスの作り直し
+PHASE_FIRE = 3 # 弾の発射
+PHASE_WEAPONS = 4 # 弾幕の武器 (ノヴァ・オービット・チェーン) の発射
+PHASE_BULLETS = 5 # 弾の移動
+PHASE_HOMING = 6 # 追尾弾の移動
+PHASE_PROJECTILES = 7 # 弾幕の弾の移動
+PHASE_ORBS = 8 # 経験値オーブの寿命
+PHASE_GHOSTS = 9 # ゴーストの更新
+PHASE_COLLISION = 10 # 弾と敵の衝突判定
+PHASE_KILL = 11 # 倒れた敵の処理
+PHASE_DAMAGE = 12 # プレイヤーと敵の衝突判定
+PHASE_PICKUP = 13 # 経験値オーブの吸い寄せと取得
+PHASE_CLEANUP = 14 # 非アクティブなオブジェクトの削除
+PHASE_DRAW = 15 # 描画
+PHASE_NAMES = (
+    "input",
+    "player",
+    "enemies",
+    "fire",
+    "weapons",
+    "bullets",
+    "homing",
+    "projectiles",
+    "orbs",
+    "ghosts",
+    "collision",
+    "kill",
+    "damage",
+    "pickup",
+    "cleanup",
+    "draw",
+)
+# moved: LODで間引いた後に動かした敵の数
+COUNT_NAMES = ("enemies", "moved", "bullets", "projectiles", "orbs", "ghosts")
+
+OVERLAY_X = 150
+OVERLAY_Y = 5
+OVERLAY_COLOR = 10
+OVERLAY_FRAMES = 30 # オーバーレイには直近このフレーム数の平均を出す
+
+
+class NullProfiler:
+    # 計測しないときに Simulation が持つプロファイラ (何もしないので、ほぼタダでやんす)
+    enabled = False
+
+    def mark(self, phase):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class FrameProfiler:
+    # 1フレームの処理を区間ごとに計測し、固定サイズのリングバッファに貯めるでやんす
+    # mark(phase) は、前回の mark() (または resume()) からの経過時間を phase に足す
+    enabled = True
+
+    def __init__(self, capacity=600):
+        self.capacity = capacity
+        self.times = np.zeros((capacity, len(PHASE_NAMES))) # ミリ秒
+        self.counts = np.zeros((capacity, len(COUNT_NAMES)), dtype=np.int32)
+        self.frames = np.zeros(capacity, dtype=np.int64) # 記録したときのフレーム番号
+        self.head = 0 # 次に書き込む行
+        self.size = 0 # 記録済みの行数 (最大 capacity)
+        self.row = [0.0] * len(PHASE_NAMES)
+        self.last = time.perf_counter()
+
+    def begin_frame(self):
+        self.row = [0.0] * len(PHASE_NAMES)
+        self.last = time.perf_counter()
+
+    def resume(self):
+        # ここまでの時間はどの区間にも入れない
+        # (pyxel が update と draw の間にする処理など)
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.row[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self, sim):
+        head = self.head
+        self.times[head] = self.row
+        self.times[head] *= 1000
+        self.counts[head] = (
+            sim.enemies.count,
+            sim.enemy_lod.last_updates,
+            len(sim.bullets) + len(sim.homing_bullets),
+            sim.projectiles.count,
+            len(sim.exp_orbs),
+            len(sim.ghosts),
+        )
+        self.frames[head] = sim.clock.frame_count
+        self.head = (head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def recent(self, num_frames):
+        # 直近 num_frames フレームの行の添字 (古い順)
+        num_frames = min(num_frames, self.size)
+        return (np.arange(self.head - num_frames, self.head)) % self.capacity
+
+    def draw_overlay(self, screen):
+        # HP/LV/TIME の横に、区間ごとの平均ミリ秒と最新のエンティティ数を出すでやんす
+        if self.size == 0:
+            return
+        rows = self.recent(OVERLAY_FRAMES)
+        means = self.times[rows].mean(axis=0)
+        y = OVERLAY_Y
+        screen.text(OVERLAY_X, y, f"FRAME {means.sum():6.2f}ms", OVERLAY_COLOR)
+        for name, ms in zip(PHASE_NAMES, means.tolist()):
+            y += 7
+            screen.text(OVERLAY_X, y, f"{name:<9}{ms:6.2f}", OVERLAY_COLOR)
+        latest = self.counts[rows[-1]].tolist()
+        for name, count in zip(COUNT_NAMES, latest):
+            y += 7
+            screen.text(OVERLAY_X, y, f"{name:<9}{count:6}", OVERLAY_COLOR)
+
+    def dump_csv(self, path):
+        # リングバッファの中身を古い順にCSVに書き出す
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                ("frame",) + tuple(f"{name}_ms" for name in PHASE_NAMES) + COUNT_NAMES
+            )
+            for i in self.recent(self.size).tolist():
+                writer.writerow(
+                    [int(self.frames[i])]
+                    + [round(ms, 4) for ms in self.times[i].tolist()]
+                    + self.counts[i].tolist()
+                )
@@ -0,0 +1,444 @@
+import math
+
+import numpy as np
+
+from spatial import overlap_pairs
+from vecmath import SIN_COS
+
+# 弾幕 (何万発もの弾) を NumPy の配列でまとめて持ち、
+# まとめて動かす・当てる・消すでやんす
+# 1発ずつオブジェクトを作る Bullet と違い、拡散弾・ノヴァ (全方位)・
+# オービット (周りを回る刃)・チェーン (少しずつ遅れて同じ向きに続けて飛ぶ弾) を、
+# パターンごとに1回の呼び出しでまとめて出す
+
+MOTION_STRAIGHT = 0 # 速度 (vx, vy) でまっすぐ飛ぶ
+MOTION_ORBIT = 1 # 持ち主 (プレイヤー) の周りを回る
+
+PIERCE_INFINITE = 2**30 # 何体でも貫通する (オービットの刃など)
+PIERCE_DAMAGE_DECAY = 0.2 # 貫通1回ごとに減るダメージの割合 (Bullet.get_damage() と同じ)
+# 当たり判定で候補を探すセルの大きさ
+# (弾の経路と敵が大きければ、overlap_pairs() が広げる)
+BROADPHASE_CELL_SIZE = 16
+
+
+class ProjectileStore:
+    # EnemyStore と同じく、生きている弾は先頭の count 個に詰めてある
+    # (インデックスは compact() で変わる)
+    # x, y は左上の座標、size は当たり判定と描画の一辺 (正方形)
+    # pierce: あと何体に当たれるか (0になったら消える)。
+    #   貫通レベル k の弾は k + 1 体 (Bullet と同じ)
+    # hits: これまでに当たった敵の数。
+    #   ダメージは damage * (1 - hits * decay) (0未満にはしない)
+    #   decay は拡散弾・ノヴァ・チェーンが PIERCE_DAMAGE_DECAY、
+    #   何体でも貫通するオービットの刃は0
+    # delay: 出てから動き出すまでのフレーム数 (その間は動かず、当たらず、描かれない)
+    # 当てた敵は (弾のID, 敵のID) を1つの整数にして hit_keys (ソート済み) に覚えておき、
+    # 同じ弾は同じ敵に2回当たらない (Bullet.hit_enemies と同じ)
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.next_id = 0
+        self.x = np.zeros(capacity, dtype=np.float64)
+        self.y = np.zeros(capacity, dtype=np.float64)
+        # 直前のフレームの位置 (経路ごと当てる)
+        self.prev_x = np.zeros(capacity, dtype=np.float64)
+        self.prev_y = np.zeros(capacity, dtype=np.float64)
+        self.vx = np.zeros(capacity, dtype=np.float64)
+        self.vy = np.zeros(capacity, dtype=np.float64)
+        self.size = np.zeros(capacity, dtype=np.float64)
+        self.damage = np.zeros(capacity, dtype=np.float64)
+        self.life = np.zeros(capacity, dtype=np.int32) # 残りのフレーム数
+        self.delay = np.zeros(capacity, dtype=np.int32)
+        self.pierce = np.zeros(capacity, dtype=np.int32)
+        self.hits = np.zeros(capacity, dtype=np.int32)
+        self.decay = np.zeros(capacity, dtype=np.float64)
+        self.motion = np.zeros(capacity, dtype=np.int8)
+        # オービットの今の角度 (ラジアン)
+        self.orbit_angle = np.zeros(capacity, dtype=np.float64)
+        self.orbit_radius = np.zeros(capacity, dtype=np.float64)
+        self.orbit_speed = np.zeros(capacity, dtype=np.float64) # 1フレームに回る角度
+        self.color = np.zeros(capacity, dtype=np.int32)
+        self.active = np.zeros(capacity, dtype=np.bool_)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.hit_keys = np.zeros(0, dtype=np.int64)
+
+    ARRAY_NAMES = (
+        "x",
+        "y",
+        "prev_x",
+        "prev_y",
+        "vx",
+        "vy",
+        "size",
+        "damage",
+        "life",
+        "delay",
+        "pierce",
+        "hits",
+        "decay",
+        "motion",
+        "orbit_angle",
+        "orbit_radius",
+        "orbit_speed",
+        "color",
+        "active",
+        "ids",
+    )
+
+    def grow(self, capacity):
+        for name in self.ARRAY_NAMES:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: self.count] = old[: self.count]
+            setattr(self, name, new)
+
+    def add(self, count, **columns):
+        # count 発を末尾に足す。columns は {列の名前: 値 (スカラーか count 個の配列)}
+        # 渡さなかった列は0 (prev_x, prev_y は x, y と同じ)
+        i = self.count
+        if i + count > len(self.x):
+            self.grow(max(len(self.x) * 2, i + count))
+        rows = slice(i, i + count)
+        for name in self.ARRAY_NAMES:
+            getattr(self, name)[rows] = columns.get(name, 0)
+        self.prev_x[rows] = self.x[rows]
+        self.prev_y[rows] = self.y[rows]
+        self.active[rows] = True
+        self.ids[rows] = np.arange(self.next_id, self.next_id + count)
+        self.next_id += count
+        self.count = i + count
+
+    def spread(
+        self,
+        x,
+        y,
+        dir_x,
+        dir_y,
+        count,
+        angle_step,
+        speed,
+        size,
+        damage,
+        life,
+        pierce_level=0,
+        color=0,
+    ):
+        # 中心 (x, y) から、向き (dir_x, dir_y) を真ん中にして
+        # angle_step ずつずらした count 発 (扇形)
+        offsets = (np.arange(count) - (count - 1) / 2) * angle_step
+        cos, sin = SIN_COS.lookup_arrays(offsets)
+        self.add(
+            count,
+            x=x - size / 2,
+            y=y - size / 2,
+            vx=(dir_x * cos - dir_y * sin) * speed,
+            vy=(dir_x * sin + dir_y * cos) * speed,
+            size=size,
+            damage=damage,
+            life=life,
+            pierce=pierce_level + 1,
+            decay=PIERCE_DAMAGE_DECAY,
+            color=color,
+        )
+
+    def nova(
+        self,
+        x,
+        y,
+        count,
+        speed,
+        size,
+        damage,
+        life,
+        pierce_level=0,
+        color=0,
+        start_angle=0.0,
+    ):
+        # 中心 (x, y) から全方位に等間隔で count 発 (リング)
+        angles = start_angle + np.arange(count) * (2 * math.pi / count)
+        cos, sin = SIN_COS.lookup_arrays(angles)
+        self.add(
+            count,
+            x=x - size / 2,
+            y=y - size / 2,
+            vx=cos * speed,
+            vy=sin * speed,
+            size=size,
+            damage=damage,
+            life=life,
+            pierce=pierce_level + 1,
+            decay=PIERCE_DAMAGE_DECAY,
+            color=color,
+        )
+
+    def orbit(self, x, y, count, radius, angular_speed, size, damage, life, color=0):
+        # 中心 (x, y) の周り、半径 radius の円周上に等間隔で count 枚の刃
+        # (何体でも貫通する)
+        # 動かすときは update() に渡す持ち主の位置を中心にして回る
+        angles = np.arange(count) * (2 * math.pi / count)
+        cos, sin = SIN_COS.lookup_arrays(angles)
+        self.add(
+            count,
+            x=x + cos * radius - size / 2,
+            y=y + sin * radius - size / 2,
+            size=size,
+            damage=damage,
+            life=life,
+            pierce=PIERCE_INFINITE,
+            motion=MOTION_ORBIT,
+            orbit_angle=angles,
+            orbit_radius=radius,
+            orbit_speed=angular_speed,
+            color=color,
+        )
+
+    def chain(
+        self,
+        x,
+        y,
+        dir_x,
+        dir_y,
+        count,
+        delay_step,
+        speed,
+        size,
+        damage,
+        life,
+        pierce_level=0,
+        color=0,
+    ):
+        # 中心 (x, y) から向き (dir_x, dir_y) に、
+        # delay_step フレームずつ遅れて続けて飛ぶ count 発
+        self.add(
+            count,
+            x=x - size / 2,
+            y=y - size / 2,
+            vx=dir_x * speed,
+            vy=dir_y * speed,
+            size=size,
+            damage=damage,
+            life=life,
+            delay=np.arange(count) * delay_step,
+            pierce=pierce_level + 1,
+            decay=PIERCE_DAMAGE_DECAY,
+            color=color,
+        )
+
+    def update(self, owner_x, owner_y, min_x, min_y, max_x, max_y):
+        # 全ての弾を1フレーム分動かし、寿命が尽きたか
+        # 範囲 (min_x, min_y)-(max_x, max_y) の外に出た弾を消す
+        # (消した弾は compact() で取り除く)
+        # オービットの刃は持ち主 (owner_x, owner_y) の周りを回る
+        n = self.count
+        if n == 0:
+            return
+        x = self.x[:n]
+        y = self.y[:n]
+        delay = self.delay[:n]
+        moving = self.active[:n] & (delay == 0)
+        np.subtract(delay, 1, out=delay, where=delay > 0)
+        self.prev_x[:n] = x
+        self.prev_y[:n] = y
+
+        motion = self.motion[:n]
+        straight = moving & (motion == MOTION_STRAIGHT)
+        np.add(x, self.vx[:n], out=x, where=straight)
+        np.add(y, self.vy[:n], out=y, where=straight)
+        orbit = np.flatnonzero(moving & (motion == MOTION_ORBIT))
+        if len(orbit):
+            old_cos, old_sin = SIN_COS.lookup_arrays(self.orbit_angle[orbit])
+            angle = self.orbit_angle[orbit] + self.orbit_speed[orbit]
+            self.orbit_angle[orbit] = angle
+            cos, sin = SIN_COS.lookup_arrays(angle)
+            radius = self.orbit_radius[orbit]
+            half = self.size[orbit] / 2
+            x[orbit] = owner_x + cos * radius - half
+            y[orbit] = owner_y + sin * radius - half
+            # 経路は持ち主から見た回転の分だけにする
+            # (持ち主と一緒に平行移動した分では当てない)
+            self.prev_x[orbit] = x[orbit] - (cos - old_cos) * radius
+            self.prev_y[orbit] = y[orbit] - (sin - old_sin) * radius
+
+        life = self.life[:n]
+        np.subtract(life, 1, out=life, where=moving)
+        size = self.size[:n]
+        inside = (x + size > min_x) & (x < max_x) & (y + size > min_y) & (y < max_y)
+        self.active[:n] &= (life > 0) & inside
+
+    def collide(self, enemies):
+        # 動いている弾と生きている敵の当たり判定をまとめて行い、当たった敵の HP を減らす
+        # 弾は、このフレームに動いた経路ごと判定し (Bullet と同じスラブ法)、
+        # 当たった時刻の早い順に貫通できる数まで当てる
+        # 当たった組の (弾のインデックス, 敵のインデックス, ダメージ) を返す
+        n = self.count
+        m = enemies.count
+        p = np.flatnonzero(self.active[:n] & (self.delay[:n] == 0))
+        e = np.flatnonzero(enemies.active[:m] & (enemies.hp[:m] > 0))
+        if len(p) == 0 or len(e) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+
+        start_x = self.prev_x[p]
+        start_y = self.prev_y[p]
+        end_x = self.x[p]
+        end_y = self.y[p]
+        size = self.size[p]
+        enemy_x = enemies.x[e]
+        enemy_y = enemies.y[e]
+        enemy_size = enemies.size[e]
+        # 経路を囲む矩形と敵の矩形が重なる組だけに絞ってから、経路で判定する
+        x0 = np.minimum(start_x, end_x)
+        y0 = np.minimum(start_y, end_y)
+        x1 = np.maximum(start_x, end_x) + size
+        y1 = np.maximum(start_y, end_y) + size
+        box, target = overlap_pairs(
+            x0,
+            y0,
+            x1,
+            y1,
+            enemy_x,
+            enemy_y,
+            float(enemy_size.max()),
+            BROADPHASE_CELL_SIZE,
+        )
+        tx = enemy_x[target]
+        ty = enemy_y[target]
+        ts = enemy_size[target]
+        near = (
+            (tx < x1[box]) & (tx + ts > x0[box]) & (ty < y1[box]) & (ty + ts > y0[box])
+        )
+        box = box[near]
+        target = target[near]
+        hit_time, hit = sweep_hit_times(
+            start_x[box],
+            start_y[box],
+            size[box],
+            end_x[box] - start_x[box],
+            end_y[box] - start_y[box],
+            tx[near],
+            ty[near],
+            ts[near],
+        )
+        pi = p[box[hit]]
+        ei = e[target[hit]]
+        hit_time = hit_time[hit]
+
+        # 既にこの弾が当たった敵は飛ばす
+        keys = (self.ids[pi] << 32) | enemies.ids[ei]
+        hit_keys = self.hit_keys
+        if len(hit_keys):
+            pos = np.minimum(np.searchsorted(hit_keys, keys), len(hit_keys) - 1)
+            new = hit_keys[pos] != keys
+            pi = pi[new]
+            ei = ei[new]
+            hit_time = hit_time[new]
+            keys = keys[new]
+
+        # 全ての弾の当たりを時刻の早い順に並べ、ラウンドに分けて確定していく
+        # 倒れた敵への当たりは捨てる (同じフレームで先に別の弾や Bullet が倒した敵に、
+        # 貫通もダメージも使わない)。貫通を使い切った弾の残りの当たりも捨てる
+        order = np.lexsort((ei, pi, hit_time))
+        pi = pi[order]
+        ei = ei[order]
+        keys = keys[order]
+        k = len(pi)
+        pending = np.ones(k, dtype=np.bool_)
+        landed = np.zeros(k, dtype=np.bool_)
+        damage = np.zeros(k)
+        is_head = np.zeros(k, dtype=np.bool_)
+        earliest = np.full(m, k) # 敵ごとの、先頭でない残りの当たりのうち一番早いもの
+        while True:
+            rest = np.flatnonzero(pending)
+            spent = (self.pierce[pi[rest]] <= 0) | (enemies.hp[ei[rest]] <= 0)
+            pending[rest[spent]] = False
+            rest = rest[~spent]
+            if len(rest) == 0:
+                break
+            # 弾ごとに一番早い当たり (先頭) を取る。同じ敵に、
+            # 先頭でないもっと早い当たりが残っている先頭は次のラウンドに回す
+            # (一番早い当たりは必ず確定するので、必ず進む)
+            head = rest[np.unique(pi[rest], return_index=True)[1]]
+            is_head[head] = True
+            later = rest[~is_head[rest]]
+            is_head[head] = False
+            np.minimum.at(earliest, ei[later], later)
+            head = head[head < earliest[ei[head]]]
+            earliest[ei[later]] = k
+
+            # 敵ごとに時刻の順に当て、HP が尽きた後の当たりは捨てる
+            head = head[np.lexsort((head, ei[head]))]
+            hit_p = pi[head]
+            hit_e = ei[head]
+            hit_damage = self.damage[hit_p] * np.maximum(
+                0.0, 1.0 - self.hits[hit_p] * self.decay[hit_p]
+            )
+            before = np.cumsum(hit_damage) - hit_damage
+            group_start = np.flatnonzero(np.r_[True, hit_e[1:] != hit_e[:-1]])
+            group_size = np.diff(np.r_[group_start, len(head)])
+            before -= np.repeat(before[group_start], group_size)
+            alive = enemies.hp[hit_e] - before > 0
+            pending[head] = False
+            landed[head[alive]] = True
+            damage[head] = hit_damage
+            hit_p = hit_p[alive]
+            np.subtract.at(enemies.hp, hit_e[alive], hit_damage[alive])
+            # 貫通した数だけ、その弾の次の当たりのダメージが減る
+            self.hits[hit_p] += 1
+            self.pierce[hit_p] -= 1
+
+        self.active[:n] &= self.pierce[:n] > 0
+        self.hit_keys = np.sort(np.concatenate((hit_keys, keys[landed])))
+        return pi[landed], ei[landed], damage[landed]
+
+    def compact(self):
+        # 消えた弾をまとめて取り除き、生きている弾を先頭に詰める (順番は保つ)
+        # 消えた弾が当てた敵の記録も捨てる
+        n = self.count
+        keep = self.active[:n].copy()
+        k = int(np.count_nonzero(keep))
+        if k == n:
+            return
+        for name in self.ARRAY_NAMES:
+            arr = getattr(self, name)
+            arr[:k] = arr[:n][keep]
+        self.count = k
+        if len(self.hit_keys):
+            self.hit_keys = self.hit_keys[np.isin(self.hit_keys >> 32, self.ids[:k])]
+
+    def state(self):
+        # スナップショット用 ({列の名前: バイト列} と当てた敵の記録)
+        n = self.count
+        columns = {name: getattr(self, name)[:n].tobytes() for name in self.ARRAY_NAMES}
+        return n, self.next_id, columns, self.hit_keys.tobytes()
+
+    def load_state(self, state):
+        n, next_id, columns, hit_keys = state
+        if n > len(self.x):
+            self.grow(n)
+        for name in self.ARRAY_NAMES:
+            arr = getattr(self, name)
+            arr[:n] = np.frombuffer(columns[name], dtype=arr.dtype)
+        self.count = n
+        self.next_id = next_id
+        self.hit_keys = np.frombuffer(hit_keys, dtype=np.int64).copy()
+
+
+def sweep_hit_times(x, y, size, dx, dy, enemy_x, enemy_y, enemy_size):
+    # main.sweep_hit_time() の配列版 (動く正方形と止まっている正方形)
+    # 重なり始める時刻 (0〜1) の配列と、重なったかどうかの配列を返す
+    t_enter = np.zeros(len(x))
+    t_exit = np.ones(len(x))
+    for start, delta, low, high in (
+        (x, dx, enemy_x - size, enemy_x + enemy_size),
+        (y, dy, enemy_y - size, enemy_y + enemy_size),
+    ):
+        moving = delta != 0
+        safe = np.where(moving, delta, 1.0)
+        t0 = (low - start) / safe
+        t1 = (high - start) / safe
+        # 動かない軸は、最初から重なっていれば (-inf, inf)、でなければ空 (inf, -inf)
+        inside = (low < start) & (start < high)
+        still_enter = np.where(inside, -np.inf, np.inf)
+        still_exit = np.where(inside, np.inf, -np.inf)
+        t_enter = np.maximum(t_enter, np.where(moving, np.minimum(t0, t1), still_enter))
+        t_exit = np.minimum(t_exit, np.where(moving, np.maximum(t0, t1), still_exit))
+    return t_enter, t_enter < t_exit
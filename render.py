@@ -0,0 +1,144 @@
+import numpy as np
+import pyxel
+
+# これ以下の面積の矩形は、画素をNumPyでまとめて書き込む
+# (大きい矩形は pyxel の rect の方が速いので1個ずつ塗る)
+SCATTER_MAX_AREA = 16
+
+
+def image_pixels(image):
+    # pyxel.Image の画素 (カラー番号) を (高さ, 幅) のNumPy配列として直接見るでやんす
+    # コピーではないので、この配列に書き込むとそのまま画像に反映される
+    return np.ctypeslib.as_array(image.data_ptr()).reshape(image.height, image.width)
+
+
+def round_half_away(values):
+    # pyxel.rect と同じ丸め方 (0.5は0から遠い方へ) で座標を整数にする
+    return (np.copysign(np.floor(np.abs(values) + 0.5), values)).astype(np.int64)
+
+
+class RectBatcher:
+    # 同じ大きさの矩形 (弾・オーブ・敵など) をまとめて画像に塗るでやんす
+    # 画面外の矩形はNumPyで一括して先に捨て、小さい矩形は1回の代入でまとめて塗る
+    def __init__(self, image, scatter_max_area=SCATTER_MAX_AREA):
+        self.image = image
+        self.pixels = image_pixels(image)
+        self.flat_pixels = self.pixels.reshape(-1)
+        self.scatter_max_area = scatter_max_area
+        self.offsets = {} # (幅, 高さ) ごとの矩形内の画素オフセット (1次元の添字)
+        self.drawn_count = 0 # 直近のフレームで塗った矩形の数
+        self.culled_count = 0 # 画面外だったので飛ばした矩形の数
+        self.origin_x = 0 # 画像の左上に来る座標 (カメラの位置。整数)
+        self.origin_y = 0
+
+    def begin_frame(self, origin_x=0, origin_y=0):
+        self.drawn_count = 0
+        self.culled_count = 0
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+
+    def rect_offsets(self, w, h):
+        offsets = self.offsets.get((w, h))
+        if offsets is None:
+            oy, ox = np.mgrid[0:h, 0:w]
+            offsets = (oy * self.pixels.shape[1] + ox).ravel()
+            self.offsets[(w, h)] = offsets
+        return offsets
+
+    def fill_rects(self, xs, ys, w, h, colors):
+        # 左上 (xs[i], ys[i])、
+        # 大きさ w x h の矩形を colors (1色または1個ずつの配列) で塗る
+        if len(xs) == 0:
+            return
+        w = int(round_half_away(np.float64(w)))
+        h = int(round_half_away(np.float64(h)))
+        if w <= 0 or h <= 0:
+            return
+        height, width = self.pixels.shape
+        x0 = round_half_away(np.asarray(xs, dtype=np.float64)) - self.origin_x
+        y0 = round_half_away(np.asarray(ys, dtype=np.float64)) - self.origin_y
+        colors = np.asarray(colors)
+
+        # 画面に全く入らない矩形は、ここでまとめて捨てる
+        visible = (x0 < width) & (x0 + w > 0) & (y0 < height) & (y0 + h > 0)
+        n = int(np.count_nonzero(visible))
+        self.culled_count += len(x0) - n
+        if n == 0:
+            return
+        self.drawn_count += n
+        if n < len(x0):
+            x0 = x0[visible]
+            y0 = y0[visible]
+            if colors.ndim:
+                colors = colors[visible]
+
+        if w * h > self.scatter_max_area:
+            self.fill_each(x0, y0, w, h, colors)
+            return
+
+        # 画面の端にかかる矩形は少ないので、それだけ1個ずつ塗る
+        inside = (x0 >= 0) & (y0 >= 0) & (x0 + w <= width) & (y0 + h <= height)
+        if not inside.all():
+            edge = ~inside
+            self.fill_each(
+                x0[edge], y0[edge], w, h, colors[edge] if colors.ndim else colors
+            )
+            x0 = x0[inside]
+            y0 = y0[inside]
+            if colors.ndim:
+                colors = colors[inside]
+
+        index = (y0 * width + x0)[:, None] + self.rect_offsets(w, h)
+        self.flat_pixels[index] = colors[:, None] if colors.ndim else colors
+
+    def fill_each(self, x0, y0, w, h, colors):
+        rect = self.image.rect
+        if colors.ndim:
+            for x, y, color in zip(x0.tolist(), y0.tolist(), colors.tolist()):
+                rect(x, y, w, h, color)
+        else:
+            color = int(colors)
+            for x, y in zip(x0.tolist(), y0.tolist()):
+                rect(x, y, w, h, color)
+
+    def fill_rects_sized(self, xs, ys, sizes, colors):
+        # 正方形の大きさがバラバラな場合 (敵など)、大きさごとのグループに分けて塗る
+        if len(sizes) == 0:
+            return
+        sizes = np.asarray(sizes)
+        colors = np.asarray(colors)
+        unique_sizes = np.unique(sizes)
+        if len(unique_sizes) == 1:
+            self.fill_rects(xs, ys, unique_sizes[0], unique_sizes[0], colors)
+            return
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        for size in unique_sizes:
+            group = sizes == size
+            self.fill_rects(
+                xs[group],
+                ys[group],
+                size,
+                size,
+                colors[group] if colors.ndim else colors,
+            )
+
+
+class CachedLayer:
+    # 内容が変わったときだけ描き直すオフスクリーンの画像でやんす (HUD・メニューなど)
+    # update(key, build, *args) は key が前回と違うときだけ画像を黒 (0) で消して
+    # build(image, key, *args) で描き直し、画像を返す (呼び出し側はそれを blt で貼る)
+    def __init__(self, width, height):
+        self.image = pyxel.Image(width, height)
+        self.key = None
+        self.built = False
+        self.rebuild_count = 0 # 描き直した回数 (計測用)
+
+    def update(self, key, build, *args):
+        if not self.built or key != self.key:
+            self.image.cls(0)
+            build(self.image, key, *args)
+            self.key = key
+            self.built = True
+            self.rebuild_count += 1
+        return self.image
@@ -0,0 +1,303 @@
+import argparse
+import hashlib
+import json
+import struct
+import time
+import zlib
+
+from events import EventLog
+from main import (
+    ALL_ABILITIES,
+    GAME_STATE_GAME_OVER,
+    App,
+    FrameClock,
+    InputState,
+    PyxelInputSource,
+    Simulation,
+    parse_debug_abilities,
+)
+from stats import STAT_MAX_HP
+
+# リプレイファイル (.vsr) の形式
+#   ヘッダ: マジック, バージョン, シード, 開始フレーム, フレーム数,
+#   アビリティ名JSONの長さ
+#   アビリティ名のJSON (デバッグ用アビリティ)
+#   チェックサムの有無 (1バイト) + 最終状態のSHA-1 (20バイト)
+#   フレームごとの入力をzlibで圧縮したもの
+#   (1フレーム6バイト: ボタンのビット列 + マウス座標)
+REPLAY_MAGIC = b"VSRP"
+REPLAY_VERSION = 1
+HEADER = struct.Struct("<4sBQIIH")
+FRAME = struct.Struct("<Hhh")
+
+# ビット列に詰める InputState のボタン
+# (順番を変えると古いリプレイが読めなくなるので注意)
+BUTTONS = (
+    "left",
+    "right",
+    "up",
+    "down",
+    "fire",
+    "toggle_continuous_move",
+    "menu_up",
+    "menu_down",
+    "confirm",
+    "retry",
+    "quit",
+)
+
+
+def pack_inputs(inputs):
+    bits = 0
+    for i, name in enumerate(BUTTONS):
+        if getattr(inputs, name):
+            bits |= 1 << i
+    return FRAME.pack(bits, int(inputs.mouse_x), int(inputs.mouse_y))
+
+
+def unpack_inputs(data, offset=0):
+    bits, mouse_x, mouse_y = FRAME.unpack_from(data, offset)
+    inputs = InputState(mouse_x=mouse_x, mouse_y=mouse_y)
+    for i, name in enumerate(BUTTONS):
+        if bits & (1 << i):
+            setattr(inputs, name, True)
+    return inputs
+
+
+def state_checksum(sim):
+    # リプレイが同じ結果になったか確かめるための、ワールドの状態のハッシュ
+    digest = hashlib.sha1()
+    digest.update(
+        repr(
+            (
+                sim.clock.frame_count,
+                sim.game_state,
+                sim.player_x,
+                sim.player_y,
+                sim.player_hp,
+                sim.stats.get(STAT_MAX_HP),
+                sim.player_level,
+                sim.player_exp,
+                sim.current_phase,
+                sim.chunks.dormant_count,
+                [(b.x, b.y, b.pierced_count) for b in sim.bullets + sim.homing_bullets],
+                [(o.x, o.y, o.value, o.life) for o in sim.exp_orbs],
+                [(g.x, g.y, g.attack_timer) for g in sim.ghosts],
+                sorted(sim.acquired_ability_levels.items()),
+            )
+        ).encode()
+    )
+    enemies = sim.enemies
+    for name in ("x", "y", "hp", "ids"):
+        digest.update(getattr(enemies, name)[: enemies.count].tobytes())
+    projectiles = sim.projectiles
+    for name in ("x", "y", "pierce", "ids"):
+        digest.update(getattr(projectiles, name)[: projectiles.count].tobytes())
+    return digest.digest()
+
+
+class Replay:
+    # 1回のランを再現するのに必要なもの (シードと、フレームごとの入力)
+    def __init__(
+        self, seed, debug_abilities=(), start_frame=0, frames=b"", checksum=None
+    ):
+        self.seed = seed
+        self.debug_abilities = list(debug_abilities)
+        self.start_frame = start_frame
+        self.frames = frames # pack_inputs() したものを連結したバイト列
+        self.checksum = checksum # 記録終了時の state_checksum() (なければNone)
+
+    @property
+    def num_frames(self):
+        return len(self.frames) // FRAME.size
+
+    def create_simulation(self, clock=None):
+        if clock is None:
+            clock = FrameClock(self.start_frame)
+        return Simulation(self.debug_abilities, clock=clock, seed=self.seed)
+
+    def save(self, path):
+        abilities = json.dumps(self.debug_abilities).encode()
+        with open(path, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    REPLAY_MAGIC,
+                    REPLAY_VERSION,
+                    self.seed,
+                    self.start_frame,
+                    self.num_frames,
+                    len(abilities),
+                )
+            )
+            f.write(abilities)
+            if self.checksum is None:
+                f.write(b"\0" + b"\0" * 20)
+            else:
+                f.write(b"\1" + self.checksum)
+            f.write(zlib.compress(self.frames, 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, start_frame, num_frames, abilities_len = (
+            HEADER.unpack_from(data)
+        )
+        if magic != REPLAY_MAGIC:
+            raise ValueError(f"{path} is not a replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"unsupported replay version: {version}")
+        offset = HEADER.size
+        debug_abilities = json.loads(data[offset : offset + abilities_len])
+        offset += abilities_len
+        has_checksum = data[offset]
+        checksum = data[offset + 1 : offset + 21] if has_checksum else None
+        frames = zlib.decompress(data[offset + 21 :])
+        if len(frames) != num_frames * FRAME.size:
+            raise ValueError(f"{path} is truncated")
+        return cls(seed, debug_abilities, start_frame, frames, checksum)
+
+
+class InputRecorder:
+    # 別の入力ソースをラップして、読んだ入力を全て記録する入力ソース
+    def __init__(self, source, seed, debug_abilities=(), start_frame=0):
+        self.source = source
+        self.seed = seed
+        self.debug_abilities = list(debug_abilities)
+        self.start_frame = start_frame
+        self.frames = bytearray()
+
+    def latch(self):
+        self.source.latch()
+
+    def poll(self):
+        inputs = self.source.poll()
+        self.frames += pack_inputs(inputs)
+        return inputs
+
+    def to_replay(self, sim=None):
+        # sim を渡すと、その時点の状態のチェックサムも一緒に保存する
+        checksum = state_checksum(sim) if sim is not None else None
+        return Replay(
+            self.seed,
+            self.debug_abilities,
+            self.start_frame,
+            bytes(self.frames),
+            checksum,
+        )
+
+    def save(self, path, sim=None):
+        self.to_replay(sim).save(path)
+
+
+class ReplayInputSource:
+    # リプレイに記録された入力を1フレームずつ返す入力ソース
+    # 最後まで再生したら、それ以降は何も入力しない
+    def __init__(self, replay):
+        self.replay = replay
+        self.position = 0
+
+    @property
+    def finished(self):
+        return self.position >= self.replay.num_frames
+
+    def latch(self):
+        pass # 記録された入力を返すだけなので、貯めるものはない
+
+    def poll(self):
+        if self.finished:
+            return InputState()
+        inputs = unpack_inputs(self.replay.frames, self.position * FRAME.size)
+        self.position += 1
+        return inputs
+
+
+def run_replay(replay, events=None):
+    # リプレイをCPUが許す限りの速さで最後まで再生し、最後の状態の Simulation を返す
+    # events に EventLog を渡すと、再生中のイベントを記録する (閉じるのは呼び出し側)
+    sim = replay.create_simulation()
+    if events is not None:
+        sim.events = events
+    source = ReplayInputSource(replay)
+    for _ in range(replay.num_frames):
+        sim.step(source.poll())
+    return sim
+
+
+class RecordingApp(App):
+    # 普通に遊びながら入力を記録するApp (ゲームオーバーになるたび・終了時に保存する)
+    def __init__(self, sim, path):
+        self.path = path
+        self.recorder = InputRecorder(
+            PyxelInputSource(), sim.seed, sim.debug_abilities, sim.clock.frame_count
+        )
+        # 巻き戻すと記録した入力と状態が合わなくなるので、記録中は巻き戻せないようにする
+        super().__init__(sim, self.recorder, rewind_seconds=0)
+
+    def tick(self):
+        was_game_over = self.sim.game_state == GAME_STATE_GAME_OVER
+        super().tick()
+        if self.sim.game_state == GAME_STATE_GAME_OVER and not was_game_over:
+            self.recorder.save(self.path, self.sim)
+        if self.sim.quit_requested:
+            self.recorder.save(self.path, self.sim) # 終了は App.update() が行う
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or play back replays.")
+    parser.add_argument("path", help="replay file (.vsr)")
+    parser.add_argument(
+        "--record", action="store_true", help="play the game and record"
+    )
+    parser.add_argument("--seed", type=int, help="seed for --record")
+    parser.add_argument(
+        "--realtime", action="store_true", help="play back in a window at 30 FPS"
+    )
+    parser.add_argument(
+        "--events",
+        help="write gameplay events of the playback to this file (.jsonl or .bin)",
+    )
+    args, ability_args = parser.parse_known_args()
+
+    if args.record:
+        # 例: uv run replay.py run.vsr --record --seed 1 --piercing_shot
+        sim = Simulation(parse_debug_abilities(ability_args), seed=args.seed)
+        RecordingApp(sim, args.path)
+        return
+
+    replay = Replay.load(args.path)
+    if args.realtime:
+        # 巻き戻すと入力の位置と状態が合わなくなるので、再生中も巻き戻せないようにする
+        App(replay.create_simulation(), ReplayInputSource(replay), rewind_seconds=0)
+        return
+
+    # イベントはリプレイの再生から作る
+    # (同じ入力なら同じ展開になるので、遊んだときのログと同じ)
+    events = None
+    if args.events:
+        events = EventLog(
+            args.events,
+            binary=args.events.endswith(".bin"),
+            ability_names=[ability.name for ability in ALL_ABILITIES],
+        )
+    start = time.perf_counter()
+    sim = run_replay(replay, events)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{replay.num_frames} frames in {elapsed:.3f}s "
+        f"({replay.num_frames / max(elapsed, 1e-9):.0f} frames/s)"
+    )
+    if events is not None:
+        events.close()
+        print(f"{events.emitted} events written to {args.events}")
+    print(f"level {sim.player_level}, phase {sim.current_phase}, hp {sim.player_hp}")
+    if replay.checksum is not None:
+        if state_checksum(sim) == replay.checksum:
+            print("checksum OK")
+        else:
+            print("checksum MISMATCH")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+# システム (Simulation の状態を更新する関数) を決めた順番で実行するスケジューラでやんす
+# システムごとに計測区間 (profiler.py の PHASE_*) を持たせておき、
+# 実行するたびにその区間にかかった時間を足す
+# (FrameProfiler を入れると、オーバーレイとCSVにシステムごとの時間が出る)
+
+
+class Scheduler:
+    def __init__(self):
+        self.systems = [] # (計測区間, システム) を実行する順に並べたもの
+
+    def add(self, phase, system, before=None):
+        # system(inputs) を実行する順番に加える
+        # before に計測区間を渡すと、その区間のシステムの直前に差し込む
+        entry = (phase, system)
+        if before is None:
+            self.systems.append(entry)
+            return
+        for position, (other_phase, _) in enumerate(self.systems):
+            if other_phase == before:
+                self.systems.insert(position, entry)
+                return
+        raise ValueError(f"no system for phase {before}")
+
+    def run(self, inputs, profiler):
+        for phase, system in self.systems:
+            system(inputs)
+            profiler.mark(phase)
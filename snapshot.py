@@ -0,0 +1,236 @@
+import pickle
+import time
+import zlib
+
+import numpy as np
+
+from main import ALL_ABILITIES, SIM_FPS, Bullet, Ghost, HomingBullet
+
+# ワールドの状態をまるごとバイト列にするスナップショットと、巻き戻し用のリングバッファ
+# スナップショットはステップとステップの間 (Simulation.step() の後) に取ること
+# (その時点では弾・敵・オーブのリストは詰められていて、使い終わったものは残っていない)
+SNAPSHOT_VERSION = 7
+BULLET_FIELDS = tuple(name for name in Bullet.__slots__ if name != "hit_enemies")
+HOMING_BULLET_FIELDS = BULLET_FIELDS + HomingBullet.__slots__
+SCALAR_TYPES = (bool, int, float)
+
+
+def take_snapshot(sim):
+    enemies = sim.enemies
+    n = enemies.count
+    state = {
+        "version": SNAPSHOT_VERSION,
+        # プレイヤーの値・タイマー・フラグなど、数値の属性は全部そのまま入れる
+        "scalars": {
+            name: value
+            for name, value in vars(sim).items()
+            if type(value) in SCALAR_TYPES
+        },
+        "frame_count": sim.clock.frame_count,
+        "acquired_ability_levels": dict(sim.acquired_ability_levels),
+        "kills_by_phase": dict(sim.kills_by_phase),
+        "stats": sim.stats.state(),
+        "level_up_choices": [
+            ALL_ABILITIES.index(a) for a in sim.selected_abilities_for_level_up
+        ],
+        "rng": rng_state_bytes(sim.rng),
+        "enemy_count": n,
+        "enemy_next_id": enemies.next_id,
+        "enemies": {
+            name: getattr(enemies, name)[:n].tobytes() for name in enemies.ARRAY_NAMES
+        },
+        "dormant_enemies": sim.chunks.state(),
+        "bullets": bullet_states(sim.bullets, BULLET_FIELDS),
+        "homing_bullets": bullet_states(sim.homing_bullets, HOMING_BULLET_FIELDS),
+        "projectiles": sim.projectiles.state(),
+        "orbs": [
+            (orb.x, orb.y, orb.value, orb.life, orb.color, orb.bucket is not None)
+            for orb in sim.exp_orbs
+        ],
+        "ghosts": [dict(vars(ghost)) for ghost in sim.ghosts],
+    }
+    return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def restore_snapshot(sim, data):
+    state = pickle.loads(data)
+    if state["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported snapshot version: {state['version']}")
+
+    # 今の弾とオーブはフリーリストに返してから作り直す
+    for bullet in sim.bullets:
+        sim.bullet_pool.release(bullet)
+    for bullet in sim.homing_bullets:
+        sim.homing_bullet_pool.release(bullet)
+    for orb in sim.exp_orbs:
+        sim.release_exp_orb(orb)
+    sim.bullets = []
+    sim.homing_bullets = []
+    sim.exp_orbs = []
+    sim.orb_buckets.clear()
+    sim.magnet_orbs = []
+    sim.ghosts = []
+    sim.flow_field.target_cell = None # 次のステップで作り直させる
+
+    for name, value in state["scalars"].items():
+        setattr(sim, name, value)
+    sim.clock.frame_count = state["frame_count"]
+    sim.acquired_ability_levels = state["acquired_ability_levels"]
+    sim.kills_by_phase = state["kills_by_phase"]
+    sim.stats.load_state(state["stats"])
+    sim.selected_abilities_for_level_up = [
+        ALL_ABILITIES[i] for i in state["level_up_choices"]
+    ]
+    set_rng_state(sim.rng, state["rng"])
+
+    enemies = sim.enemies
+    n = state["enemy_count"]
+    if n > len(enemies.x):
+        enemies.grow(n)
+    for name in enemies.ARRAY_NAMES:
+        arr = getattr(enemies, name)
+        arr[:n] = np.frombuffer(state["enemies"][name], dtype=arr.dtype)
+    enemies.count = n
+    enemies.next_id = state["enemy_next_id"]
+    enemies.id_to_index = dict(zip(enemies.ids[:n].tolist(), range(n)))
+    sim.chunks.load_state(state["dormant_enemies"])
+    sim.follow_player() # カメラはプレイヤーの位置だけで決まる
+
+    for values, hit_enemies in state["bullets"]:
+        bullet = sim.bullet_pool.acquire(0, 0, 1, 0)
+        restore_bullet(bullet, BULLET_FIELDS, values, hit_enemies)
+        sim.bullets.append(bullet)
+    for values, hit_enemies in state["homing_bullets"]:
+        bullet = sim.homing_bullet_pool.acquire(0, 0, None, 1, 0)
+        restore_bullet(bullet, HOMING_BULLET_FIELDS, values, hit_enemies)
+        sim.homing_bullets.append(bullet)
+
+    sim.projectiles.load_state(state["projectiles"])
+
+    for x, y, value, life, color, on_ground in state["orbs"]:
+        orb = sim.orb_pool.acquire(x, y, value, color)
+        orb.life = life
+        if on_ground:
+            orb.bucket = sim.orb_buckets.key(x, y)
+            sim.orb_buckets.put(orb.bucket, orb)
+        else:
+            sim.magnet_orbs.append(orb)
+        sim.exp_orbs.append(orb)
+
+    for attributes in state["ghosts"]:
+        ghost = Ghost.__new__(Ghost)
+        ghost.__dict__.update(attributes)
+        sim.ghosts.append(ghost)
+
+
+def bullet_states(bullets, fields):
+    return [
+        (tuple(getattr(bullet, name) for name in fields), tuple(bullet.hit_enemies))
+        for bullet in bullets
+    ]
+
+
+def restore_bullet(bullet, fields, values, hit_enemies):
+    for name, value in zip(fields, values):
+        setattr(bullet, name, value)
+    bullet.hit_enemies.update(hit_enemies)
+
+
+def rng_state_bytes(rng):
+    # random.Random の状態 (メルセンヌ・ツイスタの624ワード + 位置) をバイト列にする
+    version, internal, gauss_next = rng.getstate()
+    return version, np.array(internal, dtype=np.uint32).tobytes(), gauss_next
+
+
+def set_rng_state(rng, state):
+    version, internal, gauss_next = state
+    rng.setstate(
+        (version, tuple(np.frombuffer(internal, dtype=np.uint32).tolist()), gauss_next)
+    )
+
+
+class RewindBuffer:
+    # 直近 seconds 秒分のスナップショットを持つリングバッファでやんす
+    # keyframe_interval 回に1回はキーフレーム (単体で圧縮) を取り、
+    # それ以外はキーフレームを zlib の辞書 (zdict) にして圧縮する
+    # (キーフレームとの差分だけが残るので小さくなる)
+    # 古いものはキーフレームとその差分をひとまとめにして捨てるので、持つのは最大でも
+    # seconds 秒 + keyframe_interval フレーム分
+    def __init__(self, seconds=10, keyframe_interval=SIM_FPS, fps=SIM_FPS):
+        self.capacity = int(seconds * fps)
+        self.keyframe_interval = keyframe_interval
+        self.fps = fps
+        # キーフレームとその差分のまとまりのリスト。
+        # まとまりは [(フレーム番号, 圧縮したデータ), ...]
+        # で、先頭がキーフレーム
+        self.segments = []
+        # 最新のキーフレームの生のバイト列 (差分を圧縮するときの辞書)
+        self.keyframe = None
+        self.num_entries = 0
+        self.num_bytes = 0 # 圧縮したデータの合計
+        self.last_push_seconds = 0.0 # 直近の push() にかかった時間
+
+    def push(self, sim):
+        start = time.perf_counter()
+        data = take_snapshot(sim)
+        frame = sim.clock.frame_count
+        if not self.segments or len(self.segments[-1]) >= self.keyframe_interval:
+            self.keyframe = data
+            compressed = zlib.compress(data, 1)
+            self.segments.append([(frame, compressed)])
+        else:
+            compressor = zlib.compressobj(1, zdict=self.keyframe)
+            compressed = compressor.compress(data) + compressor.flush()
+            self.segments[-1].append((frame, compressed))
+        self.num_entries += 1
+        self.num_bytes += len(compressed)
+        # 一番古いまとまりを丸ごと捨てても capacity 分残るなら捨てる
+        while self.num_entries - len(self.segments[0]) >= self.capacity:
+            self.drop_entries(self.segments.pop(0))
+        self.last_push_seconds = time.perf_counter() - start
+
+    def drop_entries(self, entries):
+        self.num_entries -= len(entries)
+        self.num_bytes -= sum(len(compressed) for _, compressed in entries)
+
+    def rewind(self, sim, seconds):
+        # seconds 秒前 (なければ一番古い) の状態に戻し、それより新しい記録は捨てる
+        # 戻した状態のフレーム番号を返す (記録がなければNone)
+        if not self.segments:
+            return None
+        position = max(self.num_entries - 1 - int(seconds * self.fps), 0)
+        for segment_index, entries in enumerate(self.segments):
+            if position < len(entries):
+                break
+            position -= len(entries)
+
+        keyframe = zlib.decompress(entries[0][1])
+        if position == 0:
+            data = keyframe
+        else:
+            data = zlib.decompressobj(zdict=keyframe).decompress(entries[position][1])
+        restore_snapshot(sim, data)
+
+        # 戻した時点より後を捨てる
+        # (戻した時点は残すので、続きはこのまとまりに足していく)
+        for dropped in self.segments[segment_index + 1 :]:
+            self.drop_entries(dropped)
+        del self.segments[segment_index + 1 :]
+        self.drop_entries(entries[position + 1 :])
+        del entries[position + 1 :]
+        self.keyframe = keyframe
+        return entries[position][0]
+
+    @property
+    def seconds_stored(self):
+        return self.num_entries / self.fps
+
+    @property
+    def memory_bytes(self):
+        keyframe = len(self.keyframe) if self.keyframe is not None else 0
+        return self.num_bytes + keyframe
+
+    def bytes_per_second(self):
+        if self.num_entries == 0:
+            return 0.0
+        return self.memory_bytes / self.seconds_stored
@@ -0,0 +1,229 @@
+import math
+
+import numpy as np
+
+
+class PointGrid:
+    # 点の集合 (敵の左上座標など) をセルごとに並べた一様グリッド
+    # 毎フレーム build() でNumPyを使って一括構築し (セル番号でソートするだけ)、
+    # 矩形・最近傍・半径クエリに使うでやんす
+    # クエリの結果は build() に渡した配列のインデックス
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.build(np.zeros(0), np.zeros(0))
+
+    def build(self, xs, ys, max_extent=0.0):
+        # max_extent: 点から右下方向に広がる大きさの最大値 (矩形クエリで使う)
+        cs = self.cell_size
+        self.max_extent = max_extent
+        self.xs = xs.tolist()
+        self.ys = ys.tolist()
+        if len(xs) == 0:
+            self.cx0 = self.cy0 = 0
+            self.width = self.height = 0
+            self.order = []
+            self.starts = [0]
+            return
+        cx = np.floor(xs / cs).astype(np.int64)
+        cy = np.floor(ys / cs).astype(np.int64)
+        self.cx0 = int(cx.min())
+        self.cy0 = int(cy.min())
+        self.width = int(cx.max()) - self.cx0 + 1
+        self.height = int(cy.max()) - self.cy0 + 1
+        keys = (cy - self.cy0) * self.width + (cx - self.cx0)
+        # 安定ソートなので、同じセルの中ではインデックスの小さい順に並ぶ
+        self.order = np.argsort(keys, kind="stable").tolist()
+        counts = np.bincount(keys, minlength=self.width * self.height)
+        self.starts = [0] + np.cumsum(counts).tolist()
+
+    def cell_items(self, cx, cy):
+        # グリッド内の相対セル座標 (cx, cy) にある点のインデックス
+        if cx < 0 or cy < 0 or cx >= self.width or cy >= self.height:
+            return ()
+        k = cy * self.width + cx
+        return self.order[self.starts[k] : self.starts[k + 1]]
+
+    def query_rect(self, x, y, w, h):
+        # 矩形 (x, y, w, h) と重なりうる点をインデックスの小さい順に返す
+        # (実際に重なっているかは呼び出し側で判定する)
+        cs = self.cell_size
+        ext = self.max_extent
+        cx_start = math.floor((x - ext) / cs) - self.cx0
+        cy_start = math.floor((y - ext) / cs) - self.cy0
+        cx_end = math.floor((x + w) / cs) - self.cx0
+        cy_end = math.floor((y + h) / cs) - self.cy0
+        if cx_start == cx_end and cy_start == cy_end:
+            return list(self.cell_items(cx_start, cy_start))
+
+        found = []
+        for cy in range(max(cy_start, 0), min(cy_end, self.height - 1) + 1):
+            for cx in range(max(cx_start, 0), min(cx_end, self.width - 1) + 1):
+                found.extend(self.cell_items(cx, cy))
+        found.sort()
+        return found
+
+    def nearest(self, x, y, max_dist=math.inf, valid=None):
+        # (x, y) に最も近い点のインデックスを返す (max_dist未満に見つからなければNone)
+        # 中心のセルから外側へリング状に探し、
+        # それより外に近い点がありえなくなったら打ち切る
+        # valid (bool配列) を渡すと、valid[i] が偽の点は飛ばす
+        if not self.order:
+            return None
+        cs = self.cell_size
+        xs = self.xs
+        ys = self.ys
+        cx = math.floor(x / cs) - self.cx0
+        cy = math.floor(y / cs) - self.cy0
+        # グリッドの外から探す場合は、グリッドに届くまでのリングは飛ばす
+        first_ring = max(0, -cx, cx - (self.width - 1), -cy, cy - (self.height - 1))
+        max_ring = max(cx, self.width - 1 - cx, cy, self.height - 1 - cy)
+        best = None
+        best_dist = max_dist
+        for ring in range(first_ring, max_ring + 1):
+            # リング上のセルの点は、少なくとも (ring - 1) * cs は離れている
+            if ring > 0 and (ring - 1) * cs >= best_dist:
+                break
+            for i in self.ring_items(cx, cy, ring):
+                if valid is not None and not valid[i]:
+                    continue
+                dist = math.hypot(xs[i] - x, ys[i] - y)
+                # 同じ距離ならインデックスの小さい方 (元のリストで前にある方) を選ぶ
+                if dist < best_dist or (
+                    dist == best_dist and best is not None and i < best
+                ):
+                    best = i
+                    best_dist = dist
+        return best
+
+    def ring_items(self, cx, cy, ring):
+        if ring == 0:
+            yield from self.cell_items(cx, cy)
+            return
+        # リングの上下の辺と左右の辺 (グリッドの外のセルは範囲を切り詰めて飛ばす)
+        for gx in range(max(cx - ring, 0), min(cx + ring, self.width - 1) + 1):
+            yield from self.cell_items(gx, cy - ring)
+            yield from self.cell_items(gx, cy + ring)
+        for gy in range(max(cy - ring + 1, 0), min(cy + ring - 1, self.height - 1) + 1):
+            yield from self.cell_items(cx - ring, gy)
+            yield from self.cell_items(cx + ring, gy)
+
+
+class BucketGrid:
+    # 1セルに1個だけオブジェクトを置ける一様グリッド (経験値オーブをまとめるのに使う)
+    # セルは (セルのx, セルのy) をキーにした辞書なので、
+    # 空のセルはメモリを使わないでやんす
+    def __init__(self, cell_size=8):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def __len__(self):
+        """Return the number of occupied cells (one object per cell)."""
+        return len(self.cells)
+
+    def clear(self):
+        self.cells.clear()
+
+    def key(self, x, y):
+        cs = self.cell_size
+        return (math.floor(x / cs), math.floor(y / cs))
+
+    def get(self, key):
+        return self.cells.get(key)
+
+    def put(self, key, obj):
+        self.cells[key] = obj
+
+    def discard(self, key, obj):
+        # key のセルに obj が置かれていれば取り除く (別のオブジェクトなら何もしない)
+        if self.cells.get(key) is obj:
+            del self.cells[key]
+
+    def neighbour(self, key, exclude=None):
+        # key のセルと、その周り8セルにあるオブジェクトを1つ返す
+        # (exclude は除く。なければNone)
+        cells = self.cells
+        kx, ky = key
+        for dy in (0, -1, 1):
+            for dx in (0, -1, 1):
+                obj = cells.get((kx + dx, ky + dy))
+                if obj is not None and obj is not exclude:
+                    return obj
+        return None
+
+    def query_rect(self, x, y, w, h):
+        # 矩形 (x, y, w, h) が重なるセルにあるオブジェクト
+        # (重なっているかは呼び出し側で判定する)
+        cs = self.cell_size
+        cells = self.cells
+        found = []
+        for ky in range(math.floor(y / cs), math.floor((y + h) / cs) + 1):
+            for kx in range(math.floor(x / cs), math.floor((x + w) / cs) + 1):
+                obj = cells.get((kx, ky))
+                if obj is not None:
+                    found.append(obj)
+        return found
+
+
+def overlap_pairs(x0, y0, x1, y1, xs, ys, max_extent, cell_size=32):
+    # 矩形 i (左上 (x0[i], y0[i])、右下 (x1[i], y1[i])) と重なりうる点 j の組を、
+    # NumPy でまとめて探す
+    # 点 j は (xs[j], ys[j]) から右下に最大 max_extent まで広がる物
+    # (敵の左上座標と大きさなど)
+    # 戻り値は (矩形の添字の配列, 点の添字の配列)。
+    # 実際に重なっているかは呼び出し側で判定する
+    # 弾が何万個もあって、PointGrid.query_rect() を1個ずつ呼ぶと遅いとき用でやんす
+    empty = np.zeros(0, dtype=np.int64)
+    if len(x0) == 0 or len(xs) == 0:
+        return empty, empty
+    # 1つの矩形が縦横それぞれ最大2セルにしかかからない大きさのセルにする
+    cs = max(
+        cell_size,
+        float(np.max(x1 - x0)) + max_extent,
+        float(np.max(y1 - y0)) + max_extent,
+    )
+    cx = np.floor(xs / cs).astype(np.int64)
+    cy = np.floor(ys / cs).astype(np.int64)
+    cx0 = int(cx.min())
+    cy0 = int(cy.min())
+    width = int(cx.max()) - cx0 + 1
+    height = int(cy.max()) - cy0 + 1
+    keys = (cy - cy0) * width + (cx - cx0)
+    order = np.argsort(keys, kind="stable")
+    starts = np.concatenate(
+        ([0], np.cumsum(np.bincount(keys, minlength=width * height)))
+    )
+
+    # 矩形ごとに、かかるセル (最大 2x2) の点の範囲を並べる
+    box_cx0 = np.floor((x0 - max_extent) / cs).astype(np.int64) - cx0
+    box_cy0 = np.floor((y0 - max_extent) / cs).astype(np.int64) - cy0
+    box_cx1 = np.floor(x1 / cs).astype(np.int64) - cx0
+    box_cy1 = np.floor(y1 / cs).astype(np.int64) - cy0
+    boxes = []
+    begins = []
+    ends = []
+    for ox in (0, 1):
+        for oy in (0, 1):
+            cell_x = box_cx0 + ox
+            cell_y = box_cy0 + oy
+            valid = (
+                (cell_x <= box_cx1)
+                & (cell_y <= box_cy1)
+                & (cell_x >= 0)
+                & (cell_y >= 0)
+                & (cell_x < width)
+                & (cell_y < height)
+            )
+            index = np.flatnonzero(valid)
+            cell = cell_y[index] * width + cell_x[index]
+            boxes.append(index)
+            begins.append(starts[cell])
+            ends.append(starts[cell + 1])
+    boxes = np.concatenate(boxes)
+    begins = np.concatenate(begins)
+    counts = np.concatenate(ends) - begins
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty
+    # 範囲 [begin, begin + count) を1本の添字の列に展開する
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(boxes, counts), order[np.repeat(begins, counts) + offsets]
@@ -0,0 +1,74 @@
+# プレイヤーの能力値 (ステータス) と、アビリティが登録する修正値 (モディファイア)
+# 値は「(基本値 + 加算の合計) * (1 + 倍率の合計)」で、そこから計算する派生値も含めて
+# 一度計算したらキャッシュし、
+# 基本値か修正値が変わったとき (レベルアップ・アビリティ取得) だけ計算し直すでやんす
+
+# 基本値と修正値を持つ能力値
+STAT_LEVEL = "level" # プレイヤーのレベル (ゴーストの攻撃力に効く)
+STAT_MAX_HP = "max_hp"
+STAT_MOVE_SPEED = "move_speed" # 1フレームに動くピクセル数
+STAT_BULLET_DAMAGE = "bullet_damage"
+STAT_BULLET_SPEED = "bullet_speed" # 弾が1フレームに飛ぶピクセル数
+STAT_SHOT_COOLDOWN = "shot_cooldown" # 発射レートが1倍のときの発射間隔 (フレーム数)
+STAT_FIRE_RATE = "fire_rate" # 発射レートの倍率
+
+# 上の能力値から計算する派生値
+STAT_SHOT_INTERVAL = "shot_interval" # 実際の発射間隔 (フレーム数)
+STAT_GHOST_DAMAGE_MULTIPLIER = "ghost_damage_multiplier" # レベルが1上がるごとに1.1倍
+GHOST_DAMAGE_PER_LEVEL = 1.1
+
+
+def compute_derived(values):
+    values[STAT_SHOT_INTERVAL] = values[STAT_SHOT_COOLDOWN] / values[STAT_FIRE_RATE]
+    values[STAT_GHOST_DAMAGE_MULTIPLIER] = GHOST_DAMAGE_PER_LEVEL ** (
+        values[STAT_LEVEL] - 1
+    )
+
+
+class Stats:
+    def __init__(self, base):
+        self.base = dict(base) # {能力値: 基本値}
+        self.modifiers = [] # (能力値, 加算, 倍率, 登録元) のリスト (登録した順)
+        self.values = {} # 計算済みの値 (派生値を含む)
+        self.dirty = True # True なら values が古い
+
+    def set_base(self, stat, value):
+        if self.base.get(stat) != value:
+            self.base[stat] = value
+            self.dirty = True
+
+    def add_modifier(self, stat, add=0, mul=0.0, source=None):
+        # 加算 add と倍率 mul (0.1 なら +10%) を登録する
+        self.modifiers.append((stat, add, mul, source))
+        self.dirty = True
+
+    def get(self, stat):
+        if self.dirty:
+            self.refresh()
+        return self.values[stat]
+
+    def refresh(self):
+        adds = dict.fromkeys(self.base, 0)
+        muls = dict.fromkeys(self.base, 0.0)
+        for stat, add, mul, _ in self.modifiers:
+            adds[stat] += add
+            muls[stat] += mul
+        values = {}
+        for stat, base in self.base.items():
+            value = base + adds[stat]
+            if muls[stat]:
+                value *= 1 + muls[stat] # 倍率がなければ掛けない (整数のままにする)
+            values[stat] = value
+        compute_derived(values)
+        self.values = values
+        self.dirty = False
+
+    def state(self):
+        # スナップショット用 (計算済みの値は含めない)
+        return dict(self.base), list(self.modifiers)
+
+    def load_state(self, state):
+        base, modifiers = state
+        self.base = dict(base)
+        self.modifiers = list(modifiers)
+        self.dirty = True
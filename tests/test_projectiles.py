@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from enemies import EnemyStore
+from projectiles import PIERCE_DAMAGE_DECAY, ProjectileStore
+
+BOUNDS = (-1000, -1000, 1000, 1000) # 範囲の外に出て消えないように広くとる
+
+
+def enemies_in_a_row(count, hp=100, spacing=10):
+    # y=0 に 8x8 の敵を x=20 から spacing おきに並べる
+    enemies = EnemyStore()
+    for i in range(count):
+        enemies.spawn(20 + spacing * i, 0, hp, 0, 8, 1, 0)
+    return enemies
+
+
+def fire_right(projectiles, speed, pierce_level=0, damage=10, life=100):
+    # (0, 4) から右へ1発 (2x2)
+    projectiles.spread(0, 4, 1, 0, 1, 0, speed, 2, damage, life, pierce_level)
+
+
+def step(projectiles, enemies):
+    projectiles.update(0, 0, *BOUNDS)
+    return projectiles.collide(enemies)
+
+
+def test_pierce_limits_hits_in_order_with_decay():
+    enemies = enemies_in_a_row(4)
+    projectiles = ProjectileStore()
+    fire_right(projectiles, 60, pierce_level=2) # 1フレームで4体とも通り過ぎる
+    _, hit, damage = step(projectiles, enemies)
+    # 貫通レベル2なら3体まで、近い順に、貫通するごとにダメージが減る
+    assert hit.tolist() == [0, 1, 2]
+    decayed = [10 * (1 - PIERCE_DAMAGE_DECAY * k) for k in range(3)]
+    assert damage == pytest.approx(decayed)
+    assert enemies.hp[:4].tolist() == pytest.approx([90, 92, 94, 100])
+    assert not projectiles.active[0]
+
+
+def test_pierce_spent_across_frames():
+    enemies = enemies_in_a_row(3, spacing=20)
+    projectiles = ProjectileStore()
+    fire_right(projectiles, 20, pierce_level=1)
+    hits = []
+    for _ in range(5):
+        hits += step(projectiles, enemies)[1].tolist()
+    # 2体目で貫通を使い切り、3体目には当たらない (2体目は減ったダメージ)
+    assert hits == [0, 1]
+    decayed = 100 - 10 * (1 - PIERCE_DAMAGE_DECAY)
+    assert enemies.hp[:3].tolist() == pytest.approx([90, decayed, 100])
+
+
+def test_skips_enemy_killed_by_another_projectile_in_the_same_frame():
+    # HP 10 の敵の後ろに HP 100 の敵。同じ経路の2発が同じフレームで重なる
+    enemies = enemies_in_a_row(2, hp=10)
+    enemies.hp[1] = 100
+    projectiles = ProjectileStore()
+    fire_right(projectiles, 60, pierce_level=1)
+    fire_right(projectiles, 60, pierce_level=1)
+    shooter, hit, damage = step(projectiles, enemies)
+    # 1発目が手前の敵を倒すので、2発目はその敵に貫通もダメージも使わず、
+    # 奥の敵に減っていないダメージで当たる
+    assert list(zip(shooter.tolist(), hit.tolist())) == [(0, 0), (0, 1), (1, 1)]
+    assert damage == pytest.approx([10, 10 * (1 - PIERCE_DAMAGE_DECAY), 10])
+    assert enemies.hp[:2].tolist() == pytest.approx([0, 100 - 18])
+    assert projectiles.pierce[:2].tolist() == [0, 1]
+
+
+def test_never_hits_the_same_enemy_twice():
+    # 大きくて動かない敵の中を、何フレームもかけて通り抜ける
+    enemies = EnemyStore()
+    enemies.spawn(10, 0, 1000, 0, 40, 1, 0)
+    projectiles = ProjectileStore()
+    fire_right(projectiles, 2, pierce_level=5)
+    hits = sum(len(step(projectiles, enemies)[1]) for _ in range(30))
+    assert hits == 1
+    assert enemies.hp[0] == 990
+    assert projectiles.pierce[0] == 5
+
+
+def test_hit_keys_survive_compact_and_state_round_trip():
+    enemies = EnemyStore()
+    enemies.spawn(10, 0, 1000, 0, 40, 1, 0)
+    projectiles = ProjectileStore()
+    fire_right(projectiles, 2, pierce_level=5, life=3) # すぐ消える弾
+    fire_right(projectiles, 2, pierce_level=5) # 残る弾
+    for _ in range(6):
+        step(projectiles, enemies)
+    projectiles.compact()
+    # 消えた弾の記録は捨て、残った弾の記録だけ残る
+    assert projectiles.count == 1
+    assert (projectiles.hit_keys >> 32).tolist() == [int(projectiles.ids[0])]
+
+    restored = ProjectileStore()
+    restored.load_state(projectiles.state())
+    hits = sum(len(step(restored, enemies)[1]) for _ in range(10))
+    assert hits == 0
+    assert np.array_equal(restored.hit_keys, projectiles.hit_keys)
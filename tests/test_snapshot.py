@@ -0,0 +1,57 @@
+import random
+
+from main import InputState, Simulation
+from replay import state_checksum
+from snapshot import restore_snapshot, take_snapshot
+
+ABILITIES = [
+    "Summon Ghost",
+    "Piercing Shot",
+    "Auto-aim Bullet",
+    "Nova Ring",
+    "Orbit Blades",
+]
+
+
+def scripted_inputs(count, seed):
+    # 撃ちながら左右に往復し、ときどきメニューを動かして決定する入力
+    rng = random.Random(seed)
+    return [
+        InputState(
+            left=n % 200 < 100,
+            right=n % 200 >= 100,
+            up=n % 300 < 40,
+            fire=True,
+            mouse_x=rng.randint(0, 255),
+            mouse_y=rng.randint(0, 255),
+            menu_down=n % 5 == 0,
+            confirm=n % 7 == 0,
+            retry=n % 50 == 0,
+        )
+        for n in range(count)
+    ]
+
+
+def run(sim, inputs):
+    for frame_inputs in inputs:
+        sim.step(frame_inputs)
+
+
+def test_restored_simulation_matches_checksum():
+    sim = Simulation(ABILITIES, seed=5)
+    run(sim, scripted_inputs(600, 1))
+    restored = Simulation(seed=99)
+    restore_snapshot(restored, take_snapshot(sim))
+    assert state_checksum(restored) == state_checksum(sim)
+
+
+def test_restored_simulation_continues_identically():
+    sim = Simulation(ABILITIES, seed=5)
+    run(sim, scripted_inputs(600, 1))
+    restored = Simulation(seed=99)
+    restore_snapshot(restored, take_snapshot(sim))
+    inputs = scripted_inputs(600, 2)
+    run(sim, inputs)
+    run(restored, inputs)
+    assert restored.clock.frame_count == sim.clock.frame_count
+    assert state_checksum(restored) == state_checksum(sim)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from main import sweep_hit_time
+from projectiles import sweep_hit_times
+
+# 8x8 の敵が (20, 0) にいて、4x4 の弾が左から右へ動く
+
+
+def test_sweep_hits_at_entry_time():
+    # 左上 x=0 から dx=40 で、x=16 (20 - 4) に届いたときに重なり始める
+    assert sweep_hit_time(0, 2, 4, 4, 40, 0, 20, 0, 8, 8) == pytest.approx(16 / 40)
+
+
+def test_sweep_passes_through_without_tunnelling():
+    # 1フレームで敵を飛び越える速さでも当たる
+    assert sweep_hit_time(0, 2, 4, 4, 100, 0, 20, 0, 8, 8) == pytest.approx(16 / 100)
+
+
+def test_sweep_misses():
+    assert sweep_hit_time(0, 20, 4, 4, 40, 0, 20, 0, 8, 8) is None # 敵の下を通る
+    assert sweep_hit_time(0, 2, 4, 4, 10, 0, 20, 0, 8, 8) is None # 届かない
+    assert sweep_hit_time(0, 2, 4, 4, -40, 0, 20, 0, 8, 8) is None # 反対向き
+
+
+def test_sweep_starting_inside_hits_at_zero():
+    assert sweep_hit_time(22, 2, 4, 4, 40, 0, 20, 0, 8, 8) == 0.0
+
+
+def test_sweep_zero_delta_is_overlap_test():
+    assert sweep_hit_time(22, 2, 4, 4, 0, 0, 20, 0, 8, 8) == 0.0
+    assert sweep_hit_time(0, 2, 4, 4, 0, 0, 20, 0, 8, 8) is None
+    # 端が接しているだけなら重なっていない (is_colliding と同じ)
+    assert sweep_hit_time(16, 2, 4, 4, 0, 0, 20, 0, 8, 8) is None
+
+
+def test_sweep_arrays_match_scalar():
+    rng = np.random.default_rng(0)
+    n = 500
+    x, y = rng.uniform(-20, 40, (2, n))
+    dx, dy = rng.uniform(-30, 30, (2, n))
+    dx[::7] = 0 # 片方の軸だけ動かない弾も混ぜる
+    dy[::5] = 0
+    times, hit = sweep_hit_times(x, y, 4.0, dx, dy, 10.0, 10.0, 8.0)
+    for i in range(n):
+        expected = sweep_hit_time(x[i], y[i], 4, 4, dx[i], dy[i], 10, 10, 8, 8)
+        assert bool(hit[i]) == (expected is not None)
+        if expected is not None:
+            assert times[i] == pytest.approx(expected)
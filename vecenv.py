@@ -0,0 +1,415 @@
+import math
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from main import (
+    ALL_ABILITIES,
+    EXP_LEVEL_UP_MULTIPLIER,
+    GAME_STATE_GAME_OVER,
+    GAME_STATE_LEVEL_UP,
+    GAME_STATE_PLAYING,
+    SCREEN_HEIGHT,
+    SCREEN_WIDTH,
+    SIM_FPS,
+    WORLD_HEIGHT,
+    WORLD_WIDTH,
+    InputState,
+    Simulation,
+)
+from stats import STAT_MAX_HP
+
+# 自動プレイのエージェントを学習・評価するための、
+# K個のゲームを足並みをそろえて進める環境でやんす
+#   env = VectorEnv(16, seed=0)
+#   obs = env.reset()
+#   env.actions["fire"] = True  # 行動は env.actions に直接書き込んでもよい
+#   obs, rewards, terminated, truncated = env.step()
+# 観測 (特徴量と、画面を粗く区切った占有グリッド) ・報酬・終了フラグは、
+# 最初に確保した1つのバッファの中の配列に毎ステップ上書きする
+# step() が返すのは毎回同じ配列 (バッファのビュー) なので、読む側はコピーせずに
+# そのまま使える (次の step() で上書きされるので、取っておくならコピーする)
+# shared=True なら共有メモリに置くので、
+# 別のプロセスからも ObservationBuffer.attach() で読めるでやんす
+# 1ステップは各ゲームの Simulation.step() 1回 (1フレーム)。
+# 観測の書き込みは K 個分をまとめて配列で行う
+
+# 1つのゲームへの行動
+#   move_x, move_y: 移動の向き (-1, 0, 1)
+#   aim: 照準の向き (ラジアン。0が右、π/2が下)
+#   fire: 撃つかどうか
+#   ability: レベルアップの選択肢の番号 (0から。負なら選ばずに待つ)
+#     レベルアップ中でなければ無視する
+#     選ぶのもキー入力と同じで、メニューのカーソルを1ステップに1つずつ動かしてから
+#     決定する (選び終わるまで、同じ番号を渡し続ける。
+#     入力だけで状態が決まるので、リプレイにもそのまま残せる)
+ACTION_DTYPE = np.dtype(
+    [
+        ("move_x", np.int8),
+        ("move_y", np.int8),
+        ("aim", np.float32),
+        ("fire", np.bool_),
+        ("ability", np.int8),
+    ]
+)
+ABILITY_WAIT = -1
+
+AIM_DISTANCE = 64 # 照準の向きから作るマウスカーソルの、プレイヤーからの距離
+
+# 特徴量 (features[k, i] が FEATURE_NAMES[i])。
+# 座標は画面やワールドの大きさで割って0..1くらいにする
+FEATURE_NAMES = (
+    "player_x", # ワールドの中の位置 (0..1)
+    "player_y",
+    "hp",
+    "max_hp",
+    "level",
+    "exp_ratio", # 次のレベルまでの経験値の割合
+    "phase",
+    "seconds", # ランの経過時間 (秒)
+    "invincible",
+    "level_up", # レベルアップの選択中なら1
+    "enemies", # 動いている (休眠していない) 敵の数
+    "has_target", # 動いている敵がいれば1
+    "target_dx", # 最も近い敵への向き (画面の幅で割る)
+    "target_dy",
+    # レベルアップの選択肢のアビリティ番号 (ALL_ABILITIES の添字、なければ-1)
+    "offered_0",
+    "offered_1",
+    "offered_2",
+    # この後にアビリティごとの取得レベル (ability_0, ability_1, ...)
+) + tuple(f"ability_{i}" for i in range(len(ALL_ABILITIES)))
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+NUM_FEATURES = len(FEATURE_NAMES)
+NUM_OFFERED = 3
+FIRST_ABILITY_FEATURE = FEATURE_INDEX["ability_0"]
+
+# 占有グリッドのチャンネル。カメラに映る範囲を grid_size 四方に区切り、
+# セルごとの数を数える (255で頭打ち)
+GRID_ENEMIES = 0
+GRID_SHOTS = 1 # 弾・追尾弾・弾幕の弾
+GRID_ORBS = 2
+GRID_GHOSTS = 3
+GRID_CHANNELS = 4
+DEFAULT_GRID_SIZE = 32 # 256ピクセル四方の画面なら1セル8ピクセル
+
+# 報酬 = 拾った経験値 * XP_REWARD + プレイ中のフレーム数 * SURVIVAL_REWARD
+XP_REWARD = 1.0
+SURVIVAL_REWARD = 0.01
+DEFAULT_MAX_STEPS = SIM_FPS * 60 * 15 # これだけ進めたら打ち切る (truncated)
+
+BUFFER_ALIGN = 64
+
+
+class ObservationBuffer:
+    # 1つのバッファを、観測・報酬・終了フラグの配列に切り分けたもの
+    #   features   (K, NUM_FEATURES) float32
+    #   grids      (K, GRID_CHANNELS, grid_size, grid_size) uint8
+    #   rewards    (K,) float32
+    #   terminated (K,) bool  ゲームオーバーになった
+    #   truncated  (K,) bool  max_steps に達して打ち切った
+    # buffer を省略したら自分で確保する
+    def __init__(self, num_envs, grid_size=DEFAULT_GRID_SIZE, buffer=None):
+        self.num_envs = num_envs
+        self.grid_size = grid_size
+        if buffer is None:
+            buffer = bytearray(self.nbytes(num_envs, grid_size))
+        self.buffer = buffer
+        for name, offset, shape, dtype in self.layout(num_envs, grid_size):
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(self, name, array)
+
+    @staticmethod
+    def layout(num_envs, grid_size):
+        # [(名前, オフセット, 形, 型)]
+        # (それぞれの配列の先頭を BUFFER_ALIGN バイトにそろえる)
+        arrays = (
+            ("features", (num_envs, NUM_FEATURES), np.float32),
+            ("grids", (num_envs, GRID_CHANNELS, grid_size, grid_size), np.uint8),
+            ("rewards", (num_envs,), np.float32),
+            ("terminated", (num_envs,), np.bool_),
+            ("truncated", (num_envs,), np.bool_),
+        )
+        layout = []
+        offset = 0
+        for name, shape, dtype in arrays:
+            layout.append((name, offset, shape, dtype))
+            size = math.prod(shape) * np.dtype(dtype).itemsize
+            offset += -(-size // BUFFER_ALIGN) * BUFFER_ALIGN
+        return layout
+
+    @classmethod
+    def nbytes(cls, num_envs, grid_size=DEFAULT_GRID_SIZE):
+        name, offset, shape, dtype = cls.layout(num_envs, grid_size)[-1]
+        return offset + math.prod(shape) * np.dtype(dtype).itemsize
+
+    @classmethod
+    def attach(cls, name, num_envs, grid_size=DEFAULT_GRID_SIZE):
+        # 別のプロセスで、VectorEnv(shared=True) の共有メモリ
+        # (env.shared_memory.name) を開く
+        # 返した ObservationBuffer の shared_memory は、
+        # 使い終わったら close() するでやんす
+        memory = shared_memory.SharedMemory(name=name)
+        observations = cls(num_envs, grid_size, memory.buf)
+        observations.shared_memory = memory
+        return observations
+
+    def observation(self):
+        # step() / reset() が返す観測 (毎回同じ配列)
+        return {"features": self.features, "grids": self.grids}
+
+
+class VectorEnv:
+    # num_envs 個の Simulation をまとめて進める
+    # seed: エピソードごとのシードを決める乱数のシード
+    # (同じなら同じ行動で同じ展開になる)
+    # ゲームオーバーか打ち切りで終わったゲームは、次の step() で新しいエピソードを始める
+    # (そのゲームの行動は無視し、報酬0・終了フラグなしで始めの観測を返す)
+    def __init__(
+        self,
+        num_envs,
+        seed=None,
+        debug_abilities=(),
+        grid_size=DEFAULT_GRID_SIZE,
+        max_steps=DEFAULT_MAX_STEPS,
+        shared=False,
+    ):
+        self.num_envs = num_envs
+        self.debug_abilities = list(debug_abilities)
+        self.grid_size = grid_size
+        self.max_steps = max_steps
+        self.rng = random.Random(seed)
+        self.shared_memory = None
+        buffer = None
+        if shared:
+            self.shared_memory = shared_memory.SharedMemory(
+                create=True, size=ObservationBuffer.nbytes(num_envs, grid_size)
+            )
+            buffer = self.shared_memory.buf
+        self.buffers = ObservationBuffer(num_envs, grid_size, buffer)
+        self.actions = np.zeros(num_envs, dtype=ACTION_DTYPE)
+        self.actions["ability"] = ABILITY_WAIT
+        self.sims = [None] * num_envs
+        # エピソードの中で進めたステップ数
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.needs_reset = np.zeros(num_envs, dtype=np.bool_)
+        self.episodes = 0 # これまでに始めたエピソードの数
+        # 報酬の計算用に、
+        # 前のステップの経験値・レベル・次のレベルまでの経験値を覚えておく
+        self.last_exp = [0] * num_envs
+        self.last_level = [0] * num_envs
+        self.last_exp_to_next = [0] * num_envs
+
+    def reset(self, seed=None):
+        # 全部のゲームで新しいエピソードを始め、観測を返す
+        if seed is not None:
+            self.rng = random.Random(seed)
+        for k in range(self.num_envs):
+            self.reset_env(k)
+        self.buffers.rewards[:] = 0
+        self.buffers.terminated[:] = False
+        self.buffers.truncated[:] = False
+        self.write_observations()
+        return self.buffers.observation()
+
+    def reset_env(self, k):
+        sim = Simulation(self.debug_abilities, seed=self.rng.randrange(2**63))
+        self.sims[k] = sim
+        self.steps[k] = 0
+        self.needs_reset[k] = False
+        self.episodes += 1
+        self.remember_exp(k, sim)
+
+    def remember_exp(self, k, sim):
+        self.last_exp[k] = sim.player_exp
+        self.last_level[k] = sim.player_level
+        self.last_exp_to_next[k] = sim.exp_to_next_level
+
+    def gained_exp(self, k, sim):
+        # 前のステップから拾った経験値 (レベルアップで使った分も足し戻す)
+        gained = sim.player_exp - self.last_exp[k]
+        exp_to_next = self.last_exp_to_next[k]
+        for _ in range(sim.player_level - self.last_level[k]):
+            gained += exp_to_next
+            exp_to_next = int(exp_to_next * EXP_LEVEL_UP_MULTIPLIER)
+        return gained
+
+    def step(self, actions=None):
+        # 全部のゲームを1フレーム進め、(観測, 報酬, terminated, truncated) を返す
+        # actions を省略したら self.actions を使う
+        # (ACTION_DTYPE の配列か、同じ名前の列を持つもの)
+        if actions is None:
+            actions = self.actions
+        buffers = self.buffers
+        rewards = buffers.rewards
+        terminated = buffers.terminated
+        truncated = buffers.truncated
+        move_x = np.sign(actions["move_x"]).tolist()
+        move_y = np.sign(actions["move_y"]).tolist()
+        aim = actions["aim"].tolist()
+        fire = actions["fire"].tolist()
+        ability = actions["ability"].tolist()
+        for k, sim in enumerate(self.sims):
+            if self.needs_reset[k]:
+                self.reset_env(k)
+                rewards[k] = 0
+                terminated[k] = False
+                truncated[k] = False
+                continue
+            playing = sim.game_state == GAME_STATE_PLAYING
+            sim.step(
+                self.make_inputs(sim, move_x[k], move_y[k], aim[k], fire[k], ability[k])
+            )
+            self.steps[k] += 1
+            reward = self.gained_exp(k, sim) * XP_REWARD
+            if playing:
+                reward += SURVIVAL_REWARD
+            self.remember_exp(k, sim)
+            rewards[k] = reward
+            terminated[k] = sim.game_state == GAME_STATE_GAME_OVER
+            truncated[k] = not terminated[k] and self.steps[k] >= self.max_steps
+            self.needs_reset[k] = terminated[k] or truncated[k]
+        self.write_observations()
+        return buffers.observation(), rewards, terminated, truncated
+
+    def make_inputs(self, sim, move_x, move_y, aim, fire, ability):
+        # 行動を InputState にする。照準は、プレイヤーから aim の向きに
+        # AIM_DISTANCE 離れたところにマウスカーソルを置いたことにする
+        # (Simulation.aim_direction() の逆)
+        inputs = InputState(
+            left=move_x < 0,
+            right=move_x > 0,
+            up=move_y < 0,
+            down=move_y > 0,
+            fire=fire,
+            mouse_x=sim.player_x - sim.camera.x + math.cos(aim) * AIM_DISTANCE,
+            mouse_y=sim.player_y - sim.camera.y + math.sin(aim) * AIM_DISTANCE,
+        )
+        if sim.game_state == GAME_STATE_LEVEL_UP and 0 <= ability < len(
+            sim.selected_abilities_for_level_up
+        ):
+            # 選ぶ番号までカーソルを動かしてから決定する
+            # (balance.TurretBot.menu_inputs() と同じ)
+            selected = sim.current_ability_selection_index
+            if ability < selected:
+                inputs.menu_up = True
+            elif ability > selected:
+                inputs.menu_down = True
+            else:
+                inputs.confirm = True
+        return inputs
+
+    def write_observations(self):
+        features = self.buffers.features
+        ability_index = {ability.name: i for i, ability in enumerate(ALL_ABILITIES)}
+        for k, sim in enumerate(self.sims):
+            row = features[k]
+            row[:] = 0
+            center_x = sim.player_x + sim.player_width / 2
+            center_y = sim.player_y + sim.player_height / 2
+            row[0] = sim.player_x / WORLD_WIDTH
+            row[1] = sim.player_y / WORLD_HEIGHT
+            row[2] = sim.player_hp
+            row[3] = sim.stats.get(STAT_MAX_HP)
+            row[4] = sim.player_level
+            row[5] = sim.player_exp / sim.exp_to_next_level
+            row[6] = sim.current_phase
+            row[7] = sim.clock.frame_count / SIM_FPS
+            row[8] = sim.is_invincible
+            row[9] = sim.game_state == GAME_STATE_LEVEL_UP
+            enemies = sim.enemies
+            n = enemies.count
+            awake = enemies.active[:n]
+            row[10] = np.count_nonzero(awake)
+            if row[10] > 0:
+                # 敵の中心までの距離で一番近い敵
+                # (空間インデックスはフレームの途中で詰めた後なので使わない)
+                half = enemies.size[:n] / 2
+                dx = enemies.x[:n] + half - center_x
+                dy = enemies.y[:n] + half - center_y
+                dist = np.where(awake, dx * dx + dy * dy, np.inf)
+                i = int(np.argmin(dist))
+                row[11] = 1
+                row[12] = dx[i] / SCREEN_WIDTH
+                row[13] = dy[i] / SCREEN_HEIGHT
+            offered = [
+                ability_index[a.name] for a in sim.selected_abilities_for_level_up
+            ]
+            offered += [-1] * (NUM_OFFERED - len(offered))
+            row[14 : 14 + NUM_OFFERED] = offered[:NUM_OFFERED]
+            for name, level in sim.acquired_ability_levels.items():
+                row[FIRST_ABILITY_FEATURE + ability_index[name]] = level
+        self.write_grids()
+
+    def write_grids(self):
+        # 全部のゲームのエンティティの中心を1つの配列に集め、
+        # (ゲーム, チャンネル, セル) の番号にして bincount 1回で数える
+        # (ゲームの数が増えても、Python で回すのはエンティティを集めるところだけ)
+        g = self.grid_size
+        cell_w = SCREEN_WIDTH / g
+        cell_h = SCREEN_HEIGHT / g
+        xs = []
+        ys = []
+        slots = [] # (ゲーム * GRID_CHANNELS + チャンネル)
+        for k, sim in enumerate(self.sims):
+            if (
+                sim.game_state != GAME_STATE_PLAYING
+                and sim.game_state != GAME_STATE_LEVEL_UP
+            ):
+                continue # ゲームオーバーの画面には何も映さない
+            camera = sim.camera
+            groups = []
+            enemies = sim.enemies
+            n = enemies.count
+            awake = enemies.active[:n]
+            half = enemies.size[:n][awake] / 2
+            groups.append(
+                (GRID_ENEMIES, enemies.x[:n][awake] + half, enemies.y[:n][awake] + half)
+            )
+            projectiles = sim.projectiles
+            n = projectiles.count
+            shown = projectiles.active[:n] & (projectiles.delay[:n] == 0)
+            half = projectiles.size[:n][shown] / 2
+            groups.append(
+                (
+                    GRID_SHOTS,
+                    projectiles.x[:n][shown] + half,
+                    projectiles.y[:n][shown] + half,
+                )
+            )
+            for kind, objects in (
+                (GRID_SHOTS, sim.bullets + sim.homing_bullets),
+                (GRID_ORBS, sim.exp_orbs),
+                (GRID_GHOSTS, sim.ghosts),
+            ):
+                groups.append(
+                    (
+                        kind,
+                        np.array([o.x + o.width / 2 for o in objects if o.is_active]),
+                        np.array([o.y + o.height / 2 for o in objects if o.is_active]),
+                    )
+                )
+            for kind, x, y in groups:
+                if len(x) == 0:
+                    continue
+                xs.append(x - camera.x)
+                ys.append(y - camera.y)
+                slots.append(np.full(len(x), k * GRID_CHANNELS + kind, dtype=np.int64))
+        counts = np.zeros(self.num_envs * GRID_CHANNELS * g * g, dtype=np.int64)
+        if xs:
+            cx = np.floor(np.concatenate(xs) / cell_w).astype(np.int64)
+            cy = np.floor(np.concatenate(ys) / cell_h).astype(np.int64)
+            inside = (cx >= 0) & (cx < g) & (cy >= 0) & (cy < g)
+            cells = (np.concatenate(slots) * g + cy) * g + cx
+            counts = np.bincount(cells[inside], minlength=len(counts))
+        np.minimum(counts, 255, out=counts)
+        self.buffers.grids.reshape(-1)[:] = counts
+
+    def close(self):
+        # 共有メモリを使っていたら解放する (ビューの配列はもう使えなくなる)
+        if self.shared_memory is not None:
+            self.buffers = None
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+            self.shared_memory = None
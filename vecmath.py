@@ -0,0 +1,79 @@
+import math
+
+import numpy as np
+
+# 角度を経由せずに向き (単位ベクトル) のまま計算するための小さな数学カーネルでやんす
+# atan2 で角度にして cos/sin で戻す、という往復をしないで済むようにする
+# 1体ずつ使うスカラー版と、同じ計算を配列でまとめて行う NumPy 版
+# (名前の末尾が _arrays) がある
+
+
+def normalize(x, y):
+    # (x, y) と同じ向きの単位ベクトル (長さ0なら (0, 0))
+    length = math.hypot(x, y)
+    if length == 0:
+        return 0.0, 0.0
+    return x / length, y / length
+
+
+def normalize_arrays(xs, ys):
+    lengths = np.hypot(xs, ys)
+    valid = lengths > 0
+    ux = np.divide(xs, lengths, out=np.zeros_like(lengths), where=valid)
+    uy = np.divide(ys, lengths, out=np.zeros_like(lengths), where=valid)
+    return ux, uy
+
+
+def step_towards(x, y, target_x, target_y, speed):
+    # (x, y) から (target_x, target_y) へ speed だけ進んだ位置 (目標を通り越さない)
+    dx = target_x - x
+    dy = target_y - y
+    dist = math.hypot(dx, dy)
+    if dist <= speed:
+        return target_x, target_y
+    scale = speed / dist
+    return x + dx * scale, y + dy * scale
+
+
+def turn_limit(max_radians):
+    # turn_towards() に渡す、1回に回せる最大の角度の (cos, sin)
+    return math.cos(max_radians), math.sin(max_radians)
+
+
+def turn_towards(vx, vy, tx, ty, speed, max_cos, max_sin):
+    # 速度 (vx, vy) を (tx, ty) の向きへ最大 turn_limit() の角度だけ回し、
+    # 長さを speed にして返す
+    # 残りの角度がそれ以下なら (tx, ty) の向きにぴったり合わせる
+    # 回す向き (時計回りか反時計回りか) は外積の符号で決める
+    v_len = math.hypot(vx, vy)
+    t_len = math.hypot(tx, ty)
+    if v_len == 0 or t_len == 0:
+        return vx, vy
+    if vx * tx + vy * ty >= max_cos * v_len * t_len:
+        scale = speed / t_len
+        return tx * scale, ty * scale
+    scale = speed / v_len
+    if vx * ty - vy * tx < 0:
+        max_sin = -max_sin
+    return (vx * max_cos - vy * max_sin) * scale, (vx * max_sin + vy * max_cos) * scale
+
+
+class SinCosTable:
+    # 1周を size 等分した sin/cos の表
+    # (角度がどうしても必要なところで、三角関数の代わりに引く)
+    # 角度は一番近い目盛りに丸めるので、誤差は最大で pi / size ラジアン
+    # 配列でまとめて引くと np.cos/np.sin より速い (1個ずつなら math.cos/math.sin を使う)
+    def __init__(self, size=4096):
+        self.size = size
+        self.scale = size / (2 * math.pi) # ラジアン -> 目盛り
+        angles = np.arange(size) / self.scale
+        self.cos = np.cos(angles)
+        self.sin = np.sin(angles)
+
+    def lookup_arrays(self, radians):
+        # 向き radians (配列) の単位ベクトル (cos, sin)
+        i = np.floor(radians * self.scale + 0.5).astype(np.int64) % self.size
+        return self.cos[i], self.sin[i]
+
+
+SIN_COS = SinCosTable()
@@ -0,0 +1,129 @@
+import math
+
+import numpy as np
+
+# 画面より広いワールドを映すカメラと、
+# ワールドを正方形のチャンクに区切った休眠の管理でやんす
+
+# 休眠中の敵1体分のレコード
+# (active は常に真なので持たない。色は pyxel の16色なので1バイト)
+DORMANT_ENEMY_DTYPE = np.dtype(
+    [
+        ("x", np.float64),
+        ("y", np.float64),
+        ("hp", np.float64),
+        ("speed", np.float64),
+        ("size", np.float64),
+        ("phase", np.int32),
+        ("color", np.uint8),
+        ("ids", np.int64),
+    ]
+)
+
+
+class Camera:
+    # プレイヤーを画面の中央に映すカメラ (ワールドの端では止まる)
+    # 左上のワールド座標 (x, y) は整数にする
+    # (描画した物がカメラの動きで1ピクセル揺れないように)
+    def __init__(self, view_width, view_height, world_width, world_height):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.x = 0
+        self.y = 0
+
+    def follow(self, x, y):
+        # (x, y) が画面の中央に来るように動かす
+        self.x = min(
+            max(round(x - self.view_width / 2), 0), self.world_width - self.view_width
+        )
+        self.y = min(
+            max(round(y - self.view_height / 2), 0),
+            self.world_height - self.view_height,
+        )
+
+
+class ChunkMap:
+    # ワールドを chunk_size 四方のチャンクに区切り、
+    # カメラに映る範囲の周り margin チャンクまでを動いているチャンクとする
+    # それより外 (さらに1チャンクの余裕をもたせる) に出た敵は休眠させ、
+    # チャンクごとに DORMANT_ENEMY_DTYPE の配列にまとめて持っておく
+    # 休眠中の敵は動かず、衝突判定にも描画にも出てこない。チャンクが動き出したら元に戻す
+    def __init__(self, chunk_size, margin=1):
+        self.chunk_size = chunk_size
+        self.margin = margin
+        # 動いているチャンクの範囲 (cx0, cy0, cx1, cy1、両端を含む)
+        self.active = (0, 0, -1, -1)
+        self.dormant = {} # {(cx, cy): 休眠中の敵の配列}
+        self.dormant_count = 0
+
+    def update(self, camera, enemies):
+        # カメラの位置から動いているチャンクを決め直し、敵を起こしたり眠らせたりする
+        cs = self.chunk_size
+        margin = self.margin
+        self.active = (
+            math.floor(camera.x / cs) - margin,
+            math.floor(camera.y / cs) - margin,
+            math.floor((camera.x + camera.view_width - 1) / cs) + margin,
+            math.floor((camera.y + camera.view_height - 1) / cs) + margin,
+        )
+        self.wake(enemies)
+        self.sleep(enemies)
+
+    def wake(self, enemies):
+        cx0, cy0, cx1, cy1 = self.active
+        woken = [
+            key
+            for key in self.dormant
+            if cx0 <= key[0] <= cx1 and cy0 <= key[1] <= cy1
+        ]
+        for key in woken:
+            records = self.dormant.pop(key)
+            self.dormant_count -= len(records)
+            enemies.insert({name: records[name] for name in DORMANT_ENEMY_DTYPE.names})
+
+    def sleep(self, enemies):
+        # 動いているチャンクから1チャンク以上離れた敵を眠らせる
+        # (境目をまたいで行き来する敵が、毎フレーム起きたり眠ったりしないように)
+        n = enemies.count
+        if n == 0:
+            return
+        cs = self.chunk_size
+        cx0, cy0, cx1, cy1 = self.active
+        cx = np.floor(enemies.x[:n] / cs).astype(np.int64)
+        cy = np.floor(enemies.y[:n] / cs).astype(np.int64)
+        far = (cx < cx0 - 1) | (cx > cx1 + 1) | (cy < cy0 - 1) | (cy > cy1 + 1)
+        far &= enemies.active[:n]
+        if not far.any():
+            return
+        cx = cx[far]
+        cy = cy[far]
+        columns = enemies.extract(far)
+        records = np.empty(len(cx), dtype=DORMANT_ENEMY_DTYPE)
+        for name in DORMANT_ENEMY_DTYPE.names:
+            records[name] = columns[name]
+        # チャンクごとに分けて、既に眠っている敵の後ろに足す
+        keys = cy * (1 << 32) + cx
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        records = records[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            key = (int(cx[order[start]]), int(cy[order[start]]))
+            group = records[start:end]
+            old = self.dormant.get(key)
+            self.dormant[key] = group if old is None else np.concatenate((old, group))
+        self.dormant_count += len(records)
+
+    def state(self):
+        # スナップショット用 ({チャンク: レコードのバイト列})
+        return {key: records.tobytes() for key, records in self.dormant.items()}
+
+    def load_state(self, state):
+        self.dormant = {
+            key: np.frombuffer(data, dtype=DORMANT_ENEMY_DTYPE).copy()
+            for key, data in state.items()
+        }
+        self.dormant_count = sum(len(records) for records in self.dormant.values())